@@ -1,16 +1,53 @@
 import streamlit as st
 import os
-from PIL import Image
+from PIL import Image, ImageDraw, ImageOps, features
 import pandas as pd
-from datetime import datetime
+import io
 import json
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import hashlib
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import annotation_core as core
+from annotation_core import (
+    CLASSES_DISPONIBLES,
+    SAVE_FOLDER,
+    JOURNAL_COMPACT_EVERY,
+    AnnotationStats,
+    CatalogueCache,
+    catalogue_diff,
+    get_absolute_path,
+    get_dataset_folder,
+    get_shards_folder,
+    refresh_directory_index,
+    empty_response,
+    migrate_legacy_responses,
+    prune_empty_responses,
+    get_save_filepath,
+    get_journal_filepath,
+    load_progress,
+)
+from annotation_store import STORE_FILE, AnnotationStore
+from duplicates import find_duplicate_groups
+from instrumentation import METRICS_FILE, PROFILER
+from materialize import materialize_dataset
+from shards import export_shards
+from prelabel import PredictionStore, contradicts_folder, predict_pairs, review_order
+from integrity import check_integrity, load_report
+from similarity import SIMILAR_COUNT, SimilarityIndex
+from watcher import WatcherRegistry
+from notifications import (
+    OUTBOX_FOLDER,
+    NotificationOutbox,
+    completion_message,
+    make_transport,
+)
+
 # Configuration de la page
 st.set_page_config(
     page_title="Annotation Images bbox/crop",
@@ -20,273 +57,520 @@ st.set_page_config(
 
 # ==================== CONFIGURATION ====================
 
-CLASSES_DISPONIBLES = ["fissure_degradee", "fissure_significative", "joint_ouvert", "faiencage"]
+# Cache des rendus d'affichage (miniatures WebP/JPEG) pour les images bbox/crop
+RENDITION_FOLDER = SAVE_FOLDER / "cache_rendus"
+DISPLAY_MAX_SIZE = 1024
+RENDITION_MEMORY_BYTES = 64 * 1024 * 1024
+RENDITION_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+
+# Préchargement en arrière-plan des paires suivantes (et de la précédente)
+PREFETCH_AHEAD = 5
+PREFETCH_WORKERS = 4
+PREFETCH_MEMORY_BYTES = 16 * 1024 * 1024
+
+# Nombre de lignes affichées par page dans le résumé de fin
+SUMMARY_PAGE_SIZE = 100
 
-# CORRECTION MAJEURE: Utiliser un chemin absolu pour les sauvegardes
-# Cela garantit que les sauvegardes sont toujours au même endroit
-SCRIPT_DIR = Path(__file__).parent.absolute() if '__file__' in globals() else Path.cwd()
-SAVE_FOLDER = SCRIPT_DIR / "sauvegardes_annotations_images"
+# Vue grille: planche (atlas) des crops d'une page, encodée en une seule image
+GRID_COLUMNS = 8
+GRID_PAGE_SIZE = 48
+GRID_TILE_SIZE = 160
 
-IMAGES_SUFFIXES = ["_bbox", "_crop"]
+# Mode rapide: touches du clavier -> préfixe du libellé du bouton à cliquer
+FAST_MODE_KEYS = {str(i): f"{i} ·" for i in range(1, len(CLASSES_DISPONIBLES) + 1)}
+FAST_MODE_KEYS.update({"0": "0 ·", "x": "0 ·", "Enter": "⏎", "Backspace": "⌫"})
 
-# Configuration email
-SMTP_CONFIG = {
-    "server": "smtp.gmail.com",
-    "port": 587,
-    "sender": "maamatou.houda@gmail.com",
-    "password": "fziq atni xvlb ynwl",
-    "receiver": "houda.maamatou@logiroad-center.com"
+# Rafraîchissement du compteur de nouvelles paires (surveillance du dossier)
+WATCH_REFRESH_SECONDS = 5
+
+# Traitement des quasi-doublons d'une image validée
+DUPLICATE_POLICIES = {
+    "aucune": "Aucun (tout annoter)",
+    "propager": "Propager le label au groupe",
+    "sauter": "Sauter les autres images du groupe",
 }
 
+# Exécutions affichées dans le panneau de profilage
+PROFILE_PANEL_RUNS = 20
+# Lignes du détail du rapport d'intégrité dans la barre latérale
+INTEGRITY_PANEL_ROWS = 50
+
 # ==================== FONCTIONS UTILITAIRES ====================
+# Le scan, la persistance et l'export sont dans annotation_core (sans Streamlit);
+# les fonctions ci-dessous les relient à st.session_state.
 
-def get_absolute_path(path_str):
-    """Convertit un chemin en chemin absolu"""
-    path = Path(path_str).expanduser()
-    if not path.is_absolute():
-        path = Path.cwd() / path
-    return path.resolve()
+@st.cache_resource
+def get_catalogue_cache():
+    """Catalogues de paires partagés par toutes les sessions du serveur (un par dossier racine)"""
+    return CatalogueCache()
 
 def scan_images_directory(root_dir):
     """
     Scanne le dossier racine et récupère toutes les paires d'images bbox/crop
-    Retourne une liste de dictionnaires avec les informations des images
+    Retourne le catalogue partagé des paires (vide en cas d'erreur); le scan
+    n'a lieu que si le dossier a changé depuis le dernier catalogue construit.
     """
-    images_data = []
-    
-    # CORRECTION: Convertir en chemin absolu
-    root_path = get_absolute_path(root_dir)
-    
-    if not root_path.exists():
-        st.error(f"❌ Le dossier '{root_path}' n'existe pas!")
-        return images_data
-    
-    # Parcourir tous les sous-dossiers
-    for subdir in sorted(os.listdir(root_path)):
-        subdir_path = root_path / subdir
-        
-        if not subdir_path.is_dir():
-            continue
-        
-        # Récupérer toutes les images du sous-dossier
-        image_files = [f for f in os.listdir(subdir_path) 
-                      if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        
-        # Grouper les images par nom de base (sans _bbox/_crop)
-        image_groups = {}
-        for img_file in image_files:
-            # Trouver le nom de base
-            base_name = img_file
-            for suffix in IMAGES_SUFFIXES:
-                if suffix in base_name:
-                    base_name = base_name.split(suffix)[0]
-                    break
-            
-            if base_name not in image_groups:
-                image_groups[base_name] = {}
-            
-            # Déterminer le type (bbox ou crop)
-            if "_bbox" in img_file:
-                image_groups[base_name]["bbox"] = img_file
-            elif "_crop" in img_file:
-                image_groups[base_name]["crop"] = img_file
-        
-        # Créer les entrées pour les paires complètes
-        for base_name, files in image_groups.items():
-            if "bbox" in files and "crop" in files:
-                images_data.append({
-                    "base_name": base_name,
-                    "folder": subdir,
-                    "label_initial": subdir,
-                    "bbox_file": files["bbox"],
-                    "crop_file": files["crop"],
-                    "bbox_path": str(subdir_path / files["bbox"]),
-                    "crop_path": str(subdir_path / files["crop"])
-                })
-    
-    return images_data
+    try:
+        with PROFILER.stage("scan"):
+            return get_catalogue_cache().get(root_dir)
+    except FileNotFoundError as e:
+        st.error(f"❌ {e}")
+        return []
+
+@st.cache_resource
+def get_store():
+    """Base d'annotations partagée par toutes les sessions du serveur"""
+    return AnnotationStore(STORE_FILE)
+
+@st.cache_resource
+def get_watchers():
+    """Surveillances de dossiers partagées par toutes les sessions (une par dossier racine)"""
+    return WatcherRegistry()
+
+def get_watcher(images_data):
+    """Surveillance du dossier du catalogue; celle du dossier précédent de la session est libérée"""
+    return get_watchers().acquire(st.session_state.profile_session, images_data)
+
+def release_watcher():
+    """La session cesse de surveiller son dossier (arrêté si aucune autre session ne le suit)"""
+    get_watchers().release(st.session_state.profile_session)
 
 def initialize_session(images_data):
-    """Initialise les réponses pour toutes les images"""
+    """
+    Initialise les réponses de la session
+    Les réponses existantes sont conservées (fusion par clé stable); seules les
+    images modifiées ont une réponse, les autres sont lues via get_response.
+    """
     if "responses" not in st.session_state:
         st.session_state.responses = {}
     
-    for i, img_data in enumerate(images_data):
-        if i not in st.session_state.responses:
-            st.session_state.responses[i] = {
-                "label_choisi": None,
-                "commentaire": "",
-                "annotated": False,
-                "ignored": False
-            }
-
-def get_save_filepath(annotator_name):
-    """Génère le chemin du fichier de sauvegarde"""
-    # CORRECTION: Créer le dossier s'il n'existe pas
-    SAVE_FOLDER.mkdir(parents=True, exist_ok=True)
-    
-    safe_name = "".join(c for c in annotator_name if c.isalnum() or c in (' ', '_')).strip()
-    safe_name = safe_name.replace(' ', '_')
-    
-    filepath = SAVE_FOLDER / f"sauvegarde_{safe_name}.json"
-    return filepath
+    st.session_state.responses = prune_empty_responses(st.session_state.responses)
+    # Seule reconstruction complète des compteurs: ensuite mis à jour par update_response
+    st.session_state.stats = AnnotationStats.from_responses(images_data, st.session_state.responses)
 
-def save_progress(images_data):
-    """Sauvegarde la progression actuelle"""
-    if not st.session_state.annotator_name:
+def get_response(key):
+    """Réponse d'une image (vierge si l'image n'a pas encore été modifiée)"""
+    return st.session_state.responses.get(key) or empty_response()
+
+def relocate_current_index(images_data, current_key, fallback_index):
+    """Retrouve la position de l'image courante après un rechargement"""
+    position = images_data.position(current_key)
+    if position is not None:
+        return position
+    return min(fallback_index, len(images_data))
+
+def append_journal(images_data, record):
+    """
+    Ajoute une modification au journal (une ligne JSON, coût constant)
+    Sans instantané préalable, ou si le journal est trop long, on compacte.
+    """
+    annotator_name = st.session_state.annotator_name
+    if not annotator_name:
         return False, "Nom d'annotateur manquant"
-    
-    # CORRECTION: Sauvegarder le chemin absolu du dossier
-    save_data = {
-        "annotateur": st.session_state.annotator_name,
-        "root_directory": st.session_state.root_directory,
-        "root_directory_absolute": str(get_absolute_path(st.session_state.root_directory)),
-        "date_sauvegarde": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "current_index": st.session_state.current_index,
-        "responses": st.session_state.responses,
-        "total_images": len(images_data),
-        "version": "2.0"
-    }
-    
-    filepath = get_save_filepath(st.session_state.annotator_name)
+
+    if (not get_save_filepath(annotator_name).exists()
+            or st.session_state.journal_length >= JOURNAL_COMPACT_EVERY):
+        return save_progress(images_data)
+
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(save_data, f, ensure_ascii=False, indent=2)
-        return True, f"✅ Sauvegarde réussie dans {filepath}"
+        with PROFILER.stage("journal"):
+            core.append_journal_line(annotator_name, record)
+        PROFILER.count("lignes_journal")
+        st.session_state.journal_length += 1
+
+        # Base partagée: une ligne par changement, visible des autres sessions
+        store = get_store()
+        if "k" in record:
+            store.record_responses(
+                st.session_state.root_directory, annotator_name,
+                {record["k"]: st.session_state.responses[record["k"]]}
+            )
+        if "i" in record:
+            store.record_position(annotator_name, record["i"], record["ck"])
+        return True, "✅ Modification journalisée"
     except Exception as e:
         return False, f"❌ Erreur: {str(e)}"
 
-def load_progress(annotator_name):
-    """Charge une sauvegarde existante"""
-    filepath = get_save_filepath(annotator_name)
+def update_response(images_data, key, **fields):
+    """Modifie la réponse d'une image et journalise le changement si besoin"""
+    response = st.session_state.responses.setdefault(key, empty_response())
+    changes = {k: v for k, v in fields.items() if response.get(k) != v}
+    if not changes:
+        return False
+
+    before = dict(response)
+    response.update(changes)
+    position = images_data.position(key)
+    if position is not None:
+        st.session_state.stats.record_change(images_data.folder_of(position), before, response)
+    if st.session_state.auto_save_enabled:
+        append_journal(images_data, {"k": key, "f": changes})
+    elif st.session_state.dispatch_mode:
+        # Sans sauvegarde auto, la base partagée doit quand même savoir la paire traitée
+        get_store().record_responses(st.session_state.root_directory, st.session_state.annotator_name,
+                                     {key: response})
+    return True
+
+def is_skipped(key):
+    """Vrai si la navigation saute la paire (quasi-doublon déjà traité ou paire invalide)"""
+    return key in st.session_state.duplicate_skip or key in (st.session_state.invalid_pairs or {})
+
+def invalid_parts(key):
+    """Problèmes d'intégrité de la paire: {partie: message} (bbox, crop ou paire)"""
+    return dict((st.session_state.invalid_pairs or {}).get(key, ()))
+
+def load_integrity_report(images_data, check=False):
+    """
+    Paires invalides du dossier (dernier rapport enregistré, ou vérification complète si check)
+    Si la paire courante est invalide, passe à la suivante; retourne True si la position a changé.
+    """
+    if check:
+        report = check_integrity(images_data)
+    else:
+        report = load_report(st.session_state.root_directory)
+    st.session_state.integrity_report = report
+    st.session_state.invalid_pairs = report["invalides"] if report else {}
+    current_key = current_image_key(images_data)
+    if current_key is None or current_key not in st.session_state.invalid_pairs:
+        return False
+    st.session_state.current_index = next_position(images_data)
+    return True
+
+def take_dispatched(images_data):
+    """
+    Position de la prochaine paire distribuée (mode équipe)
+    Un nouveau lot est demandé quand le lot courant est épuisé; les paires
+    déjà traitées localement sont signalées à la base puis sautées.
+    Retourne len(images_data) quand il ne reste plus rien à distribuer.
+    """
+    store = get_store()
+    while True:
+        queue = st.session_state.dispatch_queue
+        already_done = {}
+        while queue:
+            key = queue.pop(0)
+            response = st.session_state.responses.get(key, {})
+            if response.get("annotated", False) or response.get("ignored", False):
+                already_done[key] = response
+            elif images_data.position(key) is not None and not is_skipped(key):
+                if already_done:
+                    store.record_responses(st.session_state.root_directory,
+                                           st.session_state.annotator_name, already_done)
+                return images_data.position(key)
+        if already_done:
+            store.record_responses(st.session_state.root_directory,
+                                   st.session_state.annotator_name, already_done)
+        st.session_state.dispatch_queue = store.lease_batch(
+            st.session_state.root_directory, st.session_state.annotator_name
+        )
+        if not st.session_state.dispatch_queue:
+            return len(images_data)
+
+def prediction_hint(img_data):
+    """
+    Indication du modèle pour une paire (None sans prédiction)
+    La prédiction n'est qu'affichée: le label proposé reste celui du dossier.
+    """
+    prediction = (st.session_state.predictions or {}).get(img_data["key"])
+    if prediction is None:
+        return None
+    hint = (f"🤖 Prédiction: {prediction['predicted']} ({prediction['confidence']:.0%}) · "
+            f"label du dossier douteux à {prediction['label_wrong']:.0%}")
+    if contradicts_folder(prediction, img_data["label_initial"]):
+        hint = f"⚠️ {hint}"
+    return hint
+
+def choose_label(images_data, img_key):
+    """Rappel du choix de label: seule une action de l'annotateur marque la paire comme annotée"""
+    update_response(images_data, img_key, label_choisi=st.session_state[f"label_{img_key}"],
+                    annotated=True, ignored=False)
+
+def load_predictions(images_data, compute=False):
+    """Prédictions du dossier (dernière pré-annotation enregistrée, ou calculée si compute)"""
+    if compute:
+        st.session_state.predictions = predict_pairs(images_data, st.session_state.responses)
+    else:
+        st.session_state.predictions = PredictionStore().load_predictions(st.session_state.root_directory)
+    if st.session_state.review_order is not None:
+        set_review_order(images_data)
+
+def set_review_order(images_data):
+    """
+    Ordre de revue par incertitude (positions et rang de chaque position, tableaux compacts)
+    L'image courante est placée en tête: la revue part de là où l'on est.
+    """
+    order = review_order(images_data, st.session_state.predictions, st.session_state.responses)
+    idx = st.session_state.current_index
+    if idx < len(images_data) and not is_skipped(images_data.key_of(idx)):
+        order.remove(idx)
+        order.insert(0, idx)
+    rank = array('I', bytes(4 * len(order)))
+    for r, position in enumerate(order):
+        rank[position] = r
+    st.session_state.review_order = array('I', order)
+    st.session_state.review_rank = rank
+
+def review_start(images_data):
+    """
+    Position de départ de la revue: l'image courante (en tête de l'ordre) si elle
+    n'est pas sautée, sinon la première image à traiter dans l'ordre de revue
+    """
+    idx = st.session_state.current_index
+    if idx < len(images_data) and not is_skipped(images_data.key_of(idx)):
+        return idx
+    for position in st.session_state.review_order:
+        key = images_data.key_of(position)
+        response = st.session_state.responses.get(key, {})
+        if not (response.get("annotated", False) or response.get("ignored", False) or is_skipped(key)):
+            return position
+    return len(images_data)
+
+def is_first_position(idx):
+    """Vrai si aucune image ne précède idx dans l'ordre de navigation"""
+    if st.session_state.dispatch_mode:
+        return not st.session_state.dispatch_history
+    if st.session_state.review_order is not None:
+        return idx >= len(st.session_state.review_order) or st.session_state.review_rank[idx] == 0
+    return idx == 0
+
+def is_last_position(idx):
+    """Vrai si aucune image ne suit idx dans l'ordre de navigation (jamais en mode équipe)"""
+    if st.session_state.dispatch_mode:
+        return False
+    order = st.session_state.review_order
+    if order is not None:
+        return idx >= len(order) or st.session_state.review_rank[idx] == len(order) - 1
+    return idx >= len(st.session_state.images_data) - 1
+
+def next_position(images_data):
+    """Position suivante: image suivante (ou suivante dans l'ordre de revue), ou prochaine paire distribuée en mode équipe"""
+    if not st.session_state.dispatch_mode:
+        order = st.session_state.review_order
+        if order is not None:
+            rank = st.session_state.review_rank[st.session_state.current_index] + 1
+            while rank < len(order) and is_skipped(images_data.key_of(order[rank])):
+                rank += 1
+            return order[rank] if rank < len(order) else len(images_data)
+        position = st.session_state.current_index + 1
+        while position < len(images_data) and is_skipped(images_data.key_of(position)):
+            position += 1
+        return position
+    st.session_state.dispatch_history.append(st.session_state.current_index)
+    return take_dispatched(images_data)
+
+def previous_position(images_data):
+    """Position précédente (en mode équipe: dernière paire vue, la courante retourne au lot)"""
+    if not st.session_state.dispatch_mode:
+        order = st.session_state.review_order
+        if order is not None:
+            idx = st.session_state.current_index
+            return order[-1] if idx >= len(order) else order[st.session_state.review_rank[idx] - 1]
+        return st.session_state.current_index - 1
+    current_key = current_image_key(images_data)
+    if current_key is not None:
+        st.session_state.dispatch_queue.insert(0, current_key)
+    return st.session_state.dispatch_history.pop()
+
+def detect_duplicates(images_data):
+    """Calcule les groupes de quasi-doublons (empreintes en cache) -> {clé: clés du groupe}"""
+    groups = {}
+    for keys in find_duplicate_groups(images_data):
+        for key in keys:
+            groups[key] = keys
+    st.session_state.duplicate_groups = groups
+    st.session_state.duplicate_skip = set()
+    return len(set(map(tuple, groups.values())))
+
+def apply_duplicate_policy(images_data, key):
+    """
+    Applique la décision prise sur une image à ses quasi-doublons non traités
+    "propager" recopie le label (ou l'exclusion); "sauter" les laisse non traités.
+    Dans les deux cas, ces images ne sont plus proposées à la navigation.
+    """
+    policy = st.session_state.duplicate_policy
+    if policy == "aucune":
+        return 0
+    response = get_response(key)
+    count = 0
+    for other in st.session_state.duplicate_groups.get(key, ()):
+        other_response = st.session_state.responses.get(other, {})
+        if other == key or other_response.get("annotated", False) or other_response.get("ignored", False):
+            continue
+        if policy == "propager":
+            update_response(images_data, other,
+                            label_choisi=response["label_choisi"],
+                            annotated=response["annotated"],
+                            ignored=response["ignored"],
+                            commentaire=other_response.get("commentaire") or f"Quasi-doublon de {key}")
+        st.session_state.duplicate_skip.add(other)
+        count += 1
+    return count
+
+def switch_catalogue(images_data, new_images_data):
+    """Passe la session sur un catalogue mis à jour en gardant l'image courante"""
+    current_key = current_image_key(images_data)
+
+    # Mettre à jour la liste des images
+    st.session_state.images_data = new_images_data
     
-    if not filepath.exists():
-        return None, "Aucune sauvegarde trouvée"
+    # Fusionner les réponses: les annotations suivent leur image, pas leur position
+    initialize_session(new_images_data)
+    # Les groupes de quasi-doublons sont à recalculer sur la nouvelle liste
+    st.session_state.duplicate_groups = {}
+    st.session_state.duplicate_skip = set()
+    # L'ordre de revue porte sur les positions: à reconstruire
+    if st.session_state.review_order is not None:
+        set_review_order(new_images_data)
+    if st.session_state.dispatch_mode:
+        get_store().sync_dispatch(st.session_state.root_directory)
+    st.session_state.current_index = relocate_current_index(
+        new_images_data, current_key, st.session_state.current_index
+    )
+
+@st.fragment(run_every=WATCH_REFRESH_SECONDS)
+def watch_panel():
+    """Compteur des paires apparues/disparues depuis le catalogue de la session (sans rescan)"""
+    images_data = st.session_state.images_data
+    watcher = get_watcher(images_data)
+    status = watcher.status(images_data)
+    if status is None:
+        st.info("ℹ️ Le catalogue a été mis à jour par une autre session")
+        added = removed = None
+    else:
+        added, removed, halves = status
+        st.caption(f"👁️ Surveillance ({watcher.mode}) - {halves} paire(s) incomplète(s) en attente")
+        if added:
+            st.success(f"🆕 {added} nouvelle(s) paire(s)")
+        if removed:
+            st.warning(f"🗑️ {removed} paire(s) supprimée(s)")
+    if status is not None and (added or removed):
+        if st.button("➕ Intégrer les changements", width='stretch'):
+            new_images_data = watcher.apply()
+            get_catalogue_cache().put(new_images_data)
+            if st.session_state.dispatch_mode:
+                # La distribution lit l'index des dossiers: le mettre à jour (dossiers modifiés seulement)
+                refresh_directory_index(st.session_state.root_directory)
+            switch_catalogue(images_data, new_images_data)
+            st.rerun()
+
+def record_position(images_data):
+    """Journalise la position courante après une navigation"""
+    if st.session_state.auto_save_enabled:
+        append_journal(images_data, {
+            "i": st.session_state.current_index,
+            "ck": current_image_key(images_data)
+        })
+
+def save_progress(images_data):
+    """Sauvegarde la progression actuelle (instantané complet + remise à zéro du journal)"""
+    if not st.session_state.annotator_name:
+        return False, "Nom d'annotateur manquant"
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            save_data = json.load(f)
-        
-        # Convertir les clés en int
-        if 'responses' in save_data:
-            save_data['responses'] = {
-                int(k): v for k, v in save_data['responses'].items()
-            }
-        
-        # CORRECTION: Utiliser le chemin absolu si disponible
-        if 'root_directory_absolute' in save_data:
-            save_data['root_directory'] = save_data['root_directory_absolute']
-        
-        return save_data, "✅ Sauvegarde chargée"
+        with PROFILER.stage("sauvegarde"):
+            filepath = core.write_snapshot(
+                st.session_state.annotator_name,
+                st.session_state.root_directory,
+                st.session_state.responses,
+                st.session_state.current_index,
+                current_image_key(images_data),
+                len(images_data)
+            )
+        PROFILER.count("sauvegardes_ecrites")
+        st.session_state.journal_length = 0
+
+        store = get_store()
+        store.record_responses(
+            st.session_state.root_directory, st.session_state.annotator_name, st.session_state.responses
+        )
+        store.record_session(
+            st.session_state.annotator_name,
+            st.session_state.root_directory,
+            st.session_state.current_index,
+            current_image_key(images_data),
+            len(images_data),
+            filepath
+        )
+        return True, f"✅ Sauvegarde réussie dans {filepath}"
     except Exception as e:
-        return None, f"❌ Erreur: {str(e)}"
+        return False, f"❌ Erreur: {str(e)}"
 
 def list_saved_sessions():
-    """Liste toutes les sessions sauvegardées"""
-    # CORRECTION: Créer le dossier s'il n'existe pas
-    SAVE_FOLDER.mkdir(parents=True, exist_ok=True)
-    
-    saves = []
-    for filepath in SAVE_FOLDER.glob("sauvegarde_*.json"):
-																			 
-														  
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                # Utiliser le chemin absolu si disponible
-                root_dir = data.get('root_directory_absolute', data.get('root_directory', ''))
-                
-                saves.append({
-                    'annotateur': data.get('annotateur', 'Inconnu'),
-                    'date': data.get('date_sauvegarde', 'Inconnue'),
-                    'progression': f"{data.get('current_index', 0)}/{data.get('total_images', 0)}",
-                    'filename': filepath.name,
-                    'root_directory': root_dir,
-                    'filepath': str(filepath)
-                })
-        except Exception as e:
-            st.warning(f"⚠️ Impossible de lire {filepath.name}: {e}")
-            continue
-    
-    # Trier par date (plus récent en premier)
-    saves.sort(key=lambda x: x['date'], reverse=True)
-    return saves
+    """Liste toutes les sessions sauvegardées (requête sur la base partagée)"""
+    store = get_store()
+    with PROFILER.stage("sessions"):
+        store.sync_save_files(
+            on_error=lambda filepath, e: st.warning(f"⚠️ Impossible de lire {filepath.name}: {e}")
+        )
+        return store.list_sessions()
 
 def export_to_csv(images_data):
-    """Exporte les annotations au format CSV"""
-    results = []
-    for i, img_data in enumerate(images_data):
-        response = st.session_state.responses.get(i, {})
-        ignored = response.get("ignored", False)
-        label = response.get("label_choisi", "")
-        
-        results.append({
-            "image_bbox": img_data["bbox_file"],
-            "image_crop": img_data["crop_file"],
-            "dossier_source": img_data["folder"],
-            "label_initial": img_data["label_initial"],
-            "label_choisi": "IGNORÉ" if ignored else label,
-            "statut": "Ignoré" if ignored else ("Annoté" if response.get("annotated", False) else "Non annoté"),
-            "commentaire": response.get("commentaire", ""),
-            "annotated": response.get("annotated", False)
-        })
-    
-    df = pd.DataFrame(results)
-    return df.to_csv(index=False).encode('utf-8')
+    """Exporte les annotations dans un fichier CSV de EXPORT_FOLDER (écriture en flux)"""
+    return core.export_annotations(
+        images_data,
+        st.session_state.responses,
+        core.get_export_filepath(st.session_state.annotator_name, "csv")
+    )
 
-def send_completion_email(annotator_name, images_data, csv_content):
-    """Envoie un email de notification de fin d'annotation"""
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_CONFIG["sender"]
-        msg['To'] = SMTP_CONFIG["receiver"]
-        msg['Subject'] = f"✅ Annotation terminée - {annotator_name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-        
-        completed = sum(1 for r in st.session_state.responses.values() if r.get("annotated", False))
-        ignored = sum(1 for r in st.session_state.responses.values() if r.get("ignored", False))
-        
-        body = f"""
-Bonjour,
+def materialize_session(images_data):
+    """Nouvelle version du jeu de données matérialisé de l'annotateur (seuls les fichiers modifiés sont lus)"""
+    errors = []
+    dataset_path = get_dataset_folder(st.session_state.annotator_name)
+    counts = materialize_dataset(
+        images_data, st.session_state.responses, dataset_path,
+        root_directory=str(get_absolute_path(st.session_state.root_directory)),
+        on_error=lambda relative, e: errors.append(f"{relative}: {e}")
+    )
+    return dataset_path, counts, errors
 
-L'annotateur {annotator_name} a terminé l'annotation des images.
+def export_to_shards(images_data, fmt="tar"):
+    """Exporte les paires annotées en shards d'entraînement dans EXPORT_FOLDER"""
+    output_dir = get_shards_folder(st.session_state.annotator_name, fmt)
+    index = export_shards(images_data, st.session_state.responses, output_dir, fmt)
+    return output_dir, index
 
-📊 Statistiques:
-- Total d'images: {len(images_data)}
-- Images annotées: {completed}
-- Images ignorées: {ignored}
-- Date de fin: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-- Dossier source: {st.session_state.root_directory}
+def summary_page(images_data, page):
+    """Lignes du résumé de fin pour une page de SUMMARY_PAGE_SIZE images"""
+    start = page * SUMMARY_PAGE_SIZE
+    page_images = images_data[start:start + SUMMARY_PAGE_SIZE]
+    return pd.DataFrame([
+        {
+            "Image": row["image_bbox"],
+            "Dossier": row["dossier_source"],
+            "Label initial": row["label_initial"],
+            "Label choisi": row["label_choisi"] or "Non annoté",
+            "Statut": {"Ignoré": "❌ Ignoré", "Annoté": "✅ Annoté"}.get(row["statut"], "⏳ Non annoté")
+        }
+        for row in core.export_rows(page_images, st.session_state.responses)
+    ])
 
-Les résultats détaillés sont disponibles en pièce jointe au format CSV.
+@st.cache_resource
+def get_outbox():
+    """Boîte d'envoi des notifications et son thread de remise, partagés par le serveur (None si désactivées)"""
+    transport = make_transport()
+    if transport is None:
+        return None
+    outbox = NotificationOutbox(OUTBOX_FOLDER, transport)
+    outbox.start()
+    return outbox
 
-Cordialement,
-Système d'annotation automatique
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Ajouter le CSV en pièce jointe
-        csv_attachment = MIMEBase('application', 'octet-stream')
-        csv_attachment.set_payload(csv_content)
-        encoders.encode_base64(csv_attachment)
-        csv_attachment.add_header(
-            'Content-Disposition',
-            f'attachment; filename=annotations_{annotator_name}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        )
-        msg.attach(csv_attachment)
-        
-        # Envoyer l'email
-        server = smtplib.SMTP(SMTP_CONFIG["server"], SMTP_CONFIG["port"])
-        server.starttls()
-        server.login(SMTP_CONFIG["sender"], SMTP_CONFIG["password"])
-        server.send_message(msg)
-        server.quit()
-        
-        return True, "📧 Email envoyé avec succès!"
-    
-    except Exception as e:
-        return False, f"❌ Erreur d'envoi email: {str(e)}"
+def queue_completion_email(annotator_name, images_data, export_path):
+    """Met en file l'email de fin d'annotation (remis en arrière-plan, avec reprises)"""
+    outbox = get_outbox()
+    if outbox is None:
+        return None, "ℹ️ Notifications désactivées (ANNOTATION_SMTP_RECEIVER non défini)"
+    try:
+        outbox.enqueue(completion_message(
+            annotator_name,
+            st.session_state.root_directory,
+            len(images_data),
+            count_completed_annotations(images_data),
+            count_ignored_images(images_data),
+            export_path
+        ))
+        return True, "📧 Notification mise en file d'envoi"
+    except OSError as e:
+        return False, f"❌ Erreur de mise en file de la notification: {str(e)}"
 
 def reset_session():
     """Réinitialise la session"""
@@ -296,14 +580,582 @@ def reset_session():
     st.session_state.started = False
     st.session_state.responses = {}
     st.session_state.images_data = []
+    st.session_state.stats = AnnotationStats()
+    st.session_state.journal_length = 0
+    st.session_state.export_path = None
+    st.session_state.completion_message = None
+    st.session_state.dispatch_mode = False
+    st.session_state.dispatch_queue = []
+    st.session_state.dispatch_history = []
+    st.session_state.duplicate_groups = {}
+    st.session_state.duplicate_skip = set()
+    st.session_state.predictions = None
+    st.session_state.review_order = None
+    st.session_state.review_rank = None
+    st.session_state.invalid_pairs = None
+    st.session_state.integrity_report = None
+    st.session_state.watch_enabled = False
+    release_watcher()
+    st.session_state.fast_mode = False
+    st.session_state.grid_mode = False
+    st.session_state.pace = {"normal": empty_pace(), "rapide": empty_pace(), "grille": empty_pace()}
+
+def current_image_key(images_data):
+    """Clé stable de l'image courante (None si l'annotation est terminée)"""
+    idx = st.session_state.current_index
+    return images_data.key_of(idx) if idx < len(images_data) else None
+
+def count_completed_annotations(images_data):
+    """Nombre d'annotations réellement effectuées (compteur tenu à jour, temps constant)"""
+    return st.session_state.stats.annotated
+
+def count_ignored_images(images_data):
+    """Nombre d'images ignorées (compteur tenu à jour, temps constant)"""
+    return st.session_state.stats.ignored
+
+class RenditionCache:
+    """
+    Cache LRU (en mémoire, borné en octets) des rendus d'affichage encodés
+    Chaque rendu est aussi conservé sur disque sous RENDITION_FOLDER.
+    La clé combine chemin + mtime + taille cible: un fichier modifié est ré-encodé.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def _put(self, key, data):
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = data
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        extension = "webp" if RENDITION_FORMAT == "WEBP" else "jpg"
+        return self.folder / digest[:2] / f"{digest}.{extension}"
+
+    def get(self, path, max_size=DISPLAY_MAX_SIZE):
+        """Retourne les octets encodés du rendu de `path` (côté max `max_size`)"""
+        stat = os.stat(path)
+        key = f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{max_size}"
+        return self._cached(key, lambda: encode_rendition(path, max_size))
+
+    def get_atlas(self, paths, tile_size=GRID_TILE_SIZE, columns=GRID_COLUMNS):
+        """Retourne la planche encodée des images `paths` (une tuile numérotée par image)"""
+        parts = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                parts.append(f"{path}|{stat.st_mtime_ns}|{stat.st_size}")
+            except OSError:
+                parts.append(f"{path}|absent")
+        digest = hashlib.sha1("\n".join(parts).encode('utf-8')).hexdigest()
+        key = f"atlas|{digest}|{tile_size}|{columns}"
+        return self._cached(key, lambda: encode_atlas(paths, tile_size, columns))
+
+    def _cached(self, key, encode):
+        data = self._get(key)
+        if data is not None:
+            PROFILER.count("rendus_cache_memoire")
+            return data
+
+        disk_path = self._disk_path(key)
+        try:
+            data = disk_path.read_bytes()
+            PROFILER.count("rendus_cache_disque")
+        except OSError:
+            with PROFILER.stage("encodage_rendus"):
+                data = encode()
+            PROFILER.count("rendus_encodes")
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = disk_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, disk_path)
+
+        self._put(key, data)
+        return data
+
+def count_decoded(path):
+    """Compteurs de décodage d'une image source (la taille n'est lue que si le profilage est actif)"""
+    if PROFILER.active():
+        PROFILER.count("images_decodees")
+        PROFILER.count("octets_lus", os.path.getsize(path))
+
+def encode_rendition(path, max_size):
+    """Réduit une image à `max_size` pixels de côté et l'encode pour le navigateur"""
+    count_decoded(path)
+    with Image.open(path) as img:
+        img.thumbnail((max_size, max_size))
+        if RENDITION_FORMAT == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA")
+        buffer = io.BytesIO()
+        img.save(buffer, format=RENDITION_FORMAT, quality=85)
+    return buffer.getvalue()
+
+def _atlas_tile(path, tile_size):
+    try:
+        count_decoded(path)
+        with Image.open(path) as img:
+            img.draft("RGB", (tile_size, tile_size))
+            # Les crops sont souvent plus petits que la tuile: agrandis aussi
+            return ImageOps.contain(img.convert("RGB"), (tile_size, tile_size))
+    except (OSError, ValueError):
+        # Image absente ou illisible: tuile vide
+        return None
+
+def encode_atlas(paths, tile_size, columns):
+    """Assemble les miniatures de `paths` en une grille numérotée (décodage en parallèle)"""
+    rows = max(1, -(-len(paths) // columns))
+    atlas = Image.new("RGB", (columns * tile_size, rows * tile_size), (40, 40, 40))
+    draw = ImageDraw.Draw(atlas)
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="atlas") as executor:
+        tiles = list(executor.map(lambda path: _atlas_tile(path, tile_size), paths))
+    for i, tile in enumerate(tiles):
+        x, y = (i % columns) * tile_size, (i // columns) * tile_size
+        if tile is None:
+            draw.text((x + tile_size // 2, y + tile_size // 2), "?", fill=(200, 200, 200))
+        else:
+            atlas.paste(tile, (x + (tile_size - tile.width) // 2, y + (tile_size - tile.height) // 2))
+        # Numéro de la tuile (celui des cases de sélection)
+        draw.rectangle((x, y, x + 28, y + 16), fill=(0, 0, 0))
+        draw.text((x + 4, y + 2), str(i + 1), fill=(255, 255, 255))
+        draw.rectangle((x, y, x + tile_size - 1, y + tile_size - 1), outline=(90, 90, 90))
+    buffer = io.BytesIO()
+    atlas.save(buffer, format=RENDITION_FORMAT, quality=80)
+    return buffer.getvalue()
+
+@st.cache_resource
+def get_rendition_cache():
+    """Cache des rendus partagé par toutes les sessions du serveur"""
+    return RenditionCache(RENDITION_FOLDER, RENDITION_MEMORY_BYTES)
 
-def count_completed_annotations():
-    """Compte le nombre d'annotations réellement effectuées"""
-    return sum(1 for r in st.session_state.responses.values() if r.get("annotated", False))
+class RenditionPrefetcher:
+    """
+    Précharge les rendus d'une fenêtre d'images dans le RenditionCache
+    Chaque session a sa propre fenêtre: une nouvelle fenêtre annule le travail
+    en attente de la précédente, et le volume préchargé est borné en octets.
+    """
+
+    def __init__(self, cache, max_workers, max_bytes):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def schedule(self, owner, paths):
+        """Remplace la fenêtre de préchargement de `owner` par `paths`"""
+        with self._lock:
+            previous = self._windows.get(owner)
+            if previous is not None:
+                if previous["paths"] == paths:
+                    return
+                previous["cancelled"] = True
+                for future in previous["futures"]:
+                    future.cancel()
+
+            window = {"paths": paths, "cancelled": False, "bytes": 0, "futures": []}
+            window["futures"] = [
+                self._executor.submit(self._prefetch, window, path) for path in paths
+            ]
+            self._windows[owner] = window
+
+    def _prefetch(self, window, path):
+        if window["cancelled"] or window["bytes"] >= self.max_bytes:
+            return
+        try:
+            window["bytes"] += len(self.cache.get(path))
+        except (OSError, ValueError):
+            # Image absente ou illisible: l'erreur sera affichée au rendu
+            pass
+
+@st.cache_resource
+def get_prefetcher():
+    """Pool de préchargement partagé par toutes les sessions du serveur"""
+    return RenditionPrefetcher(get_rendition_cache(), PREFETCH_WORKERS, PREFETCH_MEMORY_BYTES)
+
+def prefetch_around(images_data, idx):
+    """Planifie le préchargement des paires suivantes et de la précédente"""
+    if st.session_state.dispatch_mode:
+        positions = (images_data.position(k) for k in st.session_state.dispatch_queue[:PREFETCH_AHEAD])
+        neighbours = [i for i in positions if i is not None]
+        neighbours.extend(st.session_state.dispatch_history[-1:])
+    else:
+        neighbours = list(range(idx + 1, min(idx + 1 + PREFETCH_AHEAD, len(images_data))))
+        if idx > 0:
+            neighbours.append(idx - 1)
+
+    paths = []
+    for i in neighbours:
+        paths.append(images_data[i]["crop_path"])
+        paths.append(images_data[i]["bbox_path"])
+    get_prefetcher().schedule(st.session_state.session_id, tuple(paths))
+
+# ==================== MODE RAPIDE ====================
+
+def empty_pace():
+    """Cadence d'un mode: annotations, temps CPU serveur et horodatages"""
+    return {"annotations": 0, "cpu": 0.0, "first": None, "last": None}
+
+def begin_cpu_accounting(mode, kind="script"):
+    """
+    Début d'une exécution (script complet ou fragment seul) pour la mesure CPU
+    Une exécution interrompue par st.rerun reprend dans le même thread: son
+    temps CPU est alors compté jusqu'au début de la suivante.
+    """
+    PROFILER.begin_run(st.session_state.profile_session, f"{kind} {mode}", st.session_state.profiling)
+    now = time.thread_time()
+    ident = threading.get_ident()
+    open_run = st.session_state.open_run
+    if open_run is not None and open_run[0] == ident and now >= open_run[1]:
+        st.session_state.pace[open_run[2]]["cpu"] += now - open_run[1]
+    st.session_state.open_run = (ident, now, mode, kind)
+
+def end_cpu_accounting():
+    """Fin normale d'une exécution: temps CPU du thread depuis begin_cpu_accounting"""
+    open_run = st.session_state.open_run
+    if open_run is not None and open_run[0] == threading.get_ident():
+        st.session_state.pace[open_run[2]]["cpu"] += time.thread_time() - open_run[1]
+    st.session_state.open_run = None
+    PROFILER.end_run()
+
+def begin_fragment_accounting(mode):
+    """
+    Mesure CPU d'un fragment réexécuté seul (le script complet se mesure lui-même)
+    Retourne True si le fragment s'exécute seul.
+    """
+    open_run = st.session_state.open_run
+    standalone = open_run is None or open_run[3] == "fragment"
+    if standalone:
+        begin_cpu_accounting(mode, "fragment")
+    return standalone
+
+def count_annotation(mode):
+    """Compte une image validée dans le mode courant"""
+    pace = st.session_state.pace[mode]
+    now = time.time()
+    pace["annotations"] += 1
+    pace["first"] = pace["first"] or now
+    pace["last"] = now
+
+def pace_summary(mode):
+    """(annotations/min, ms CPU/annotation) d'un mode, None si pas assez de mesures"""
+    pace = st.session_state.pace[mode]
+    if pace["annotations"] < 2 or pace["last"] <= pace["first"]:
+        return None
+    per_minute = (pace["annotations"] - 1) * 60 / (pace["last"] - pace["first"])
+    return per_minute, pace["cpu"] * 1000 / pace["annotations"]
+
+def keyboard_bridge(active=True):
+    """
+    Relie les touches de FAST_MODE_KEYS aux boutons du mode rapide
+    L'écouteur est posé une fois sur la page (fonction gardée sur le document)
+    et retiré par keyboard_bridge(False) dès qu'une autre vue est affichée.
+    """
+    if active:
+        script = f"""
+        <script>
+        const doc = window.parent.document;
+        const keys = {json.dumps(FAST_MODE_KEYS, ensure_ascii=False)};
+        if (!doc.__annotationKeys) {{
+            doc.__annotationKeys = (event) => {{
+                const tag = (event.target.tagName || "").toLowerCase();
+                if (tag === "input" || tag === "textarea" || event.ctrlKey || event.metaKey || event.altKey) return;
+                const prefix = keys[event.key];
+                if (!prefix) return;
+                const button = Array.from(doc.querySelectorAll("button"))
+                    .find((b) => b.innerText.trim().startsWith(prefix));
+                if (button && !button.disabled) {{
+                    event.preventDefault();
+                    button.click();
+                }}
+            }};
+            doc.addEventListener("keydown", doc.__annotationKeys);
+        }}
+        </script>
+        """
+    else:
+        script = """
+        <script>
+        const doc = window.parent.document;
+        if (doc.__annotationKeys) {
+            doc.removeEventListener("keydown", doc.__annotationKeys);
+            delete doc.__annotationKeys;
+        }
+        </script>
+        """
+    st.session_state.keyboard_bridge = active
+    if hasattr(st, "iframe"):
+        st.iframe(script, height=1)
+    else:
+        # Streamlit < 1.52
+        import streamlit.components.v1 as components
+        components.html(script, height=0)
+
+@st.fragment
+def fast_annotation_panel():
+    """
+    Annotation au clavier: un chiffre choisit le label et passe à l'image suivante,
+    0/x ignore, Entrée valide le label proposé, Retour arrière revient en arrière.
+    Seul ce fragment est réexécuté d'une image à l'autre.
+    """
+    standalone = begin_fragment_accounting("rapide")
+
+    images_data = st.session_state.images_data
+    idx = st.session_state.current_index
+    if idx >= len(images_data):
+        # Fin: écran de résumé (script complet)
+        st.rerun()
+
+    img_data = images_data[idx]
+    img_key = img_data["key"]
+    response = get_response(img_key)
+    suggested = response["label_choisi"] or img_data["label_initial"]
+
+    st.progress(idx / len(images_data))
+    if response.get("ignored", False):
+        status = "❌ Ignorée"
+    elif response.get("annotated", False):
+        status = f"✅ {response['label_choisi']}"
+    else:
+        status = "⏳ Non annotée"
+    st.markdown(f"### ⚡ Image {idx + 1} / {len(images_data)} — 📁 {img_data['folder']} — {status}")
+    hint = prediction_hint(img_data)
+    if hint is not None:
+        st.caption(hint)
+
+    problems = invalid_parts(img_key)
+    col1, col2 = st.columns(2)
+    for column, part, path in ((col1, "bbox", img_data["bbox_path"]), (col2, "crop", img_data["crop_path"])):
+        with column:
+            if part in problems:
+                st.error(f"❌ Image {part} invalide: {problems[part]}")
+            elif os.path.exists(path):
+                st.image(get_rendition_cache().get(path), width='stretch')
+            else:
+                st.error("❌ Image non trouvée")
+    prefetch_around(images_data, idx)
+
+    action = None
+    columns = st.columns(len(CLASSES_DISPONIBLES) + 1)
+    for i, (column, label) in enumerate(zip(columns, CLASSES_DISPONIBLES), 1):
+        with column:
+            if st.button(f"{i} · {label}", key=f"fast_{label}", width='stretch',
+                         type="primary" if label == suggested else "secondary"):
+                action = {"label_choisi": label, "annotated": True, "ignored": False}
+    with columns[-1]:
+        if st.button("0 · Ignorer", key="fast_ignore", width='stretch'):
+            action = {"ignored": True, "label_choisi": None, "annotated": False}
+
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        at_start = is_first_position(idx)
+        if st.button("⌫ Précédent", key="fast_previous", disabled=at_start, width='stretch'):
+            st.session_state.current_index = previous_position(images_data)
+            record_position(images_data)
+            st.rerun(scope="fragment" if standalone else "app")
+    with col_next:
+        if st.button(f"⏎ Valider ({suggested if not response.get('ignored', False) else 'ignorée'})",
+                     key="fast_next", width='stretch'):
+            action = {} if response.get("ignored", False) else {"label_choisi": suggested, "annotated": True}
+
+    if action is not None:
+        update_response(images_data, img_key, **action)
+        apply_duplicate_policy(images_data, img_key)
+        count_annotation("rapide")
+        st.session_state.current_index = next_position(images_data)
+        record_position(images_data)
+        st.rerun(scope="fragment" if standalone else "app")
+
+    st.caption("⌨️ 1-4: label et image suivante · 0 ou x: ignorer · Entrée: valider · Retour arrière: précédent")
+    if standalone:
+        end_cpu_accounting()
+
+def profiling_panel():
+    """Dernières exécutions de la session (ms par étape) et compteurs"""
+    runs = PROFILER.recent_runs(st.session_state.profile_session, PROFILE_PANEL_RUNS)
+    if not runs:
+        st.caption("Pas encore d'exécution mesurée")
+        return
+    rows = []
+    for run in runs:
+        row = {
+            "heure": time.strftime("%H:%M:%S", time.localtime(run["heure"])),
+            "exécution": run["execution"] + (" ⤴" if run["interrompue"] else ""),
+            "total ms": round(run["total"] * 1000, 1)
+        }
+        row.update({f"{name} ms": round(seconds * 1000, 1) for name, seconds in run["etapes"].items()})
+        row.update(run["compteurs"])
+        rows.append(row)
+    st.dataframe(pd.DataFrame(rows), hide_index=True, width='stretch')
+    st.caption(f"⤴ interrompue par un rerun · métriques Prometheus: {METRICS_FILE}")
+
+# ==================== VUE GRILLE ====================
+
+def grid_tile_label(response):
+    """Statut court d'une tuile pour les cases de sélection"""
+    if response.get("ignored", False):
+        return "❌"
+    if response.get("annotated", False):
+        return f"✅ {response['label_choisi']}"
+    return "⏳"
+
+def apply_to_tiles(images_data, selection_key, page_keys, pace_mode="grille", **fields):
+    """Applique `fields` aux tuiles sélectionnées (rappel de bouton: avant la réexécution)"""
+    selected = st.session_state.get(selection_key) or []
+    for number in selected:
+        key = page_keys[number - 1]
+        update_response(images_data, key, **fields)
+        count_annotation(pace_mode)
+    # Vider la sélection pour la suite
+    st.session_state[selection_key] = []
+
+def select_tiles(selection_key, numbers):
+    st.session_state[selection_key] = list(numbers)
+
+@st.fragment
+def grid_panel():
+    """
+    Vue grille d'un sous-dossier: seule la page affichée est décodée, sous la
+    forme d'une planche (une seule image) mise en cache; les tuiles choisies
+    reçoivent un label ou sont ignorées en une action.
+    """
+    standalone = begin_fragment_accounting("grille")
+    images_data = st.session_state.images_data
+    folders = sorted(images_data.folders())
+    if not folders:
+        st.info("ℹ️ Aucune image")
+        return
+
+    col_folder, col_filter, col_page = st.columns([2, 1, 1])
+    with col_folder:
+        folder = st.selectbox("📁 Sous-dossier", folders, key="grid_folder")
+    with col_filter:
+        pending_only = st.checkbox("⏳ Non traitées seulement", key="grid_pending_only")
+
+    records = images_data.folder_pairs(folder)
+    if pending_only:
+        records = [img for img in records
+                   if not get_response(img.key).get("annotated", False)
+                   and not get_response(img.key).get("ignored", False)]
+    page_count = max(1, -(-len(records) // GRID_PAGE_SIZE))
+    with col_page:
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1,
+                               key=f"grid_page_{folder}_{pending_only}") - 1
+    page_records = records[page * GRID_PAGE_SIZE:(page + 1) * GRID_PAGE_SIZE]
+    if not page_records:
+        st.success("🎉 Toutes les images de ce dossier sont traitées")
+        if standalone:
+            end_cpu_accounting()
+        return
+
+    page_keys = [img.key for img in page_records]
+    st.caption(f"{len(records)} images · page {page + 1}/{page_count} · label initial: {folder.split('/', 1)[0]}")
+    st.image(get_rendition_cache().get_atlas(tuple(img.crop_path for img in page_records)), width='stretch')
+
+    numbers = list(range(1, len(page_records) + 1))
+    statuses = {n: grid_tile_label(get_response(key)) for n, key in zip(numbers, page_keys)}
+    selection_key = f"grid_selection_{folder}_{pending_only}_{page}"
+    st.pills("Tuiles sélectionnées", numbers, selection_mode="multi", key=selection_key,
+             format_func=lambda n: f"{n} {statuses[n]}")
+
+    col_all, col_none, col_label, col_apply, col_ignore = st.columns([1, 1, 2, 2, 2])
+    with col_all:
+        st.button("☑️ Tout", key="grid_all", on_click=select_tiles, args=(selection_key, numbers),
+                  width='stretch')
+    with col_none:
+        st.button("⬜ Aucune", key="grid_none", on_click=select_tiles, args=(selection_key, []),
+                  width='stretch')
+    with col_label:
+        initial = folder.split("/", 1)[0]
+        label = st.selectbox("Label", CLASSES_DISPONIBLES, label_visibility="collapsed", key="grid_label",
+                             index=CLASSES_DISPONIBLES.index(initial) if initial in CLASSES_DISPONIBLES else 0)
+    with col_apply:
+        st.button("🏷️ Appliquer le label", key="grid_apply", type="primary", width='stretch',
+                  on_click=apply_to_tiles, args=(images_data, selection_key, page_keys),
+                  kwargs={"label_choisi": label, "annotated": True, "ignored": False})
+    with col_ignore:
+        st.button("❌ Ignorer", key="grid_ignore", width='stretch',
+                  on_click=apply_to_tiles, args=(images_data, selection_key, page_keys),
+                  kwargs={"ignored": True, "label_choisi": None, "annotated": False})
+
+    if standalone:
+        end_cpu_accounting()
+
+# ==================== CROPS SIMILAIRES ====================
+
+@st.cache_resource
+def get_similarity_index(root_directory):
+    """Index de similarité d'un dossier racine, partagé par les sessions du serveur"""
+    return SimilarityIndex(root_directory)
+
+@st.fragment
+def similar_panel(img_key, label):
+    """
+    Les SIMILAR_COUNT crops les plus proches de l'image courante (index
+    vectoriel mis à jour quand le catalogue change); le label courant peut
+    être appliqué aux crops sélectionnés.
+    """
+    standalone = begin_fragment_accounting("normal")
+    images_data = st.session_state.images_data
+    index = get_similarity_index(st.session_state.root_directory)
+    if st.session_state.similar_catalogue is not images_data:
+        with st.spinner("🔍 Mise à jour de l'index de similarité..."):
+            index.update(images_data)
+        st.session_state.similar_catalogue = images_data
+
+    try:
+        neighbours = [(key, score) for key, score in index.neighbours(img_key, SIMILAR_COUNT)
+                      if images_data.position(key) is not None]
+    except LookupError:
+        st.warning("⚠️ Crop illisible: pas de recherche de similarité")
+        neighbours = []
+    if not neighbours:
+        if standalone:
+            end_cpu_accounting()
+        return
+
+    keys = [key for key, _ in neighbours]
+    st.image(get_rendition_cache().get_atlas(tuple(images_data[images_data.position(key)].crop_path
+                                                   for key in keys)), width='stretch')
+    numbers = list(range(1, len(keys) + 1))
+    details = {n: f"{n} {grid_tile_label(get_response(key))} · {key.split('/', 1)[0]} · {score:.2f}"
+               for n, (key, score) in zip(numbers, neighbours)}
+    selection_key = f"similar_selection_{img_key}"
+    st.pills("Crops sélectionnés (dossier · similarité)", numbers, selection_mode="multi", key=selection_key,
+             format_func=details.get)
+
+    col_all, col_none, col_apply = st.columns([1, 1, 3])
+    with col_all:
+        st.button("☑️ Tout", key="similar_all", on_click=select_tiles, args=(selection_key, numbers),
+                  width='stretch')
+    with col_none:
+        st.button("⬜ Aucun", key="similar_none", on_click=select_tiles, args=(selection_key, []),
+                  width='stretch')
+    with col_apply:
+        st.button(f"🏷️ Appliquer « {label} » à la sélection", key="similar_apply", type="primary",
+                  width='stretch', on_click=apply_to_tiles, args=(images_data, selection_key, keys, "normal"),
+                  kwargs={"label_choisi": label, "annotated": True, "ignored": False})
 
-def count_ignored_images():
-    """Compte le nombre d'images ignorées"""
-    return sum(1 for r in st.session_state.responses.values() if r.get("ignored", False))
+    if standalone:
+        end_cpu_accounting()
 
 # ==================== INITIALISATION ====================
 
@@ -322,12 +1174,90 @@ if "started" not in st.session_state:
 if "images_data" not in st.session_state:
     st.session_state.images_data = []
 
+if "stats" not in st.session_state:
+    st.session_state.stats = AnnotationStats()
+
+if "journal_length" not in st.session_state:
+    st.session_state.journal_length = 0
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 if "auto_save_enabled" not in st.session_state:
     st.session_state.auto_save_enabled = True
 
+if "export_path" not in st.session_state:
+    st.session_state.export_path = None
+
+if "completion_message" not in st.session_state:
+    st.session_state.completion_message = None
+
+if "dispatch_mode" not in st.session_state:
+    st.session_state.dispatch_mode = False
+
+if "dispatch_queue" not in st.session_state:
+    st.session_state.dispatch_queue = []
+
+if "dispatch_history" not in st.session_state:
+    st.session_state.dispatch_history = []
+
+if "fast_mode" not in st.session_state:
+    st.session_state.fast_mode = False
+
+if "grid_mode" not in st.session_state:
+    st.session_state.grid_mode = False
+
+if "keyboard_bridge" not in st.session_state:
+    st.session_state.keyboard_bridge = False
+
+if "pace" not in st.session_state:
+    st.session_state.pace = {"normal": empty_pace(), "rapide": empty_pace(), "grille": empty_pace()}
+
+if "open_run" not in st.session_state:
+    st.session_state.open_run = None
+
+if "profile_session" not in st.session_state:
+    st.session_state.profile_session = uuid.uuid4().hex[:8]
+
+# Mesure des exécutions de cette session (ANNOTATION_PROFILAGE=1: activée par défaut)
+if "profiling" not in st.session_state:
+    st.session_state.profiling = PROFILER.enabled
+
+if "watch_enabled" not in st.session_state:
+    st.session_state.watch_enabled = False
+
+if "duplicate_groups" not in st.session_state:
+    st.session_state.duplicate_groups = {}
+
+if "duplicate_skip" not in st.session_state:
+    st.session_state.duplicate_skip = set()
+
+if "predictions" not in st.session_state:
+    st.session_state.predictions = None
+
+if "review_order" not in st.session_state:
+    st.session_state.review_order = None
+    st.session_state.review_rank = None
+
+if "invalid_pairs" not in st.session_state:
+    st.session_state.invalid_pairs = None
+    st.session_state.integrity_report = None
+
+if "similar_catalogue" not in st.session_state:
+    st.session_state.similar_catalogue = None
+
+if "duplicate_policy" not in st.session_state:
+    st.session_state.duplicate_policy = "aucune"
+
 if "show_crop_zoom" not in st.session_state:
     st.session_state.show_crop_zoom = {}
 
+# Mesure du temps CPU serveur de cette exécution (voir le panneau de cadence)
+if st.session_state.grid_mode:
+    begin_cpu_accounting("grille")
+else:
+    begin_cpu_accounting("rapide" if st.session_state.fast_mode else "normal")
+
 # ==================== CSS ====================
 
 st.markdown("""
@@ -413,6 +1343,8 @@ with st.expander("ℹ️ Informations sur les sauvegardes - IMPORTANT"):
 # ==================== ÉCRAN DE DÉMARRAGE ====================
 
 if not st.session_state.started:
+    if st.session_state.keyboard_bridge:
+        keyboard_bridge(False)
     st.markdown("""
     ### Bienvenue dans l'outil de sélection d'images
     
@@ -445,6 +1377,11 @@ if not st.session_state.started:
             st.code(f"Répertoire actuel : {Path.cwd()}")
             st.info("💡 Le chemin peut être absolu (ex: /home/user/dataset) ou relatif (ex: ./dataset)")
         
+        dispatch_mode = st.checkbox(
+            "👥 Mode équipe : recevoir des lots d'images que personne n'a encore traitées",
+            help="Les paires sont réservées par lots pour vous seul; une réservation non traitée expire et est redistribuée"
+        )
+        
         if st.button("🚀 Démarrer l'annotation", type="primary", key="start_new"):
             if not name.strip():
                 st.error("⚠️ Veuillez entrer votre nom")
@@ -478,15 +1415,18 @@ if not st.session_state.started:
                             st.session_state.images_data = images_data
                             st.session_state.current_index = 0
                             initialize_session(images_data)
+                            st.session_state.dispatch_mode = dispatch_mode
+                            if dispatch_mode:
+                                get_store().sync_dispatch(abs_path)
+                                st.session_state.current_index = take_dispatched(images_data)
                             st.session_state.started = True
                             
                             # Afficher les sous-dossiers trouvés
-                            folders = list(set(img["folder"] for img in images_data))
+                            folders = st.session_state.stats.folders
                             st.success(f"✅ {len(images_data)} paires d'images trouvées dans {len(folders)} sous-dossiers!")
                             with st.expander("📁 Sous-dossiers détectés"):
                                 for folder in sorted(folders):
-                                    count = sum(1 for img in images_data if img["folder"] == folder)
-                                    st.write(f"- {folder}: {count} paires")
+                                    st.write(f"- {folder}: {folders[folder]['total']} paires")
                             
                             st.info("💡 Si vous ajoutez des images pendant l'annotation, utilisez le bouton '🔄 Recharger les images' dans la sidebar")
                             
@@ -533,9 +1473,22 @@ if not st.session_state.started:
                                     if images_data:
                                         st.session_state.annotator_name = save_data['annotateur']
                                         st.session_state.root_directory = str(root_dir_path)
-                                        st.session_state.current_index = save_data['current_index']
-                                        st.session_state.responses = save_data['responses']
+                                        responses = save_data['responses']
+                                        if save_data['legacy_keys']:
+                                            responses = migrate_legacy_responses(responses, images_data)
+                                        st.session_state.responses = responses
+                                        st.session_state.journal_length = save_data['journal_length']
+                                        if save_data['journal_valid_bytes'] is not None:
+                                            # Les prochaines lignes suivent la dernière ligne lisible
+                                            core.truncate_journal(save_data['annotateur'],
+                                                                  save_data['journal_valid_bytes'])
                                         st.session_state.images_data = images_data
+                                        initialize_session(images_data)
+                                        st.session_state.current_index = relocate_current_index(
+                                            images_data,
+                                            save_data.get('current_key'),
+                                            save_data['current_index']
+                                        )
                                         st.session_state.started = True
                                         st.success("✅ Session chargée!")
                                         st.rerun()
@@ -554,6 +1507,7 @@ else:
     idx = st.session_state.current_index
     
     # Sidebar avec contrôles
+    PROFILER.start("barre_laterale")
     with st.sidebar:
         st.markdown("### 💾 Sauvegarde")
         st.markdown(f"**👤 Annotateur:** {st.session_state.annotator_name}")
@@ -574,56 +1528,165 @@ else:
                 # Sauvegarder d'abord
                 save_progress(images_data)
                 
-                # Recharger les images
-                new_images_data = scan_images_directory(st.session_state.root_directory)
-                
+                # Recharger les images (catalogue partagé, rescanné seulement si le dossier a changé)
+                try:
+                    new_images_data = get_catalogue_cache().get(st.session_state.root_directory)
+                    changes = catalogue_diff(images_data, new_images_data)
+                except OSError as e:
+                    st.error(f"❌ Erreur lors du rechargement: {e}")
+                    new_images_data, changes = [], {"ajoutees": [], "supprimees": []}
+
                 if new_images_data:
-                    old_count = len(images_data)
                     new_count = len(new_images_data)
+                    switch_catalogue(images_data, new_images_data)
+                    if st.session_state.watch_enabled:
+                        get_watcher(new_images_data).rebase(new_images_data)
                     
-                    # Mettre à jour la liste des images
-                    st.session_state.images_data = new_images_data
-                    
-                    # Initialiser les réponses pour les nouvelles images
-                    for i, img_data in enumerate(new_images_data):
-                        if i not in st.session_state.responses:
-                            st.session_state.responses[i] = {
-                                "label_choisi": None,
-                                "commentaire": "",
-                                "annotated": False,
-                                "ignored": False
-                            }
-                    
-                    diff = new_count - old_count
-                    if diff > 0:
-                        st.success(f"✅ {diff} nouvelles images détectées! Total: {new_count}")
-                    elif diff < 0:
-                        st.warning(f"⚠️ {abs(diff)} images supprimées. Total: {new_count}")
-                    else:
+                    added = len(changes["ajoutees"])
+                    removed = len(changes["supprimees"])
+                    if added:
+                        st.success(f"✅ {added} nouvelles paires détectées! Total: {new_count}")
+                    if removed:
+                        st.warning(f"⚠️ {removed} paires supprimées. Total: {new_count}")
+                    if not added and not removed:
                         st.info(f"ℹ️ Aucun changement. Total: {new_count}")
                     
                     st.rerun()
                 else:
                     st.error("❌ Aucune image trouvée")
         
+        st.session_state.watch_enabled = st.checkbox(
+            "👁️ Surveiller le dossier (nouvelles paires en direct)",
+            value=st.session_state.watch_enabled
+        )
+        if st.session_state.watch_enabled:
+            watch_panel()
+        else:
+            release_watcher()
+        
         st.markdown("---")
         
         auto_save = st.checkbox(
-            "Sauvegarde auto (toutes les 5 images)",
+            "Sauvegarde auto (chaque modification est journalisée)",
             value=st.session_state.auto_save_enabled
         )
         st.session_state.auto_save_enabled = auto_save
         
+        st.markdown("---")
+        st.session_state.fast_mode = st.checkbox(
+            "⚡ Mode rapide (clavier)",
+            value=st.session_state.fast_mode,
+            help="Chiffres: label + image suivante, 0/x: ignorer, Entrée: valider, Retour arrière: précédent"
+        )
+        st.session_state.grid_mode = st.checkbox(
+            "🔲 Vue grille (label par lot)",
+            value=st.session_state.grid_mode and not st.session_state.dispatch_mode,
+            disabled=st.session_state.dispatch_mode,
+            help="Indisponible en mode équipe (les paires y sont distribuées une à une)"
+        )
+        with st.expander("⏱️ Cadence"):
+            for mode in ("normal", "rapide", "grille"):
+                summary = pace_summary(mode)
+                if summary is None:
+                    st.write(f"**{mode}:** pas encore de mesure")
+                else:
+                    per_minute, cpu_ms = summary
+                    st.write(f"**{mode}:** {per_minute:.1f} annotations/min · {cpu_ms:.0f} ms CPU/annotation")
+        with st.expander("🩺 Profilage (debug)"):
+            st.session_state.profiling = st.checkbox(
+                "Mesurer les exécutions",
+                value=st.session_state.profiling,
+                help="Pour cette session; ANNOTATION_PROFILAGE=1 l'active par défaut pour toutes"
+            )
+            if st.session_state.profiling:
+                profiling_panel()
+        
+        st.markdown("---")
+        st.markdown("### 🧬 Quasi-doublons")
+        if st.button("🧬 Détecter les quasi-doublons", use_container_width=True):
+            with st.spinner("🔍 Calcul des empreintes des crops..."):
+                group_count = detect_duplicates(images_data)
+            st.info(f"ℹ️ {group_count} groupes ({len(st.session_state.duplicate_groups)} images)")
+        st.session_state.duplicate_policy = st.radio(
+            "Après validation d'une image:",
+            list(DUPLICATE_POLICIES),
+            index=list(DUPLICATE_POLICIES).index(st.session_state.duplicate_policy),
+            format_func=DUPLICATE_POLICIES.get,
+            disabled=not st.session_state.duplicate_groups
+        )
+        
+        st.markdown("### 🛡️ Intégrité des images")
+        if st.session_state.invalid_pairs is None and load_integrity_report(images_data):
+            st.rerun()
+        if st.button("🛡️ Vérifier les images", use_container_width=True,
+                     help="Décodage complet de chaque fichier; seuls les fichiers nouveaux ou modifiés sont relus"):
+            with st.spinner("🔍 Décodage des images..."):
+                moved = load_integrity_report(images_data, check=True)
+            if moved:
+                st.rerun()
+        report = st.session_state.integrity_report
+        if report is None:
+            st.caption("Jamais vérifié: les paires illisibles ne sont détectées qu'à l'affichage")
+        else:
+            st.caption(f"Vérifié le {report['date'].replace('T', ' ')}: {len(report['invalides'])} paire(s) "
+                       f"invalide(s), sautée(s) - {len(report['orphelines'])} moitié(s) orpheline(s)")
+            if report["invalides"] or report["orphelines"]:
+                with st.expander("🛡️ Détails"):
+                    for key, problems in list(report["invalides"].items())[:INTEGRITY_PANEL_ROWS]:
+                        st.markdown(f"- `{key}`: " + "; ".join(f"{part}: {message}" for part, message in problems))
+                    for path in report["orphelines"][:INTEGRITY_PANEL_ROWS]:
+                        st.markdown(f"- `{path}`: orpheline")
+        
+        st.markdown("### 📦 Jeu de données")
+        if st.button("📦 Matérialiser le jeu de données", use_container_width=True,
+                     help="Nouvelle version (un dossier par classe, clones si possible); seuls les changements sont lus"):
+            with st.spinner("📦 Placement des fichiers..."):
+                dataset_path, counts, errors = materialize_session(images_data)
+            if counts["version"] is None:
+                st.error(f"❌ Version incomplète, non publiée ({counts['erreurs']} erreur(s)): relancez pour reprendre")
+            else:
+                st.success(f"✅ Version {counts['version']}: {counts['places']} fichiers placés, "
+                           f"{counts['retires']} retirés, {counts['inchanges']} inchangés")
+            st.caption(f"📁 {dataset_path}")
+            for error in errors[:5]:
+                st.warning(f"⚠️ {error}")
+        
+        st.markdown("### 🤖 Pré-annotation")
+        if st.session_state.predictions is None:
+            load_predictions(images_data)
+        if st.button("🤖 Pré-annoter les crops", use_container_width=True):
+            with st.spinner("🔍 Évaluation des crops par le modèle..."):
+                load_predictions(images_data, compute=True)
+            doubtful = sum(1 for key, p in st.session_state.predictions.items()
+                           if contradicts_folder(p, images_data[images_data.position(key)]["label_initial"]))
+            st.info(f"ℹ️ {len(st.session_state.predictions)} crops évalués, {doubtful} labels de dossier douteux")
+        review_enabled = st.checkbox(
+            "🎯 Revue par incertitude (labels douteux d'abord)",
+            value=st.session_state.review_order is not None and not st.session_state.dispatch_mode,
+            disabled=not st.session_state.predictions or st.session_state.dispatch_mode,
+            help="Indisponible en mode équipe (l'ordre y est fixé par la distribution)"
+        )
+        if review_enabled and st.session_state.review_order is None:
+            set_review_order(images_data)
+            st.session_state.current_index = review_start(images_data)
+            st.rerun()
+        elif not review_enabled and st.session_state.review_order is not None:
+            st.session_state.review_order = None
+            st.session_state.review_rank = None
+        
         if st.button("🏠 Retour à l'accueil", use_container_width=True):
             if st.session_state.auto_save_enabled:
                 save_progress(images_data)
+            if st.session_state.dispatch_mode:
+                get_store().release_leases(st.session_state.root_directory, st.session_state.annotator_name)
             reset_session()
             st.rerun()
         
         st.markdown("---")
         st.markdown("### 📈 Statistiques")
-        completed = count_completed_annotations()
-        ignored = count_ignored_images()
+        PROFILER.start("statistiques")
+        completed = count_completed_annotations(images_data)
+        ignored = count_ignored_images(images_data)
         st.metric("Annotées", f"{completed}/{len(images_data)}")
         st.metric("Ignorées", f"{ignored}/{len(images_data)}")
         total_processed = completed + ignored
@@ -632,88 +1695,119 @@ else:
         
         # Statistiques par sous-dossier
         with st.expander("📁 Par sous-dossier"):
-            folders = {}
-            for i, img in enumerate(images_data):
-                folder = img["folder"]
-                if folder not in folders:
-                    folders[folder] = {"total": 0, "annotated": 0, "ignored": 0}
-                folders[folder]["total"] += 1
-                if st.session_state.responses[i].get("annotated", False):
-                    folders[folder]["annotated"] += 1
-                if st.session_state.responses[i].get("ignored", False):
-                    folders[folder]["ignored"] += 1
+            folders = st.session_state.stats.folders
             
             for folder in sorted(folders.keys()):
                 stats = folders[folder]
                 st.write(f"**{folder}:**")
                 st.write(f"  ✅ Annotées: {stats['annotated']}/{stats['total']}")
                 st.write(f"  ❌ Ignorées: {stats['ignored']}/{stats['total']}")
+        PROFILER.stop("statistiques")
+    PROFILER.stop("barre_laterale")
+    PROFILER.start("vue_principale")
+    
+    # Les raccourcis du mode rapide ne restent pas actifs sous une autre vue
+    fast_view = st.session_state.fast_mode and not st.session_state.grid_mode and idx < len(images_data)
+    if st.session_state.keyboard_bridge and not fast_view:
+        keyboard_bridge(False)
     
     # Vérifier si terminé
     if idx >= len(images_data):
         st.success("🎉 **Annotation terminée !**")
         st.balloons()
         
-        # Exporter les résultats
-        csv_content = export_to_csv(images_data)
-        
-        # Envoyer l'email
-        with st.spinner("📧 Envoi de la notification..."):
-            success, message = send_completion_email(
+        # Exporter les résultats et mettre la notification en file (une seule fois par session)
+        if st.session_state.export_path is None:
+            export_path = str(export_to_csv(images_data))
+            success, message = queue_completion_email(
                 st.session_state.annotator_name,
                 images_data,
-                csv_content
+                export_path
             )
+            st.session_state.export_path = export_path
+            st.session_state.completion_message = (success, message)
+            
+            if success:
+                # La notification est sur disque: la sauvegarde temporaire n'est plus utile
+                try:
+                    filepath = get_save_filepath(st.session_state.annotator_name)
+                    if filepath.exists():
+                        filepath.unlink()
+                    get_journal_filepath(st.session_state.annotator_name).unlink(missing_ok=True)
+                    get_store().forget_session(st.session_state.annotator_name)
+                except:
+                    pass
+        export_path = st.session_state.export_path
         
+        success, message = st.session_state.completion_message
         if success:
             st.success(message)
-            # Supprimer la sauvegarde temporaire
-            try:
-                filepath = get_save_filepath(st.session_state.annotator_name)
-                if filepath.exists():
-                    filepath.unlink()
-            except:
-                pass
+        elif success is None:
+            st.info(message)
         else:
             st.error(message)
         
         # Résumé
         with st.expander("📊 Résumé des annotations", expanded=True):
-            df = pd.DataFrame([
-                {
-                    "Image": img["bbox_file"],
-                    "Dossier": img["folder"],
-                    "Label initial": img["label_initial"],
-                    "Label choisi": "IGNORÉ" if st.session_state.responses[i].get("ignored", False) else (st.session_state.responses[i]["label_choisi"] or "Non annoté"),
-                    "Statut": "❌ Ignoré" if st.session_state.responses[i].get("ignored", False) else ("✅ Annoté" if st.session_state.responses[i].get("annotated", False) else "⏳ Non annoté")
-                }
-                for i, img in enumerate(images_data)
-            ])
-            st.dataframe(df, width='stretch')
+            page_count = max(1, -(-len(images_data) // SUMMARY_PAGE_SIZE))
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, key="summary_page")
+            st.caption(f"Page {page}/{page_count} - {len(images_data)} images")
+            st.dataframe(summary_page(images_data, page - 1), width='stretch')
         
         # Téléchargement
-        st.download_button(
-            label="📥 Télécharger les résultats (CSV)",
-            data=csv_content,
-            file_name=f"annotations_{st.session_state.annotator_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv",
-            width='stretch'
-        )
+        with open(export_path, 'rb') as export_file:
+            st.download_button(
+                label="📥 Télécharger les résultats (CSV)",
+                data=export_file,
+                file_name=Path(export_path).name,
+                mime="text/csv",
+                width='stretch'
+            )
+        
+        # Shards d'entraînement (lecture séquentielle de gros fichiers)
+        col_tar, col_npy = st.columns(2)
+        for column, fmt, label in ((col_tar, "tar", "🗃️ Shards tar (style WebDataset)"),
+                                   (col_npy, "npy", "🧮 Tableaux npy (memmap)")):
+            with column:
+                if st.button(label, key=f"shards_{fmt}", width='stretch'):
+                    with st.spinner("🗃️ Écriture des shards..."):
+                        output_dir, index = export_to_shards(images_data, fmt)
+                    st.success(f"✅ {index['echantillons']} paires exportées")
+                    st.caption(f"📁 {output_dir}")
         
         if st.button("🔄 Nouvelle annotation", width='stretch'):
             reset_session()
             st.rerun()
     
+    elif st.session_state.grid_mode:
+        grid_panel()
+    
+    elif st.session_state.fast_mode:
+        keyboard_bridge()
+        fast_annotation_panel()
+    
     else:
         img_data = images_data[idx]
+        img_key = img_data["key"]
         
         # Barre de progression
         st.progress(idx / len(images_data))
         st.markdown(f"### Image {idx + 1} / {len(images_data)}")
+        if st.session_state.dispatch_mode:
+            st.caption(f"👥 Mode équipe - {len(st.session_state.dispatch_queue)} paire(s) restante(s) dans votre lot")
+        duplicate_count = len(st.session_state.duplicate_groups.get(img_key, ())) - 1
+        if duplicate_count > 0:
+            st.caption(f"🧬 {duplicate_count} quasi-doublon(s) de cette image dans le dossier")
+        hint = prediction_hint(img_data)
+        if hint is not None:
+            st.caption(hint)
+        problems = invalid_parts(img_key)
+        if "paire" in problems:
+            st.warning(f"🛡️ Paire incohérente: {problems['paire']}")
         
         # Statut de l'annotation actuelle
-        is_ignored = st.session_state.responses[idx].get("ignored", False)
-        is_annotated = st.session_state.responses[idx].get("annotated", False)
+        is_ignored = get_response(img_key).get("ignored", False)
+        is_annotated = get_response(img_key).get("annotated", False)
         
         if is_ignored:
             status_badge = "❌ Ignorée"
@@ -744,9 +1838,10 @@ else:
                 <div class='image-title'>🔳 Image BBOX</div>
             </div>""", unsafe_allow_html=True)
             
-            if os.path.exists(img_data["bbox_path"]):
-                img_bbox = Image.open(img_data["bbox_path"])
-                st.image(img_bbox, width='stretch')
+            if "bbox" in problems:
+                st.error(f"❌ Image bbox invalide: {problems['bbox']}")
+            elif os.path.exists(img_data["bbox_path"]):
+                st.image(get_rendition_cache().get(img_data["bbox_path"]), width='stretch')
                 st.caption(f"📄 {img_data['bbox_file']}")
             else:
                 st.error("❌ Image bbox non trouvée")
@@ -756,14 +1851,14 @@ else:
                 <div class='image-title'>✂️ Image CROP</div>
             </div>""", unsafe_allow_html=True)
             
-            if os.path.exists(img_data["crop_path"]):
-                img_crop = Image.open(img_data["crop_path"])
-                
-                # Afficher l'image normalement
-                st.image(img_crop, width='content')
+            if "crop" in problems:
+                st.error(f"❌ Image crop invalide: {problems['crop']}")
+            elif os.path.exists(img_data["crop_path"]):
+                # Afficher le rendu réduit; l'image originale n'est lue qu'en mode zoom
+                st.image(get_rendition_cache().get(img_data["crop_path"]), width='content')
                 st.caption(f"📄 {img_data['crop_file']}")
 
-                zoom_key = f"zoom_{idx}"
+                zoom_key = f"zoom_{img_key}"
                 
                 if zoom_key not in st.session_state.show_crop_zoom:
                     st.session_state.show_crop_zoom[zoom_key] = False
@@ -771,7 +1866,7 @@ else:
                 # Bouton pour zoomer avec colonnes pour centrer
                 col_btn1, col_btn2, col_btn3 = st.columns([1, 1, 1])
                 with col_btn2:
-                    if st.button("🔍 Zoom", key=f"btn_zoom_{idx}", width='stretch'):
+                    if st.button("🔍 Zoom", key=f"btn_zoom_{img_key}", width='stretch'):
                         st.session_state.show_crop_zoom[zoom_key] = not st.session_state.show_crop_zoom[zoom_key]
                         st.rerun()
                 
@@ -782,15 +1877,18 @@ else:
                     st.markdown("### 🔍 Mode Zoom")
                     
                     # Bouton fermer en haut
-                    if st.button("✕ Fermer le zoom", key=f"close_zoom_top_{idx}", type="primary", width='stretch'):
+                    if st.button("✕ Fermer le zoom", key=f"close_zoom_top_{img_key}", type="primary", width='stretch'):
                         st.session_state.show_crop_zoom[zoom_key] = False
                         st.rerun()
                     
-                    # Afficher l'image en grand
-                    st.image(img_crop, width='stretch', caption="Image CROP agrandie")
+                    # Afficher l'image en grand (pleine résolution, chargée à la demande)
+                    with PROFILER.stage("reencodage_streamlit"), Image.open(img_data["crop_path"]) as img_crop:
+                        count_decoded(img_data["crop_path"])
+                        img_crop.load()
+                        st.image(img_crop, width='stretch', caption="Image CROP agrandie")
                     
                     # Bouton fermer en bas aussi
-                    if st.button("✕ Fermer le zoom", key=f"close_zoom_bottom_{idx}", type="secondary", width='stretch'):
+                    if st.button("✕ Fermer le zoom", key=f"close_zoom_bottom_{img_key}", type="secondary", width='stretch'):
                         st.session_state.show_crop_zoom[zoom_key] = False
                         st.rerun()
                     
@@ -798,6 +1896,9 @@ else:
             else:
                 st.error("❌ Image crop non trouvée")
         
+        # Préparer les paires voisines pendant que l'annotateur travaille
+        prefetch_around(images_data, idx)
+        
         st.markdown("---")
         
         # Zone d'annotation
@@ -809,27 +1910,28 @@ else:
         ignore_checkbox = st.checkbox(
             "❌ **Ignorer cette image** (ne correspond à aucune des 4 classes)",
             value=is_ignored,
-            key=f"ignore_{idx}",
+            key=f"ignore_{img_key}",
             help="Cochez cette case si l'image ne correspond à aucune des classes disponibles"
         )
         
         if ignore_checkbox != is_ignored:
-            st.session_state.responses[idx]["ignored"] = ignore_checkbox
             if ignore_checkbox:
                 # Si on ignore, on efface le label et on marque comme non annoté
-                st.session_state.responses[idx]["label_choisi"] = None
-                st.session_state.responses[idx]["annotated"] = False
+                update_response(images_data, img_key, ignored=True, label_choisi=None, annotated=False)
+            else:
+                update_response(images_data, img_key, ignored=False)
             st.rerun()
         
         st.markdown("</div>", unsafe_allow_html=True)
         
         # SÉLECTION DU LABEL (désactivé si ignoré)
         if not ignore_checkbox:
-            current_choice = st.session_state.responses[idx]["label_choisi"]
+            current_choice = get_response(img_key)["label_choisi"]
             
             # Si pas encore de choix, utiliser le label initial comme suggestion
             if current_choice is None:
-                default_index = CLASSES_DISPONIBLES.index(img_data["label_initial"]) if img_data["label_initial"] in CLASSES_DISPONIBLES else 0
+                initial = img_data["label_initial"]
+                default_index = CLASSES_DISPONIBLES.index(initial) if initial in CLASSES_DISPONIBLES else 0
             else:
                 default_index = CLASSES_DISPONIBLES.index(current_choice) if current_choice in CLASSES_DISPONIBLES else 0
             
@@ -837,27 +1939,28 @@ else:
                 "🏷️ Sélectionnez le label approprié:",
                 CLASSES_DISPONIBLES,
                 index=default_index,
-                key=f"label_{idx}",
-                horizontal=True
+                key=f"label_{img_key}",
+                horizontal=True,
+                # Marquer comme annoté seulement si l'utilisateur change le choix (pas à l'affichage)
+                on_change=choose_label,
+                args=(images_data, img_key)
             )
-            
-            # Marquer comme annoté si l'utilisateur change le choix
-            if choice != current_choice:
-                st.session_state.responses[idx]["label_choisi"] = choice
-                st.session_state.responses[idx]["annotated"] = True
-                st.session_state.responses[idx]["ignored"] = False
         else:
             st.info("ℹ️ Image ignorée - sélection de label désactivée")
         
         comment = st.text_area(
             "💬 Commentaire (optionnel):",
-            value=st.session_state.responses[idx]["commentaire"],
-            key=f"comment_{idx}",
+            value=get_response(img_key)["commentaire"],
+            key=f"comment_{img_key}",
             height=100,
             placeholder="Ajoutez un commentaire si nécessaire..."
         )
         
-        st.session_state.responses[idx]["commentaire"] = comment
+        update_response(images_data, img_key, commentaire=comment)
+        
+        if not ignore_checkbox and st.toggle(f"🔎 Afficher les {SIMILAR_COUNT} crops les plus similaires",
+                                             key="show_similar"):
+            similar_panel(img_key, choice)
         
         st.markdown("---")
         
@@ -865,28 +1968,30 @@ else:
         col1, col2, col3 = st.columns([1, 2, 1])
         
         with col1:
-            if st.button("⬅️ Précédent", disabled=(idx == 0), width='stretch'):
-                st.session_state.current_index -= 1
+            at_start = is_first_position(idx)
+            if st.button("⬅️ Précédent", disabled=at_start, width='stretch'):
+                st.session_state.current_index = previous_position(images_data)
+                record_position(images_data)
                 st.rerun()
         
         with col3:
-            button_label = "Suivant ➡️" if idx < len(images_data) - 1 else "✅ Terminer"
+            is_last = is_last_position(idx)
+            button_label = "✅ Terminer" if is_last else "Suivant ➡️"
             if st.button(button_label, type="primary", width='stretch'):
                 # Marquer comme annoté ou ignoré si pas déjà fait
-                if not ignore_checkbox and not st.session_state.responses[idx].get("annotated", False):
-                    st.session_state.responses[idx]["annotated"] = True
-                    if st.session_state.responses[idx]["label_choisi"] is None:
+                if not ignore_checkbox and not get_response(img_key).get("annotated", False):
+                    changes = {"annotated": True}
+                    if get_response(img_key)["label_choisi"] is None:
                         # Utiliser le choix actuel du radio button si disponible
-                        if not ignore_checkbox:
-                            st.session_state.responses[idx]["label_choisi"] = CLASSES_DISPONIBLES[default_index]
+                        changes["label_choisi"] = CLASSES_DISPONIBLES[default_index]
+                    update_response(images_data, img_key, **changes)
+                apply_duplicate_policy(images_data, img_key)
+                count_annotation("normal")
                 
-                st.session_state.current_index += 1
+                st.session_state.current_index = next_position(images_data)
                 
-                # Sauvegarde automatique
-                if st.session_state.auto_save_enabled and (st.session_state.current_index % 5 == 0):
-                    success, msg = save_progress(images_data)
-                    if success:
-                        st.toast("💾 Sauvegarde automatique", icon="✅")
+                # Sauvegarde automatique (une ligne de journal, compactée périodiquement)
+                record_position(images_data)
                 
                 st.rerun()
 
@@ -896,4 +2001,7 @@ st.markdown("""
 <div style='text-align: center; color: #666; font-size: 0.8rem;'>
     Outil d'annotation bbox/crop | Développé par Houda MAAMATOU & Claude
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+PROFILER.stop("vue_principale")
+end_cpu_accounting()
\ No newline at end of file
@@ -0,0 +1,384 @@
+"""
+Interface en ligne de commande (sans Streamlit) pour les tâches batch
+
+    python annotation_cli.py scan RACINE [--profondeur N]
+    python annotation_cli.py stats ANNOTATEUR
+    python annotation_cli.py export ANNOTATEUR [-o annotations.csv] [--format csv|jsonl|parquet]
+    python annotation_cli.py merge ANNOTATEUR [ANNOTATEUR ...] --vers NOM
+    python annotation_cli.py sessions
+    python annotation_cli.py restantes RACINE
+    python annotation_cli.py desaccords RACINE
+    python annotation_cli.py distribuer RACINE ANNOTATEUR [--lot N]
+    python annotation_cli.py doublons RACINE [--distance N]
+    python annotation_cli.py verifier RACINE [--profondeur N] [--workers N]
+    python annotation_cli.py preannoter RACINE [--annotateur NOM] [--modele module:fabrique]
+    python annotation_cli.py similaires RACINE CLE [-k N]
+    python annotation_cli.py materialiser ANNOTATEUR [--vers DOSSIER] [--mode reflink|copie|lien]
+    python annotation_cli.py shards ANNOTATEUR [-o DOSSIER] [--format tar|npy] [--taille-mo N] [--bbox]
+    python annotation_cli.py envoyer [--transport smtp|fichier|webhook]
+"""
+import argparse
+import sys
+
+from annotation_core import (
+    AnnotationStats,
+    EXPORT_CHUNK_ROWS,
+    EXPORT_FORMATS,
+    SCAN_MAX_DEPTH,
+    export_annotations,
+    get_absolute_path,
+    get_dataset_folder,
+    get_shards_folder,
+    load_progress,
+    load_session,
+    merge_responses,
+    refresh_directory_index,
+    scan_images_directory,
+    fill_missing_responses,
+    write_csv,
+    write_jsonl,
+    write_snapshot,
+)
+from annotation_store import DISPATCH_BATCH_SIZE, AnnotationStore
+
+# Les modules lourds (numpy, PIL, email) sont importés par les commandes qui
+# les utilisent: `stats`, `sessions` ou `export` démarrent sans les charger.
+# Leurs options valent None par défaut, la valeur du module s'applique alors.
+
+def _given(**options):
+    """Options passées en ligne de commande (les autres gardent le défaut du module)"""
+    return {name: value for name, value in options.items() if value is not None}
+
+def cmd_scan(args):
+    """Met à jour l'index du dossier racine et affiche les paires par sous-dossier"""
+    root_path = get_absolute_path(args.racine)
+    if not root_path.exists():
+        print(f"❌ Le dossier '{root_path}' n'existe pas!", file=sys.stderr)
+        return 1
+
+    images_data, diff = refresh_directory_index(root_path, args.profondeur)
+    counts = {}
+    for img in images_data:
+        counts[img["folder"]] = counts.get(img["folder"], 0) + 1
+
+    for folder in sorted(counts):
+        print(f"{folder}: {counts[folder]} paires")
+    print(f"Total: {len(images_data)} paires dans {len(counts)} sous-dossiers")
+    print(f"Ajoutées: {len(diff['ajoutees'])} | Supprimées: {len(diff['supprimees'])}")
+    return 0
+
+def cmd_stats(args):
+    """Affiche la progression d'un annotateur (globale et par sous-dossier)"""
+    save_data, images_data, responses = load_session(args.annotateur)
+    stats = AnnotationStats.from_responses(images_data, responses)
+
+    print(f"Annotateur: {save_data['annotateur']}")
+    print(f"Dossier: {save_data['root_directory']}")
+    print(f"Dernière sauvegarde: {save_data.get('date_sauvegarde', 'Inconnue')}")
+    print(f"Annotées: {stats.annotated}/{stats.total}")
+    print(f"Ignorées: {stats.ignored}/{stats.total}")
+    for folder, counts in sorted(stats.folders.items()):
+        print(f"  {folder}: {counts['annotated']} annotées, {counts['ignored']} ignorées / {counts['total']}")
+    return 0
+
+def cmd_export(args):
+    """Exporte les annotations d'un annotateur (csv, jsonl ou parquet), ligne par ligne"""
+    _, images_data, responses = load_session(args.annotateur)
+    if args.output == "-":
+        if args.format == "parquet":
+            print("❌ L'export Parquet nécessite un fichier de sortie (-o)", file=sys.stderr)
+            return 1
+        writer = write_csv if args.format == "csv" else write_jsonl
+        writer(images_data, responses, sys.stdout)
+    else:
+        export_annotations(images_data, responses, args.output, args.format, args.bloc)
+        print(f"✅ {len(images_data)} lignes exportées dans {args.output}")
+    return 0
+
+def cmd_merge(args):
+    """Fusionne les sauvegardes de plusieurs annotateurs dans une nouvelle sauvegarde"""
+    sessions = []
+    for annotator_name in args.annotateurs:
+        save_data, msg = load_progress(annotator_name)
+        if save_data is None:
+            print(f"❌ {annotator_name}: {msg}", file=sys.stderr)
+            return 1
+        if save_data['legacy_keys']:
+            print(f"❌ {annotator_name}: sauvegarde v2 (clés par position), reprenez-la d'abord dans l'application",
+                  file=sys.stderr)
+            return 1
+        sessions.append(save_data)
+
+    roots = {str(get_absolute_path(s['root_directory'])) for s in sessions}
+    if len(roots) > 1:
+        print(f"❌ Les sauvegardes portent sur des dossiers différents: {', '.join(sorted(roots))}",
+              file=sys.stderr)
+        return 1
+    root_directory = roots.pop()
+
+    responses, conflicts = merge_responses(sessions)
+    images_data = scan_images_directory(root_directory)
+    fill_missing_responses(responses, images_data)
+
+    current_key = images_data[0]["key"] if images_data else None
+    filepath = write_snapshot(args.vers, root_directory, responses, 0, current_key, len(images_data))
+    store = AnnotationStore()
+    store.record_responses(root_directory, args.vers, responses)
+    store.record_session(args.vers, root_directory, 0, current_key, len(images_data), filepath)
+    print(f"✅ {len(sessions)} sauvegardes fusionnées dans {filepath}")
+    if conflicts:
+        print(f"⚠️ {len(conflicts)} images avec des labels différents (la sauvegarde la plus récente l'emporte):")
+        for key in conflicts:
+            print(f"  {key}")
+    return 0
+
+def cmd_sessions(args):
+    """Liste les sessions sauvegardées (base partagée, fichiers modifiés importés)"""
+    store = AnnotationStore()
+    store.sync_save_files(on_error=lambda filepath, e: print(f"⚠️ Impossible de lire {filepath.name}: {e}",
+                                                             file=sys.stderr))
+    for session in store.list_sessions():
+        print(f"{session['annotateur']}\t{session['progression']}\t{session['date']}\t{session['root_directory']}")
+    return 0
+
+def cmd_unlabelled(args):
+    """Liste les paires qu'aucun annotateur n'a encore traitées"""
+    refresh_directory_index(args.racine)
+    store = AnnotationStore()
+    store.sync_save_files()
+    keys = store.unlabelled_keys(args.racine)
+    for key in keys:
+        print(key)
+    print(f"{len(keys)} paires non traitées", file=sys.stderr)
+    return 0
+
+def cmd_disagreements(args):
+    """Liste les paires dont les décisions diffèrent entre annotateurs"""
+    store = AnnotationStore()
+    store.sync_save_files()
+    rows = store.disagreements(args.racine)
+    for key, decisions in rows:
+        print(f"{key}\t" + ", ".join(f"{name}: {decision}" for name, decision in decisions.items()))
+    print(f"{len(rows)} paires en désaccord", file=sys.stderr)
+    return 0
+
+def cmd_dispatch(args):
+    """Réserve un lot de paires non traitées pour un annotateur (mode équipe)"""
+    refresh_directory_index(args.racine)
+    store = AnnotationStore()
+    store.sync_dispatch(args.racine)
+    keys = store.lease_batch(args.racine, args.annotateur, batch_size=args.lot)
+    for key in keys:
+        print(key)
+    print(f"{len(keys)} paires réservées pour {args.annotateur}", file=sys.stderr)
+    return 0
+
+def cmd_duplicates(args):
+    """Calcule les empreintes des crops (cache) et liste les groupes de quasi-doublons"""
+    from duplicates import find_duplicate_groups
+
+    images_data = scan_images_directory(args.racine)
+    groups = find_duplicate_groups(images_data, **_given(max_distance=args.distance))
+    for keys in groups:
+        print("\t".join(keys))
+    grouped = sum(len(keys) for keys in groups)
+    print(f"{len(groups)} groupes de quasi-doublons ({grouped} paires, {grouped - len(groups)} redondantes)",
+          file=sys.stderr)
+    return 0
+
+def cmd_check(args):
+    """Vérifie l'intégrité des paires (cache par fichier) et liste les paires invalides et les moitiés orphelines"""
+    from integrity import check_integrity
+
+    images_data = scan_images_directory(args.racine, args.profondeur)
+    report = check_integrity(images_data, args.profondeur, **_given(workers=args.workers))
+    for key, problems in report["invalides"].items():
+        print(f"{key}\t" + "; ".join(f"{part}: {message}" for part, message in problems))
+    for path in report["orphelines"]:
+        print(f"{path}\torpheline")
+    print(f"{report['paires']} paires vérifiées ({report['decodes']} fichiers décodés): "
+          f"{len(report['invalides'])} invalides, {len(report['orphelines'])} moitiés orphelines", file=sys.stderr)
+    return 1 if report["invalides"] or report["orphelines"] else 0
+
+def cmd_prelabel(args):
+    """Évalue les crops avec le modèle (cache) et liste les paires au label de dossier le plus douteux"""
+    from prelabel import contradicts_folder, predict_pairs
+
+    if args.annotateur:
+        _, images_data, responses = load_session(args.annotateur)
+    else:
+        images_data, responses = scan_images_directory(args.racine), {}
+    predictions = predict_pairs(images_data, responses, **_given(model_spec=args.modele, workers=args.workers))
+    ranked = sorted(predictions.items(), key=lambda item: -item[1]["label_wrong"])
+    for key, p in ranked[:args.top]:
+        print(f"{key}\t{p['predicted']}\t{p['confidence']:.2f}\t{p['label_wrong']:.2f}")
+    label_of = {img["key"]: img["label_initial"] for img in images_data}
+    doubtful = sum(1 for key, p in predictions.items() if contradicts_folder(p, label_of[key]))
+    print(f"{len(predictions)} crops évalués, {doubtful} labels de dossier douteux", file=sys.stderr)
+    return 0
+
+def cmd_similar(args):
+    """Met à jour l'index de similarité (ajouts seulement) et liste les crops les plus proches d'une paire"""
+    from similarity import SimilarityIndex
+
+    images_data = scan_images_directory(args.racine)
+    index = SimilarityIndex(args.racine)
+    added, removed = index.update(images_data)
+    print(f"Index: {len(index)} crops ({added} ajoutés, {removed} retirés)", file=sys.stderr)
+    for key, score in index.neighbours(args.cle, **_given(k=args.k)):
+        print(f"{key}\t{score:.4f}")
+    return 0
+
+def cmd_materialize(args):
+    """Écrit (ou met à jour) le jeu de données annoté: un dossier par classe, manifeste avec empreintes"""
+    from materialize import materialize_dataset
+
+    save_data, images_data, responses = load_session(args.annotateur)
+    dataset_path = args.vers or get_dataset_folder(args.annotateur)
+    counts = materialize_dataset(
+        images_data, responses, dataset_path, args.mode,
+        root_directory=str(get_absolute_path(save_data['root_directory'])),
+        on_error=lambda relative, e: print(f"⚠️ {relative}: {e}", file=sys.stderr),
+        **_given(workers=args.workers)
+    )
+    if counts["version"] is None:
+        print(f"❌ {dataset_path}: version incomplète, non publiée ({counts['erreurs']} erreur(s))")
+    else:
+        print(f"✅ {dataset_path}/v{counts['version']}: {counts['places']} fichiers placés, "
+              f"{counts['retires']} retirés, {counts['inchanges']} inchangés")
+    return 1 if counts["erreurs"] else 0
+
+def cmd_shards(args):
+    """Exporte les paires annotées en shards d'entraînement (tar séquentiels ou tableaux npy)"""
+    from shards import export_shards
+
+    _, images_data, responses = load_session(args.annotateur)
+    output_dir = args.output or get_shards_folder(args.annotateur, args.format)
+    max_bytes = None if args.taille_mo is None else args.taille_mo * 1024 * 1024
+    index = export_shards(images_data, responses, output_dir, args.format, args.bbox,
+                          **_given(max_bytes=max_bytes, image_size=args.taille_image, workers=args.workers))
+    shard_count = len(index["shards"]) if args.format == "tar" else 1
+    print(f"✅ {index['echantillons']} paires exportées dans {output_dir} ({shard_count} shard(s))")
+    return 0
+
+def cmd_outbox(args):
+    """Remet les notifications en attente dont l'échéance est passée"""
+    from notifications import OUTBOX_FOLDER, NotificationOutbox, make_transport
+
+    transport = make_transport(**_given(kind=args.transport))
+    if transport is None:
+        print("ℹ️ Notifications désactivées (ANNOTATION_SMTP_RECEIVER non défini)", file=sys.stderr)
+        return 1
+    outbox = NotificationOutbox(OUTBOX_FOLDER, transport)
+    outbox.deliver_due()
+    pending = outbox.pending()
+    print(f"📧 {len(pending)} notification(s) en attente dans {OUTBOX_FOLDER}")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Outil d'annotation bbox/crop en mode batch")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", help="Scanner un dossier racine")
+    scan.add_argument("racine", help="Dossier principal contenant les sous-dossiers d'images")
+    scan.add_argument("--profondeur", type=int, default=SCAN_MAX_DEPTH,
+                      help="Nombre de niveaux de sous-dossiers à parcourir")
+    scan.set_defaults(func=cmd_scan)
+
+    stats = subparsers.add_parser("stats", help="Statistiques d'une sauvegarde")
+    stats.add_argument("annotateur")
+    stats.set_defaults(func=cmd_stats)
+
+    export = subparsers.add_parser("export", help="Exporter une sauvegarde (csv, jsonl, parquet)")
+    export.add_argument("annotateur")
+    export.add_argument("-o", "--output", default="-", help="Fichier de sortie (- pour stdout)")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export.add_argument("--bloc", type=int, default=EXPORT_CHUNK_ROWS,
+                        help="Lignes par bloc (groupes de lignes Parquet)")
+    export.set_defaults(func=cmd_export)
+
+    merge = subparsers.add_parser("merge", help="Fusionner plusieurs sauvegardes")
+    merge.add_argument("annotateurs", nargs="+")
+    merge.add_argument("--vers", required=True, help="Nom d'annotateur de la sauvegarde fusionnée")
+    merge.set_defaults(func=cmd_merge)
+
+    sessions = subparsers.add_parser("sessions", help="Lister les sessions sauvegardées")
+    sessions.set_defaults(func=cmd_sessions)
+
+    unlabelled = subparsers.add_parser("restantes", help="Paires traitées par aucun annotateur")
+    unlabelled.add_argument("racine")
+    unlabelled.set_defaults(func=cmd_unlabelled)
+
+    disagreements = subparsers.add_parser("desaccords", help="Paires aux décisions divergentes")
+    disagreements.add_argument("racine")
+    disagreements.set_defaults(func=cmd_disagreements)
+
+    dispatch = subparsers.add_parser("distribuer", help="Réserver un lot de paires non traitées")
+    dispatch.add_argument("racine")
+    dispatch.add_argument("annotateur")
+    dispatch.add_argument("--lot", type=int, default=DISPATCH_BATCH_SIZE)
+    dispatch.set_defaults(func=cmd_dispatch)
+
+    duplicates = subparsers.add_parser("doublons", help="Groupes de crops quasi identiques")
+    duplicates.add_argument("racine")
+    duplicates.add_argument("--distance", type=int,
+                            help="Distance de Hamming maximale entre empreintes (0 à 3)")
+    duplicates.set_defaults(func=cmd_duplicates)
+
+    check = subparsers.add_parser("verifier", help="Détecter les paires illisibles, tronquées ou incohérentes")
+    check.add_argument("racine")
+    check.add_argument("--profondeur", type=int, default=SCAN_MAX_DEPTH,
+                       help="Nombre de niveaux de sous-dossiers à parcourir")
+    check.add_argument("--workers", type=int)
+    check.set_defaults(func=cmd_check)
+
+    prelabel = subparsers.add_parser("preannoter", help="Pré-annoter les crops et classer les labels douteux")
+    prelabel.add_argument("racine")
+    prelabel.add_argument("--annotateur", help="Apprendre aussi des décisions de cette sauvegarde (même dossier)")
+    prelabel.add_argument("--modele",
+                          help="Modèle externe module:fabrique (défaut: centroïdes couleur/texture)")
+    prelabel.add_argument("--workers", type=int)
+    prelabel.add_argument("--top", type=int, default=50, help="Nombre de paires douteuses affichées")
+    prelabel.set_defaults(func=cmd_prelabel)
+
+    similar = subparsers.add_parser("similaires", help="Crops les plus proches d'une paire (index vectoriel)")
+    similar.add_argument("racine")
+    similar.add_argument("cle", help="Clé de la paire (sous-dossier/nom)")
+    similar.add_argument("-k", type=int, help="Nombre de voisins")
+    similar.set_defaults(func=cmd_similar)
+
+    materialize = subparsers.add_parser("materialiser", help="Écrire le jeu de données annoté (un dossier par classe)")
+    materialize.add_argument("annotateur")
+    materialize.add_argument("--vers", help="Dossier du jeu de données (défaut: datasets/dataset_ANNOTATEUR)")
+    materialize.add_argument("--mode", choices=("lien", "reflink", "copie"), default="reflink",
+                             help="Premier mode essayé (lien physique partagé avec la source, clone, copie)")
+    materialize.add_argument("--workers", type=int)
+    materialize.set_defaults(func=cmd_materialize)
+
+    shards = subparsers.add_parser("shards", help="Exporter les paires annotées en shards d'entraînement")
+    shards.add_argument("annotateur")
+    shards.add_argument("-o", "--output", help="Dossier de sortie (défaut: exports/shards_ANNOTATEUR_DATE_FORMAT)")
+    shards.add_argument("--format", choices=("tar", "npy"), default="tar")
+    shards.add_argument("--taille-mo", type=int,
+                        help="Taille maximale d'un shard tar (Mo)")
+    shards.add_argument("--bbox", action="store_true", help="Inclure les images bbox de contexte (tar)")
+    shards.add_argument("--taille-image", type=int, help="Côté des crops (npy)")
+    shards.add_argument("--workers", type=int)
+    shards.set_defaults(func=cmd_shards)
+
+    outbox = subparsers.add_parser("envoyer", help="Remettre les notifications en attente")
+    outbox.add_argument("--transport", choices=("smtp", "fichier", "webhook"))
+    outbox.set_defaults(func=cmd_outbox)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (LookupError, FileNotFoundError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,907 @@
+"""
+Cœur de l'outil d'annotation bbox/crop, sans dépendance à Streamlit
+Scan des dossiers, appariement bbox/crop, persistance (instantané + journal)
+et export. Utilisé par l'application Streamlit et par annotation_cli.py.
+"""
+import os
+import csv
+import json
+import multiprocessing
+import sqlite3
+import sys
+import threading
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+# ==================== CONFIGURATION ====================
+
+CLASSES_DISPONIBLES = ["fissure_degradee", "fissure_significative", "joint_ouvert", "faiencage"]
+
+# CORRECTION MAJEURE: Utiliser un chemin absolu pour les sauvegardes
+# Cela garantit que les sauvegardes sont toujours au même endroit
+SCRIPT_DIR = Path(__file__).parent.absolute() if '__file__' in globals() else Path.cwd()
+SAVE_FOLDER = SCRIPT_DIR / "sauvegardes_annotations_images"
+
+# Index persistant des sous-dossiers (mtime + paires) pour éviter les rescans complets
+INDEX_FILE = SAVE_FOLDER / "index_images.sqlite"
+INDEX_VERSION = 2
+
+# Parcours des sous-dossiers: profondeur (1 = sous-dossiers de classe uniquement)
+# et nombre de lectures de dossiers simultanées (utile sur NFS/SMB)
+SCAN_MAX_DEPTH = 1
+SCAN_WORKERS = 8
+
+# Démarrage des processus des pools de calcul: jamais par fork, le serveur
+# Streamlit a des threads (préchargement, surveillance, envoi) qui tiennent des verrous
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+IMAGES_SUFFIXES = ["_bbox", "_crop"]
+
+# Nombre de lignes de journal au-delà duquel un nouvel instantané est écrit
+JOURNAL_COMPACT_EVERY = 500
+
+SAVE_VERSION = "3.0"
+
+# Exports écrits sur disque par blocs de lignes (mémoire constante)
+EXPORT_FOLDER = SAVE_FOLDER / "exports"
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+EXPORT_CHUNK_ROWS = 10000
+
+# Jeux de données matérialisés (un dossier par classe, voir materialize.py)
+DATASET_FOLDER = SAVE_FOLDER / "datasets"
+
+EXPORT_COLUMNS = [
+    "image_bbox", "image_crop", "dossier_source", "label_initial",
+    "label_choisi", "statut", "commentaire", "annotated"
+]
+
+# ==================== SCAN DES DOSSIERS ====================
+
+def get_absolute_path(path_str):
+    """Convertit un chemin en chemin absolu"""
+    path = Path(path_str).expanduser()
+    if not path.is_absolute():
+        path = Path.cwd() / path
+    return path.resolve()
+
+def process_pool(max_workers):
+    """Pool de processus démarrés sans fork (sûr depuis un processus multi-thread)"""
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(POOL_START_METHOD))
+
+def split_image_name(file_name):
+    """
+    Décompose un nom de fichier image en (base_name, type)
+    type vaut "bbox", "crop" ou None; retourne None si ce n'est pas une image.
+    """
+    if not file_name.lower().endswith(('.png', '.jpg', '.jpeg')):
+        return None
+
+    # Trouver le nom de base
+    base_name = file_name
+    for suffix in IMAGES_SUFFIXES:
+        if suffix in base_name:
+            base_name = base_name.split(suffix)[0]
+            break
+
+    # Déterminer le type (bbox ou crop)
+    if "_bbox" in file_name:
+        return base_name, "bbox"
+    if "_crop" in file_name:
+        return base_name, "crop"
+    return base_name, None
+
+def group_image_pairs(file_names):
+    """
+    Groupe les fichiers d'un sous-dossier par nom de base (sans _bbox/_crop)
+    Retourne la liste ordonnée des paires complètes (base_name, bbox_file, crop_file)
+    """
+    image_groups = {}
+    for img_file in file_names:
+        parsed = split_image_name(img_file)
+        if parsed is None:
+            continue
+        base_name, kind = parsed
+        files = image_groups.setdefault(base_name, {})
+        if kind is not None:
+            files[kind] = img_file
+
+    return [
+        (base_name, files["bbox"], files["crop"])
+        for base_name, files in image_groups.items()
+        if "bbox" in files and "crop" in files
+    ]
+
+def image_key(folder, base_name):
+    """Identifiant stable d'une paire d'images (indépendant de sa position)"""
+    return f"{folder}/{base_name}"
+
+class ImagePair:
+    """
+    Paire d'images d'un catalogue, construite à la demande
+    Les chemins absolus et la clé sont recalculés à chaque accès; l'accès
+    par clé (img["crop_path"]) reste possible comme avec un dictionnaire.
+    `folder` est le chemin relatif (séparateur /) du dossier contenant la paire;
+    le label initial est le sous-dossier de premier niveau (la classe).
+    """
+    __slots__ = ("root", "folder", "base_name", "bbox_file", "crop_file")
+
+    FIELDS = ("key", "base_name", "folder", "label_initial", "bbox_file", "crop_file", "bbox_path", "crop_path")
+
+    def __init__(self, root, folder, base_name, bbox_file, crop_file):
+        self.root = root
+        self.folder = folder
+        self.base_name = base_name
+        self.bbox_file = bbox_file
+        self.crop_file = crop_file
+
+    @property
+    def key(self):
+        return image_key(self.folder, self.base_name)
+
+    @property
+    def label_initial(self):
+        return self.folder.split("/", 1)[0]
+
+    @property
+    def bbox_path(self):
+        return os.path.join(self.root, self.folder, self.bbox_file)
+
+    @property
+    def crop_path(self):
+        return os.path.join(self.root, self.folder, self.crop_file)
+
+    def __getitem__(self, name):
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self.FIELDS else default
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+class ImageCatalogue:
+    """
+    Liste compacte et immuable des paires d'un dossier racine
+    Pensée pour être partagée entre sessions: noms de dossiers et fins de
+    noms de fichiers (_bbox.png...) sont stockés une seule fois et référencés
+    par indices dans des tableaux; seul le nom de base est gardé par paire.
+    Se parcourt et s'indexe comme une liste d'ImagePair.
+    """
+
+    def __init__(self, root_path, rows, fingerprint=None):
+        """
+        rows: (folder, base_name, bbox_file, crop_file), regroupées par dossier
+        fingerprint: ((folder, mtime_ns), ...) des dossiers lus, racine ("") comprise
+        """
+        self.root = str(root_path)
+        self.fingerprint = fingerprint
+        self._folders = []
+        self._tails = []
+        self._folder_ids = array("I")
+        self._bbox_tails = array("I")
+        self._crop_tails = array("I")
+        self._base_names = []
+        self._positions = {}
+        # Plage [début, fin) des positions de chaque dossier (lignes regroupées par dossier)
+        self._folder_ranges = {}
+
+        folder_ids = {}
+        tail_ids = {}
+        for folder, base_name, bbox_file, crop_file in rows:
+            folder_id = folder_ids.get(folder)
+            if folder_id is None:
+                folder_id = folder_ids[folder] = len(self._folders)
+                self._folders.append(sys.intern(folder))
+            self._folder_ids.append(folder_id)
+            for tails, file_name in ((self._bbox_tails, bbox_file), (self._crop_tails, crop_file)):
+                # Le nom de base est toujours un préfixe des deux fichiers (voir group_image_pairs)
+                tail = file_name[len(base_name):]
+                tail_id = tail_ids.get(tail)
+                if tail_id is None:
+                    tail_id = tail_ids[tail] = len(self._tails)
+                    self._tails.append(tail)
+                tails.append(tail_id)
+            position = len(self._base_names)
+            self._positions[image_key(folder, base_name)] = position
+            self._base_names.append(base_name)
+            start, _ = self._folder_ranges.get(folder, (position, position))
+            self._folder_ranges[folder] = (start, position + 1)
+
+    def __len__(self):
+        return len(self._base_names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return self._record(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._record(i)
+
+    def __eq__(self, other):
+        if not isinstance(other, ImageCatalogue):
+            return NotImplemented
+        return self.root == other.root and list(self.rows()) == list(other.rows())
+
+    __hash__ = object.__hash__
+
+    def _record(self, i):
+        base_name = self._base_names[i]
+        return ImagePair(
+            self.root,
+            self._folders[self._folder_ids[i]],
+            base_name,
+            base_name + self._tails[self._bbox_tails[i]],
+            base_name + self._tails[self._crop_tails[i]]
+        )
+
+    def rows(self):
+        """Génère les (folder, base_name, bbox_file, crop_file) du catalogue"""
+        for i in range(len(self)):
+            record = self._record(i)
+            yield record.folder, record.base_name, record.bbox_file, record.crop_file
+
+    def folders(self):
+        """Dossiers contenant au moins une paire"""
+        return list(self._folder_ranges)
+
+    def folder_sizes(self):
+        """Nombre de paires de chaque dossier, dans l'ordre du catalogue"""
+        return {folder: end - start for folder, (start, end) in self._folder_ranges.items()}
+
+    def folder_pairs(self, folder):
+        """Paires (ImagePair) d'un dossier"""
+        start, end = self._folder_ranges.get(folder, (0, 0))
+        return [self._record(i) for i in range(start, end)]
+
+    def updated(self, added, removed, fingerprint=None):
+        """
+        Nouveau catalogue sans les clés `removed` et avec les paires `added`
+        added: (folder, base_name, bbox_file, crop_file); ajoutées en fin de dossier.
+        """
+        rows = [row for row in self.rows() if image_key(row[0], row[1]) not in removed]
+        rows.extend(added)
+        rows.sort(key=lambda row: row[0])
+        return ImageCatalogue(self.root, rows, fingerprint)
+
+    def folder_of(self, i):
+        return self._folders[self._folder_ids[i]]
+
+    def key_of(self, i):
+        return image_key(self.folder_of(i), self._base_names[i])
+
+    def position(self, key):
+        """Position d'une clé stable dans le catalogue, ou None"""
+        return self._positions.get(key)
+
+    def is_current(self):
+        """
+        Vrai si aucun des dossiers lus n'a changé depuis la construction (un stat par dossier)
+        Ajouter, supprimer ou renommer une image modifie le mtime de son dossier.
+        """
+        if self.fingerprint is None:
+            return False
+        for folder, mtime_ns in self.fingerprint:
+            try:
+                if os.stat(os.path.join(self.root, folder)).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+def catalogue_diff(old, new):
+    """Paires ajoutées/supprimées entre deux catalogues (même format que refresh_directory_index)"""
+    if old is new:
+        return {"ajoutees": [], "supprimees": []}
+    old_keys = {(img.folder, img.base_name) for img in old}
+    new_keys = {(img.folder, img.base_name) for img in new}
+    return {"ajoutees": sorted(new_keys - old_keys), "supprimees": sorted(old_keys - new_keys)}
+
+def _open_index():
+    """Ouvre (et crée si besoin) l'index persistant des dossiers d'images"""
+    SAVE_FOLDER.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(INDEX_FILE, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    # L'index n'est qu'un cache: un schéma périmé est simplement recréé
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version != INDEX_VERSION:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS dossiers")
+            conn.execute("DROP TABLE IF EXISTS paires")
+            conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dossiers (
+            root TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            subdirs TEXT NOT NULL,
+            PRIMARY KEY (root, folder)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS paires (
+            root TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            base_name TEXT NOT NULL,
+            bbox_file TEXT NOT NULL,
+            crop_file TEXT NOT NULL,
+            PRIMARY KEY (root, folder, base_name)
+        )
+    """)
+    return conn
+
+def _visit_folder(root_path, folder, known):
+    """
+    Lit un sous-dossier (exécuté dans un thread du pool de scan)
+    known = {folder: (mtime_ns, subdirs)} issu de l'index, ou {} sans index.
+    Retourne (folder, mtime_ns, pairs, subdirs); pairs vaut None si le mtime
+    est inchangé, auquel cas les sous-dossiers connus de l'index sont repris.
+    """
+    path = root_path / folder
+    mtime_ns = os.stat(path).st_mtime_ns
+    if folder in known and known[folder][0] == mtime_ns:
+        return folder, mtime_ns, None, known[folder][1]
+
+    # d_type du scandir: pas de stat supplémentaire par entrée
+    file_names = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            else:
+                file_names.append(entry.name)
+    return folder, mtime_ns, group_image_pairs(file_names), sorted(subdirs)
+
+def walk_image_folders(root_dir, known=None, max_depth=SCAN_MAX_DEPTH, workers=SCAN_WORKERS):
+    """
+    Parcourt en parallèle les sous-dossiers du dossier racine jusqu'à max_depth niveaux
+    Génère (folder, mtime_ns, pairs, subdirs) dès qu'un dossier est lu, dans
+    l'ordre de fin des lectures (voir _visit_folder pour pairs/subdirs).
+    """
+    root_path = get_absolute_path(root_dir)
+    known = known or {}
+
+    with os.scandir(root_path) as entries:
+        top_level = sorted(entry.name for entry in entries if entry.is_dir())
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as executor:
+        pending = {executor.submit(_visit_folder, root_path, folder, known): 1
+                   for folder in top_level}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                depth = pending.pop(future)
+                try:
+                    folder, mtime_ns, pairs, subdirs = future.result()
+                except FileNotFoundError:
+                    # Dossier supprimé pendant le parcours
+                    continue
+                if depth < max_depth:
+                    for name in subdirs:
+                        child = f"{folder}/{name}"
+                        pending[executor.submit(_visit_folder, root_path, child, known)] = depth + 1
+                yield folder, mtime_ns, pairs, subdirs
+
+def refresh_directory_index(root_dir, max_depth=SCAN_MAX_DEPTH):
+    """
+    Met à jour l'index persistant du dossier racine et retourne (catalogue, diff)
+    Seuls les sous-dossiers dont le mtime a changé sont relus sur le disque.
+    diff = {"ajoutees": [(folder, base_name), ...], "supprimees": [...]}
+    """
+    root_path = get_absolute_path(root_dir)
+    root_key = str(root_path)
+    diff = {"ajoutees": [], "supprimees": []}
+
+    # mtime de la racine relevé avant le parcours: un changement pendant le scan invalide le catalogue
+    fingerprint = [("", os.stat(root_path).st_mtime_ns)]
+    conn = _open_index()
+    try:
+        with conn:
+            known = {
+                folder: (mtime_ns, json.loads(subdirs))
+                for folder, mtime_ns, subdirs in conn.execute(
+                    "SELECT folder, mtime_ns, subdirs FROM dossiers WHERE root = ?", (root_key,)
+                )
+            }
+
+            # Sous-dossiers nouveaux ou modifiés, écrits au fil du parcours
+            visited = set()
+            for folder, mtime_ns, pairs, subdirs in walk_image_folders(root_path, known, max_depth):
+                visited.add(folder)
+                fingerprint.append((folder, mtime_ns))
+                if pairs is None:
+                    continue
+
+                old_names = {base_name for (base_name,) in conn.execute(
+                    "SELECT base_name FROM paires WHERE root = ? AND folder = ?",
+                    (root_key, folder)
+                )}
+                new_names = {base_name for base_name, _, _ in pairs}
+                diff["ajoutees"].extend((folder, b) for b in new_names - old_names)
+                diff["supprimees"].extend((folder, b) for b in old_names - new_names)
+
+                # Réécrire le dossier dans l'ordre de lecture (conserve l'ordre des rowid)
+                conn.execute("DELETE FROM paires WHERE root = ? AND folder = ?", (root_key, folder))
+                conn.executemany(
+                    "INSERT INTO paires (root, folder, base_name, bbox_file, crop_file) VALUES (?, ?, ?, ?, ?)",
+                    [(root_key, folder, b, bbox, crop) for b, bbox, crop in pairs]
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO dossiers (root, folder, mtime_ns, subdirs) VALUES (?, ?, ?, ?)",
+                    (root_key, folder, mtime_ns, json.dumps(subdirs, ensure_ascii=False))
+                )
+
+            # Sous-dossiers disparus (ou hors de la profondeur demandée)
+            for folder in set(known) - visited:
+                for (base_name,) in conn.execute(
+                    "SELECT base_name FROM paires WHERE root = ? AND folder = ?",
+                    (root_key, folder)
+                ):
+                    diff["supprimees"].append((folder, base_name))
+                conn.execute("DELETE FROM paires WHERE root = ? AND folder = ?", (root_key, folder))
+                conn.execute("DELETE FROM dossiers WHERE root = ? AND folder = ?", (root_key, folder))
+
+        images_data = ImageCatalogue(root_path, conn.execute(
+            "SELECT folder, base_name, bbox_file, crop_file FROM paires "
+            "WHERE root = ? ORDER BY folder, rowid",
+            (root_key,)
+        ), tuple(sorted(fingerprint)))
+    finally:
+        conn.close()
+
+    diff["ajoutees"].sort()
+    diff["supprimees"].sort()
+    return images_data, diff
+
+def iter_image_pairs(root_dir, max_depth=SCAN_MAX_DEPTH, workers=SCAN_WORKERS):
+    """Génère les paires (ImagePair) dossier par dossier, sans index"""
+    root_path = get_absolute_path(root_dir)
+    for folder, _, pairs, _ in walk_image_folders(root_path, None, max_depth, workers):
+        for base_name, bbox_file, crop_file in pairs:
+            yield ImagePair(str(root_path), folder, base_name, bbox_file, crop_file)
+
+def scan_images_directory_full(root_path, max_depth=SCAN_MAX_DEPTH):
+    """Scan complet sans index (utilisé si l'index est inutilisable)"""
+    pairs = list(iter_image_pairs(root_path, max_depth))
+    # Même ordre que l'index: par dossier puis ordre de lecture
+    pairs.sort(key=lambda img: img.folder)
+    return ImageCatalogue(root_path, (
+        (img.folder, img.base_name, img.bbox_file, img.crop_file) for img in pairs
+    ))
+
+def scan_images_directory(root_dir, max_depth=SCAN_MAX_DEPTH):
+    """
+    Scanne le dossier racine et récupère toutes les paires d'images bbox/crop
+    Retourne un ImageCatalogue (séquence d'ImagePair)
+    Lève FileNotFoundError si le dossier n'existe pas.
+    """
+    # CORRECTION: Convertir en chemin absolu
+    root_path = get_absolute_path(root_dir)
+
+    if not root_path.exists():
+        raise FileNotFoundError(f"Le dossier '{root_path}' n'existe pas!")
+
+    try:
+        images_data, _ = refresh_directory_index(root_path, max_depth)
+    except sqlite3.Error:
+        images_data = scan_images_directory_full(root_path, max_depth)
+
+    return images_data
+
+class CatalogueCache:
+    """
+    Catalogues partagés par tout le processus, un par dossier racine
+    Un catalogue est réutilisé tant que son empreinte (mtime des dossiers lus)
+    est inchangée. Un verrou par dossier évite les scans simultanés: les
+    sessions qui arrivent pendant un scan attendent son résultat.
+    """
+
+    def __init__(self, max_depth=SCAN_MAX_DEPTH):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._catalogues = {}
+        self._build_locks = {}
+
+    def get(self, root_dir):
+        """Catalogue à jour du dossier racine (scan seulement s'il a changé)"""
+        root_key = str(get_absolute_path(root_dir))
+        catalogue = self._catalogues.get(root_key)
+        if catalogue is not None and catalogue.is_current():
+            return catalogue
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(root_key, threading.Lock())
+        with build_lock:
+            # Un autre thread a pu reconstruire le catalogue pendant l'attente
+            previous = self._catalogues.get(root_key)
+            if previous is not None and previous.is_current():
+                return previous
+            catalogue = scan_images_directory(root_key, self.max_depth)
+            if catalogue == previous:
+                # Mêmes paires (mtime modifié sans ajout ni suppression): on garde l'exemplaire partagé
+                previous.fingerprint = catalogue.fingerprint
+                catalogue = previous
+            self._catalogues[root_key] = catalogue
+            return catalogue
+
+    def put(self, catalogue):
+        """Publie un catalogue construit ailleurs (par exemple mis à jour par le watcher)"""
+        with self._lock:
+            self._catalogues[catalogue.root] = catalogue
+
+    def invalidate(self, root_dir=None):
+        """Oublie le catalogue d'un dossier (ou tous)"""
+        with self._lock:
+            if root_dir is None:
+                self._catalogues.clear()
+            else:
+                self._catalogues.pop(str(get_absolute_path(root_dir)), None)
+
+# ==================== RÉPONSES ====================
+
+def empty_response():
+    """Réponse vierge pour une image pas encore traitée"""
+    return {
+        "label_choisi": None,
+        "commentaire": "",
+        "annotated": False,
+        "ignored": False
+    }
+
+def prune_empty_responses(responses):
+    """Retire les réponses vierges (réponses creuses: une image absente n'est pas traitée)"""
+    empty = empty_response()
+    return {key: response for key, response in responses.items() if response != empty}
+
+def migrate_legacy_responses(responses, images_data):
+    """
+    Convertit les réponses des sauvegardes v2 (clés = position) en clés stables
+    La conversion suppose que le dossier n'a pas changé depuis la sauvegarde.
+    """
+    migrated = {}
+    for k, v in responses.items():
+        if isinstance(k, int) or str(k).isdigit():
+            i = int(k)
+            if i < len(images_data):
+                migrated[images_data[i]["key"]] = v
+        else:
+            migrated[k] = v
+    return migrated
+
+def fill_missing_responses(responses, images_data):
+    """Ajoute une réponse vierge pour chaque image sans réponse (fusion par clé stable)"""
+    for img_data in images_data:
+        if img_data["key"] not in responses:
+            responses[img_data["key"]] = empty_response()
+    return responses
+
+class AnnotationStats:
+    """
+    Compteurs annotées/ignorées, globaux et par sous-dossier
+    Reconstruits en un passage au chargement, puis tenus à jour en temps
+    constant à chaque modification d'une réponse (record_change).
+    folders = {folder: {"total", "annotated", "ignored"}}
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.annotated = 0
+        self.ignored = 0
+        self.folders = {}
+
+    @classmethod
+    def from_responses(cls, images_data, responses):
+        """
+        Compteurs d'un catalogue: totaux d'après les plages de dossiers, puis
+        un passage sur les réponses traitées (aucune ImagePair construite)
+        """
+        stats = cls()
+        for folder, size in images_data.folder_sizes().items():
+            stats.folders[folder] = {"total": size, "annotated": 0, "ignored": 0}
+            stats.total += size
+        for key, response in responses.items():
+            annotated = bool(response.get("annotated", False))
+            ignored = bool(response.get("ignored", False))
+            if not (annotated or ignored):
+                continue
+            position = images_data.position(key)
+            if position is None:
+                continue
+            counts = stats.folders[images_data.folder_of(position)]
+            counts["annotated"] += annotated
+            counts["ignored"] += ignored
+            stats.annotated += annotated
+            stats.ignored += ignored
+        return stats
+
+    def record_change(self, folder, before, after):
+        """Applique le passage d'une réponse de `before` à `after` (dictionnaires de réponse)"""
+        counts = self.folders[folder]
+        for field in ("annotated", "ignored"):
+            delta = int(bool(after.get(field, False))) - int(bool(before.get(field, False)))
+            if delta:
+                counts[field] += delta
+                setattr(self, field, getattr(self, field) + delta)
+
+    @property
+    def processed(self):
+        return self.annotated + self.ignored
+
+# ==================== PERSISTANCE ====================
+
+def _safe_annotator_name(annotator_name):
+    """Nom d'annotateur utilisable dans un nom de fichier"""
+    safe_name = "".join(c for c in annotator_name if c.isalnum() or c in (' ', '_')).strip()
+    return safe_name.replace(' ', '_')
+
+def get_save_filepath(annotator_name):
+    """Génère le chemin du fichier de sauvegarde"""
+    # CORRECTION: Créer le dossier s'il n'existe pas
+    SAVE_FOLDER.mkdir(parents=True, exist_ok=True)
+
+    filepath = SAVE_FOLDER / f"sauvegarde_{_safe_annotator_name(annotator_name)}.json"
+    return filepath
+
+def get_journal_filepath(annotator_name):
+    """Chemin du journal des modifications (ajouts uniquement) d'un annotateur"""
+    SAVE_FOLDER.mkdir(parents=True, exist_ok=True)
+    return SAVE_FOLDER / f"journal_{_safe_annotator_name(annotator_name)}.jsonl"
+
+def append_journal_line(annotator_name, record):
+    """
+    Ajoute une ligne JSON au journal de l'annotateur (coût constant)
+    Une ligne laissée incomplète par une écriture interrompue est d'abord
+    terminée: la nouvelle ligne ne la prolonge jamais.
+    """
+    line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+    with open(get_journal_filepath(annotator_name), 'a+b') as f:
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+def replay_journal(save_data, journal_path):
+    """
+    Rejoue le journal sur l'instantané chargé
+    Les lignes illisibles (écriture interrompue) sont sautées. Retourne
+    (lignes rejouées, octets valides): les octets valides s'arrêtent à la fin
+    de la dernière ligne lisible, position où tronquer le journal avant d'y
+    ajouter de nouvelles lignes.
+    """
+    replayed = 0
+    valid_bytes = 0
+    offset = 0
+    with open(journal_path, 'rb') as f:
+        for line in f:
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "k" in record:
+                save_data['responses'].setdefault(record["k"], empty_response()).update(record["f"])
+            if "i" in record:
+                save_data['current_index'] = record["i"]
+                save_data['current_key'] = record.get("ck")
+            replayed += 1
+            valid_bytes = offset
+    return replayed, valid_bytes
+
+def truncate_journal(annotator_name, valid_bytes):
+    """Coupe le journal après sa dernière ligne lisible (reprise après une écriture interrompue)"""
+    journal_path = get_journal_filepath(annotator_name)
+    try:
+        if journal_path.stat().st_size > valid_bytes:
+            os.truncate(journal_path, valid_bytes)
+    except FileNotFoundError:
+        pass
+
+def write_snapshot(annotator_name, root_directory, responses, current_index, current_key, total_images):
+    """
+    Écrit l'instantané complet d'un annotateur et remet son journal à zéro
+    L'instantané est écrit dans un fichier temporaire puis renommé atomiquement.
+    Retourne le chemin du fichier de sauvegarde.
+    """
+    # CORRECTION: Sauvegarder le chemin absolu du dossier
+    save_data = {
+        "annotateur": annotator_name,
+        "root_directory": root_directory,
+        "root_directory_absolute": str(get_absolute_path(root_directory)),
+        "date_sauvegarde": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "current_index": current_index,
+        "current_key": current_key,
+        "responses": responses,
+        "total_images": total_images,
+        "version": SAVE_VERSION
+    }
+
+    filepath = get_save_filepath(annotator_name)
+    tmp_path = filepath.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(save_data, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+    # Le journal est désormais contenu dans l'instantané
+    get_journal_filepath(annotator_name).unlink(missing_ok=True)
+    return filepath
+
+def load_progress(annotator_name):
+    """Charge une sauvegarde existante (instantané + rejeu du journal)"""
+    filepath = get_save_filepath(annotator_name)
+
+    if not filepath.exists():
+        return None, "Aucune sauvegarde trouvée"
+
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            save_data = json.load(f)
+
+        # Les sauvegardes v2 utilisent la position comme clé: conversion à la reprise
+        save_data['legacy_keys'] = save_data.get('version', '2.0') != SAVE_VERSION
+
+        save_data['journal_length'] = 0
+        save_data['journal_valid_bytes'] = None
+        journal_path = get_journal_filepath(annotator_name)
+        if journal_path.exists() and not save_data['legacy_keys']:
+            save_data['journal_length'], save_data['journal_valid_bytes'] = replay_journal(save_data, journal_path)
+
+        # CORRECTION: Utiliser le chemin absolu si disponible
+        if 'root_directory_absolute' in save_data:
+            save_data['root_directory'] = save_data['root_directory_absolute']
+
+        return save_data, "✅ Sauvegarde chargée"
+    except Exception as e:
+        return None, f"❌ Erreur: {str(e)}"
+
+def load_session(annotator_name):
+    """
+    Charge la sauvegarde d'un annotateur et rescanne son dossier racine
+    Retourne (save_data, images_data, responses); les réponses sont migrées
+    vers les clés stables et complétées pour les nouvelles images.
+    Lève LookupError si la sauvegarde est absente ou illisible.
+    """
+    save_data, msg = load_progress(annotator_name)
+    if save_data is None:
+        raise LookupError(msg)
+
+    images_data = scan_images_directory(save_data['root_directory'])
+    responses = save_data['responses']
+    if save_data['legacy_keys']:
+        responses = migrate_legacy_responses(responses, images_data)
+    fill_missing_responses(responses, images_data)
+    return save_data, images_data, responses
+
+def merge_responses(sessions):
+    """
+    Fusionne les réponses de plusieurs sauvegardes (liste de save_data)
+    Pour chaque image, la réponse traitée (annotée ou ignorée) de la sauvegarde
+    la plus récente l'emporte. Retourne (responses, conflits) où conflits liste
+    les clés dont les labels traités diffèrent entre annotateurs.
+    """
+    merged = {}
+    decisions = {}
+    for save_data in sorted(sessions, key=lambda s: s.get('date_sauvegarde', '')):
+        for key, response in save_data['responses'].items():
+            processed = response.get("annotated", False) or response.get("ignored", False)
+            if not processed:
+                merged.setdefault(key, dict(response))
+                continue
+            merged[key] = dict(response)
+            decision = "IGNORÉ" if response.get("ignored", False) else response.get("label_choisi")
+            decisions.setdefault(key, set()).add(decision)
+
+    conflicts = sorted(key for key, labels in decisions.items() if len(labels) > 1)
+    return merged, conflicts
+
+# ==================== EXPORT ====================
+
+def export_rows(images_data, responses):
+    """Génère une ligne d'export par image (dictionnaires ordonnés selon EXPORT_COLUMNS)"""
+    for img_data in images_data:
+        response = responses.get(img_data["key"], {})
+        ignored = response.get("ignored", False)
+        label = response.get("label_choisi", "")
+
+        yield {
+            "image_bbox": img_data["bbox_file"],
+            "image_crop": img_data["crop_file"],
+            "dossier_source": img_data["folder"],
+            "label_initial": img_data["label_initial"],
+            "label_choisi": "IGNORÉ" if ignored else label,
+            "statut": "Ignoré" if ignored else ("Annoté" if response.get("annotated", False) else "Non annoté"),
+            "commentaire": response.get("commentaire", ""),
+            "annotated": response.get("annotated", False)
+        }
+
+def iter_export_chunks(images_data, responses, chunk_size=EXPORT_CHUNK_ROWS):
+    """Regroupe les lignes d'export par blocs de `chunk_size` (mémoire bornée par bloc)"""
+    chunk = []
+    for row in export_rows(images_data, responses):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def write_csv(images_data, responses, stream):
+    """Écrit les annotations au format CSV dans un flux texte ouvert (ligne par ligne)"""
+    writer = csv.DictWriter(stream, fieldnames=EXPORT_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(export_rows(images_data, responses))
+
+def write_jsonl(images_data, responses, stream):
+    """Écrit les annotations au format JSON Lines dans un flux texte ouvert"""
+    for row in export_rows(images_data, responses):
+        stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+def write_parquet(images_data, responses, path, chunk_size=EXPORT_CHUNK_ROWS):
+    """Écrit les annotations au format Parquet, un groupe de lignes par bloc (nécessite pyarrow)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("L'export Parquet nécessite pyarrow (pip install pyarrow)")
+
+    schema = pa.schema(
+        [(name, pa.string()) for name in EXPORT_COLUMNS if name != "annotated"]
+        + [("annotated", pa.bool_())]
+    )
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_export_chunks(images_data, responses, chunk_size):
+            writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=schema))
+
+def export_annotations(images_data, responses, path, fmt="csv", chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Exporte les annotations dans un fichier au format csv, jsonl ou parquet
+    Les lignes sont produites au fil de l'eau: la mémoire ne dépend pas du
+    nombre d'images. Le fichier est écrit sous un nom temporaire puis renommé.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu: {fmt} (attendu: {', '.join(EXPORT_FORMATS)})")
+
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        if fmt == "parquet":
+            write_parquet(images_data, responses, tmp_path, chunk_size)
+        else:
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                if fmt == "csv":
+                    write_csv(images_data, responses, f)
+                else:
+                    write_jsonl(images_data, responses, f)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return path
+
+def get_shards_folder(annotator_name, fmt="tar"):
+    """Dossier horodaté d'un export en shards dans EXPORT_FOLDER"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return EXPORT_FOLDER / f"shards_{_safe_annotator_name(annotator_name)}_{timestamp}_{fmt}"
+
+def get_dataset_folder(annotator_name):
+    """Dossier du jeu de données matérialisé d'un annotateur dans DATASET_FOLDER"""
+    return DATASET_FOLDER / f"dataset_{_safe_annotator_name(annotator_name)}"
+
+def get_export_filepath(annotator_name, fmt="csv"):
+    """Chemin horodaté d'un export dans EXPORT_FOLDER"""
+    EXPORT_FOLDER.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return EXPORT_FOLDER / f"annotations_{_safe_annotator_name(annotator_name)}_{timestamp}.{fmt}"
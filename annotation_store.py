@@ -0,0 +1,412 @@
+"""
+Base d'annotations partagée par toutes les sessions (SQLite en mode WAL)
+Chaque réponse est attribuée à son annotateur; les métadonnées de session
+servent à lister les sauvegardes sans relire chaque fichier JSON. Les
+sauvegardes JSON restent la référence pour la reprise d'une session.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from annotation_core import SAVE_FOLDER, INDEX_FILE, SAVE_VERSION, get_absolute_path
+
+STORE_FILE = SAVE_FOLDER / "annotations.sqlite"
+
+# Mode équipe: lots d'images non traitées distribués avec un bail à durée limitée
+DISPATCH_BATCH_SIZE = 20
+DISPATCH_LEASE_SECONDS = 15 * 60
+# Part des paires confiées à deux annotateurs (accord inter-annotateurs)
+DISPATCH_OVERLAP_RATE = 0.0
+# Sous-dossiers distribués en priorité (dans cet ordre), puis tous les autres
+DISPATCH_PRIORITY_FOLDERS = []
+
+def overlap_target(image_key, overlap_rate):
+    """Nombre de décisions attendues pour une paire (2 pour la part overlap_rate, sinon 1)"""
+    return 2 if zlib.crc32(image_key.encode('utf-8')) % 10000 < overlap_rate * 10000 else 1
+
+def response_decision(response):
+    """Décision portée par une réponse: label choisi, "IGNORÉ" ou None si non traitée"""
+    if response.get("ignored", False):
+        return "IGNORÉ"
+    if response.get("annotated", False):
+        return response.get("label_choisi")
+    return None
+
+class AnnotationStore:
+    """
+    Accès à la base partagée (une connexion par thread)
+    Les écritures de plusieurs processus Streamlit/CLI sont sérialisées par
+    SQLite (WAL + busy_timeout); les lectures ne bloquent pas les écritures.
+    """
+
+    def __init__(self, path=STORE_FILE):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    annotateur TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    date_sauvegarde TEXT NOT NULL,
+                    current_index INTEGER NOT NULL,
+                    current_key TEXT,
+                    total_images INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    save_mtime_ns INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS reponses (
+                    root TEXT NOT NULL,
+                    image_key TEXT NOT NULL,
+                    annotateur TEXT NOT NULL,
+                    label_choisi TEXT,
+                    commentaire TEXT NOT NULL DEFAULT '',
+                    annotated INTEGER NOT NULL,
+                    ignored INTEGER NOT NULL,
+                    decision TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (root, image_key, annotateur)
+                );
+                CREATE INDEX IF NOT EXISTS reponses_decision
+                    ON reponses (root, decision, image_key);
+                CREATE TABLE IF NOT EXISTS distribution (
+                    root TEXT NOT NULL,
+                    image_key TEXT NOT NULL,
+                    folder TEXT NOT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    disponible_apres REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (root, image_key)
+                );
+                CREATE INDEX IF NOT EXISTS distribution_a_faire
+                    ON distribution (root, folder, image_key, disponible_apres) WHERE complete = 0;
+                CREATE TABLE IF NOT EXISTS baux (
+                    root TEXT NOT NULL,
+                    image_key TEXT NOT NULL,
+                    annotateur TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (root, image_key, annotateur)
+                );
+                CREATE INDEX IF NOT EXISTS baux_expiration ON baux (expires_at);
+                CREATE INDEX IF NOT EXISTS baux_annotateur ON baux (root, annotateur);
+            """)
+            self._local.conn = conn
+        return conn
+
+    # ---------- écritures ----------
+
+    def _response_row(self, root, key, annotator_name, response, now):
+        return (
+            root, key, annotator_name,
+            response.get("label_choisi"),
+            response.get("commentaire", "") or "",
+            int(bool(response.get("annotated", False))),
+            int(bool(response.get("ignored", False))),
+            response_decision(response),
+            now
+        )
+
+    def record_responses(self, root_directory, annotator_name, responses):
+        """Enregistre (upsert) les réponses {clé: réponse} d'un annotateur"""
+        root = str(get_absolute_path(root_directory))
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany("""
+                INSERT INTO reponses (root, image_key, annotateur, label_choisi, commentaire,
+                                      annotated, ignored, decision, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (root, image_key, annotateur) DO UPDATE SET
+                    label_choisi = excluded.label_choisi,
+                    commentaire = excluded.commentaire,
+                    annotated = excluded.annotated,
+                    ignored = excluded.ignored,
+                    decision = excluded.decision,
+                    updated_at = excluded.updated_at
+            """, [self._response_row(root, key, annotator_name, response, now)
+                  for key, response in responses.items()])
+            # Décision annulée: la paire redevient distribuable
+            conn.executemany(
+                "UPDATE distribution SET complete = 0 WHERE root = ? AND image_key = ? AND complete = 1",
+                [(root, key) for key, response in responses.items() if response_decision(response) is None]
+            )
+
+    def record_session(self, annotator_name, root_directory, current_index, current_key,
+                       total_images, filepath):
+        """Met à jour les métadonnées de session d'après son fichier de sauvegarde"""
+        filepath = Path(filepath)
+        stat = filepath.stat()
+        filename = filepath.name
+        save_mtime_ns = stat.st_mtime_ns
+        date_sauvegarde = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO sessions (annotateur, root, date_sauvegarde, current_index,
+                                                 current_key, total_images, filename, save_mtime_ns)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (annotator_name, str(get_absolute_path(root_directory)), date_sauvegarde,
+                  current_index, current_key, total_images, filename, save_mtime_ns))
+
+    def record_position(self, annotator_name, current_index, current_key):
+        """Met à jour la position courante d'une session existante"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE sessions SET current_index = ?, current_key = ? WHERE annotateur = ?",
+                (current_index, current_key, annotator_name)
+            )
+
+    def forget_session(self, annotator_name):
+        """Retire une session de la liste (ses réponses restent dans la base)"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE annotateur = ?", (annotator_name,))
+
+    def sync_save_files(self, on_error=None):
+        """
+        Importe les fichiers sauvegarde_*.json inconnus ou modifiés hors de la base
+        Seul un stat est fait par fichier; les fichiers inchangés ne sont pas relus.
+        """
+        conn = self._conn()
+        known = dict(conn.execute("SELECT filename, save_mtime_ns FROM sessions"))
+        present = set()
+        for filepath in SAVE_FOLDER.glob("sauvegarde_*.json"):
+            present.add(filepath.name)
+            try:
+                mtime_ns = filepath.stat().st_mtime_ns
+                if known.get(filepath.name) == mtime_ns:
+                    continue
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                if on_error is not None:
+                    on_error(filepath, e)
+                continue
+
+            annotator_name = data.get('annotateur', 'Inconnu')
+            root_directory = data.get('root_directory_absolute', data.get('root_directory', ''))
+            if data.get('version') == SAVE_VERSION:
+                # Les clés par position (v2) ne sont pas attribuables avant migration
+                self.record_responses(root_directory, annotator_name, data.get('responses', {}))
+            self.record_session(
+                annotator_name, root_directory, data.get('current_index', 0),
+                data.get('current_key'), data.get('total_images', 0), filepath
+            )
+
+        # Fichiers supprimés (annotation terminée ou nettoyage manuel)
+        with conn:
+            for filename in set(known) - present:
+                conn.execute("DELETE FROM sessions WHERE filename = ?", (filename,))
+
+    # ---------- requêtes ----------
+
+    def list_sessions(self):
+        """Sessions sauvegardées, plus récentes en premier"""
+        rows = self._conn().execute("""
+            SELECT annotateur, date_sauvegarde, current_index, total_images, filename, root
+            FROM sessions
+            ORDER BY date_sauvegarde DESC
+        """)
+        return [
+            {
+                'annotateur': annotator_name,
+                'date': date,
+                'progression': f"{current_index}/{total_images}",
+                'filename': filename,
+                'root_directory': root,
+                'filepath': str(SAVE_FOLDER / filename)
+            }
+            for annotator_name, date, current_index, total_images, filename, root in rows
+        ]
+
+    def unlabelled_keys(self, root_directory):
+        """
+        Clés des paires de l'index qu'aucun annotateur n'a encore traitées
+        Jointure avec l'index des dossiers: le dossier doit avoir été scanné.
+        """
+        root = str(get_absolute_path(root_directory))
+        conn = self._conn()
+        conn.execute("ATTACH DATABASE ? AS idx", (str(INDEX_FILE),))
+        try:
+            return [key for (key,) in conn.execute("""
+                SELECT p.folder || '/' || p.base_name AS image_key
+                FROM idx.paires p
+                WHERE p.root = ? AND NOT EXISTS (
+                    SELECT 1 FROM reponses r
+                    WHERE r.root = p.root
+                      AND r.decision IS NOT NULL
+                      AND r.image_key = p.folder || '/' || p.base_name
+                )
+                ORDER BY p.folder, p.rowid
+            """, (root,))]
+        finally:
+            conn.execute("DETACH DATABASE idx")
+
+    def disagreements(self, root_directory):
+        """
+        Images dont les décisions diffèrent entre annotateurs
+        Retourne [(clé, {annotateur: décision})], triées par clé.
+        """
+        root = str(get_absolute_path(root_directory))
+        rows = self._conn().execute("""
+            SELECT image_key, annotateur, decision FROM reponses
+            WHERE root = ? AND decision IS NOT NULL AND image_key IN (
+                SELECT image_key FROM reponses
+                WHERE root = ? AND decision IS NOT NULL
+                GROUP BY image_key
+                HAVING COUNT(DISTINCT decision) > 1
+            )
+            ORDER BY image_key, annotateur
+        """, (root, root))
+        result = {}
+        for key, annotator_name, decision in rows:
+            result.setdefault(key, {})[annotator_name] = decision
+        return sorted(result.items())
+
+    # ---------- distribution (mode équipe) ----------
+
+    def sync_dispatch(self, root_directory):
+        """
+        Aligne la table de distribution sur l'index des dossiers (paires ajoutées/supprimées)
+        À appeler après un scan, avant de distribuer des lots.
+        """
+        root = str(get_absolute_path(root_directory))
+        conn = self._conn()
+        conn.execute("ATTACH DATABASE ? AS idx", (str(INDEX_FILE),))
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT OR IGNORE INTO distribution (root, image_key, folder)
+                    SELECT root, folder || '/' || base_name, folder FROM idx.paires WHERE root = ?
+                """, (root,))
+                conn.execute("""
+                    DELETE FROM distribution WHERE root = ? AND image_key NOT IN (
+                        SELECT folder || '/' || base_name FROM idx.paires WHERE root = ?
+                    )
+                """, (root, root))
+        finally:
+            conn.execute("DETACH DATABASE idx")
+
+    def lease_batch(self, root_directory, annotator_name, batch_size=DISPATCH_BATCH_SIZE,
+                    lease_seconds=DISPATCH_LEASE_SECONDS, overlap_rate=DISPATCH_OVERLAP_RATE,
+                    priority_folders=DISPATCH_PRIORITY_FOLDERS):
+        """
+        Réserve jusqu'à batch_size paires pour un annotateur et retourne leurs clés
+        Les baux encore actifs de l'annotateur sont renouvelés et rendus en premier.
+        Une paire est distribuée tant que décisions + baux actifs d'autres
+        annotateurs restent sous sa cible (voir overlap_target). La transaction
+        est prise en écriture dès le début: deux sessions ne reçoivent jamais
+        la même paire au-delà de la cible. Les paires complètes sont marquées
+        au passage et sortent de l'index partiel des paires à faire; une paire
+        dont tous les baux sont pris porte leur échéance (disponible_apres) et
+        est écartée par l'index sans examiner ses baux.
+        """
+        root = str(get_absolute_path(root_directory))
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM baux WHERE expires_at < ?", (now,))
+
+            # Baux en cours de l'annotateur sur des paires qu'il n'a pas encore traitées
+            keys = [key for (key,) in conn.execute("""
+                SELECT b.image_key FROM baux b
+                WHERE b.root = ? AND b.annotateur = ? AND NOT EXISTS (
+                    SELECT 1 FROM reponses r
+                    WHERE r.root = b.root AND r.image_key = b.image_key
+                      AND r.annotateur = b.annotateur AND r.decision IS NOT NULL
+                )
+                ORDER BY b.image_key
+            """, (root, annotator_name))]
+
+            passes = [("AND folder = ?", (folder,)) for folder in priority_folders]
+            if priority_folders:
+                placeholders = ", ".join("?" * len(priority_folders))
+                passes.append((f"AND folder NOT IN ({placeholders})", tuple(priority_folders)))
+            else:
+                passes.append(("", ()))
+
+            # Filtrage dans SQLite: les paires déjà couvertes par des baux ne remontent pas
+            conn.create_function("cible", 1, lambda key: overlap_target(key, overlap_rate),
+                                 deterministic=True)
+            expires_at = now + lease_seconds
+            completed = []
+            renewed = [(expires_at, root, key) for key in keys]
+            saturated = []
+            for condition, params in passes:
+                if len(keys) >= batch_size:
+                    break
+                candidates = conn.execute(f"""
+                    SELECT image_key, decisions, leases, cible FROM (
+                        SELECT d.image_key, d.folder, cible(d.image_key) AS cible,
+                            (SELECT COUNT(*) FROM reponses r
+                             WHERE r.root = d.root AND r.image_key = d.image_key
+                               AND r.decision IS NOT NULL) AS decisions,
+                            (SELECT COUNT(*) FROM baux b
+                             WHERE b.root = d.root AND b.image_key = d.image_key) AS leases,
+                            EXISTS (SELECT 1 FROM reponses r
+                                    WHERE r.root = d.root AND r.image_key = d.image_key
+                                      AND r.annotateur = ? AND r.decision IS NOT NULL) AS done_by_me,
+                            EXISTS (SELECT 1 FROM baux b
+                                    WHERE b.root = d.root AND b.image_key = d.image_key
+                                      AND b.annotateur = ?) AS leased_by_me
+                        FROM distribution d
+                        WHERE d.root = ? AND d.complete = 0 AND d.disponible_apres <= ? {condition}
+                        ORDER BY d.folder, d.image_key
+                    )
+                    WHERE decisions >= cible
+                       OR (decisions + leases < cible AND NOT done_by_me AND NOT leased_by_me)
+                """, (annotator_name, annotator_name, root, now) + params)
+                for key, decisions, leases, target in candidates:
+                    if decisions >= target:
+                        completed.append((root, key))
+                        continue
+                    keys.append(key)
+                    if decisions + leases + 1 >= target:
+                        saturated.append((expires_at, root, key))
+                    if len(keys) >= batch_size:
+                        break
+
+            conn.executemany(
+                "UPDATE distribution SET complete = 1 WHERE root = ? AND image_key = ?", completed
+            )
+            conn.executemany("""
+                UPDATE distribution SET disponible_apres = ?
+                WHERE root = ? AND image_key = ? AND complete = 0
+            """, saturated)
+            conn.executemany("""
+                UPDATE distribution SET disponible_apres = ?
+                WHERE root = ? AND image_key = ? AND disponible_apres > 0
+            """, renewed)
+            conn.executemany("""
+                INSERT OR REPLACE INTO baux (root, image_key, annotateur, expires_at)
+                VALUES (?, ?, ?, ?)
+            """, [(root, key, annotator_name, expires_at) for key in keys])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return keys
+
+    def release_leases(self, root_directory, annotator_name):
+        """Rend les paires réservées par un annotateur (fin ou abandon de session)"""
+        root = str(get_absolute_path(root_directory))
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                UPDATE distribution SET disponible_apres = 0
+                WHERE root = ? AND image_key IN (
+                    SELECT image_key FROM baux WHERE root = ? AND annotateur = ?
+                )
+            """, (root, root, annotator_name))
+            conn.execute("DELETE FROM baux WHERE root = ? AND annotateur = ?", (root, annotator_name))
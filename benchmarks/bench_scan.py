@@ -0,0 +1,77 @@
+"""
+Débit du scan des sous-dossiers selon le nombre de dossiers et de fichiers
+
+    python benchmarks/bench_scan.py [--dossiers 4 32 128] [--paires 100 1000] [--latence-ms 2]
+
+Génère des arborescences synthétiques (paires _bbox/_crop vides) dans un
+dossier temporaire et compare le parcours séquentiel (1 thread) au pool
+de SCAN_WORKERS threads. --latence-ms ajoute un délai à chaque lecture de
+dossier pour simuler un montage réseau (NFS/SMB).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from annotation_core import SCAN_WORKERS, iter_image_pairs
+
+def make_tree(root, folders, pairs_per_folder):
+    """Crée `folders` sous-dossiers de `pairs_per_folder` paires chacun"""
+    for f in range(folders):
+        folder = root / f"classe_{f:04d}"
+        folder.mkdir()
+        for p in range(pairs_per_folder):
+            base = f"20250327_143847_400000_{p:06d}_{882827021 + p}"
+            (folder / f"{base}_bbox.png").touch()
+            (folder / f"{base}_crop.png").touch()
+
+def with_latency(latency_s):
+    """Ajoute `latency_s` secondes à chaque os.scandir / os.stat; retourne la fonction de restauration"""
+    real_scandir, real_stat = os.scandir, os.stat
+
+    def slow_scandir(*args, **kwargs):
+        time.sleep(latency_s)
+        return real_scandir(*args, **kwargs)
+
+    def slow_stat(*args, **kwargs):
+        time.sleep(latency_s)
+        return real_stat(*args, **kwargs)
+
+    def restore():
+        os.scandir, os.stat = real_scandir, real_stat
+
+    os.scandir, os.stat = slow_scandir, slow_stat
+    return restore
+
+def time_scan(root, workers):
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_image_pairs(root, workers=workers))
+    return count, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dossiers", type=int, nargs="+", default=[4, 32, 128])
+    parser.add_argument("--paires", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--latence-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    print(f"{'dossiers':>8} {'paires/dossier':>14} {'threads':>7} {'temps (s)':>10} {'paires/s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for folders in args.dossiers:
+            for pairs in args.paires:
+                root = Path(tmp) / f"arbre_{folders}_{pairs}"
+                root.mkdir()
+                make_tree(root, folders, pairs)
+                restore = with_latency(args.latence_ms / 1000) if args.latence_ms else None
+                for workers in (1, SCAN_WORKERS):
+                    count, elapsed = time_scan(root, workers)
+                    print(f"{folders:>8} {pairs:>14} {workers:>7} {elapsed:>10.3f} {count / elapsed:>10.0f}")
+                if restore is not None:
+                    restore()
+
+if __name__ == "__main__":
+    main()
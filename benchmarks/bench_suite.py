@@ -0,0 +1,205 @@
+"""
+Suite de mesures des chemins critiques (scan, sauvegarde, sessions, export)
+
+    python benchmarks/bench_suite.py [--paires 1000 10000 100000] [--arbres DOSSIER]
+                                     [--sortie resultats.json] [--reference reference.json]
+                                     [--tolerance 0.3] [--repetitions 3] [--enregistrer-reference]
+
+Pour chaque taille, un arbre synthétique (voir synthetic_tree.py) est
+généré puis chaque cas est mesuré: meilleur temps réel sur --repetitions
+exécutions sans traçage, puis pic de mémoire Python (tracemalloc). Les
+sauvegardes, l'index et la base partagée sont redirigés vers un dossier
+temporaire. Les résultats sont écrits en JSON et comparés à la référence:
+le code de sortie est 1 si un cas est plus lent ou plus gourmand que la
+référence au-delà de la tolérance.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import annotation_core as core
+import annotation_store
+from annotation_core import CLASSES_DISPONIBLES
+from annotation_store import AnnotationStore
+from synthetic_tree import TREE_DEPTH, make_synthetic_tree
+
+BENCH_FOLDER = Path(__file__).resolve().parent
+RESULTS_FILE = BENCH_FOLDER / "resultats.json"
+BASELINE_FILE = BENCH_FOLDER / "reference.json"
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Exécutions chronométrées par cas (la plus rapide est retenue)
+REPEATS = 3
+# Sauvegardes d'annotateurs présentes pour la liste des sessions
+SESSION_COUNT = 5
+# Écart relatif toléré, et écarts absolus en dessous desquels on ignore le bruit
+TOLERANCE = 0.3
+NOISE_SECONDS = 0.005
+NOISE_BYTES = 256 * 1024
+
+def isolate_storage(folder):
+    """Redirige sauvegardes, index et exports vers `folder` (modules déjà importés)"""
+    folder.mkdir(parents=True, exist_ok=True)
+    for module in (core, annotation_store):
+        module.SAVE_FOLDER = folder
+        module.INDEX_FILE = folder / "index_images.sqlite"
+    core.EXPORT_FOLDER = folder / "exports"
+
+def make_responses(images_data):
+    """Réponses d'une session à moitié annotée (une image ignorée sur dix)"""
+    responses = {}
+    for i, img in enumerate(images_data):
+        if i % 2:
+            continue
+        ignored = i % 10 == 0
+        responses[img["key"]] = {
+            "label_choisi": None if ignored else CLASSES_DISPONIBLES[i % len(CLASSES_DISPONIBLES)],
+            "commentaire": "",
+            "annotated": not ignored,
+            "ignored": ignored
+        }
+    return responses
+
+def build_cases(root, storage):
+    """Liste de (nom, préparation, mesure) pour un arbre donné"""
+    state = {}
+
+    def cold_index():
+        core.INDEX_FILE.unlink(missing_ok=True)
+
+    def scan():
+        state["images"] = core.scan_images_directory(root, TREE_DEPTH)
+        state.pop("responses", None)
+
+    def with_responses():
+        if "responses" not in state:
+            state["responses"] = make_responses(state["images"])
+
+    def save():
+        images = state["images"]
+        core.write_snapshot("bench", str(root), state["responses"], 0, images[0]["key"], len(images))
+
+    def load():
+        core.load_progress("bench")
+
+    def write_sessions():
+        for s in range(SESSION_COUNT):
+            # Fichiers réécrits (nouveau mtime): réimportés par la mesure suivante
+            core.write_snapshot(f"bench_{s}", str(root), state["responses"], 0, None, len(state["images"]))
+
+    def list_sessions():
+        store = AnnotationStore(storage / "annotations.sqlite")
+        store.sync_save_files()
+        store.list_sessions()
+
+    def export():
+        core.export_annotations(state["images"], state["responses"], storage / "export.csv", "csv")
+
+    return [
+        ("scan_froid", cold_index, scan),
+        ("scan_chaud", None, scan),
+        ("sauvegarde", with_responses, save),
+        ("chargement", None, load),
+        ("sessions_import", write_sessions, list_sessions),
+        ("sessions_liste", None, list_sessions),
+        ("export_csv", None, export),
+    ]
+
+def measure(prepare, run, repeats=REPEATS):
+    """(secondes, pic mémoire en octets): meilleur temps sur `repeats` exécutions, puis une exécution tracée"""
+    elapsed = float("inf")
+    for _ in range(repeats):
+        if prepare is not None:
+            prepare()
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    if prepare is not None:
+        prepare()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak
+
+def compare(results, baseline, tolerance):
+    """Cas en régression par rapport à la référence: liste de messages"""
+    reference = {(r["cas"], r["paires"]): r for r in baseline.get("resultats", [])}
+    regressions = []
+    for result in results:
+        ref = reference.get((result["cas"], result["paires"]))
+        if ref is None:
+            continue
+        for field, noise, unit in (("secondes", NOISE_SECONDS, "s"), ("pic_octets", NOISE_BYTES, "o")):
+            before, after = ref[field], result[field]
+            if after > before * (1 + tolerance) and after - before > noise:
+                regressions.append(f"{result['cas']} ({result['paires']} paires): {field} "
+                                   f"{before:.4g}{unit} -> {after:.4g}{unit} (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paires", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--arbres", help="Dossier où garder les arbres générés (réutilisés d'une exécution à l'autre)")
+    parser.add_argument("--sortie", default=str(RESULTS_FILE))
+    parser.add_argument("--reference", default=str(BASELINE_FILE))
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--repetitions", type=int, default=REPEATS)
+    parser.add_argument("--enregistrer-reference", action="store_true",
+                        help="Écrire aussi les résultats comme nouvelle référence")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'cas':<16} {'paires':>8} {'temps (s)':>10} {'pic (Mo)':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        trees = Path(args.arbres) if args.arbres else Path(tmp) / "arbres"
+        for pairs in args.paires:
+            root = trees / f"arbre_{pairs}"
+            make_synthetic_tree(root, pairs)
+            storage = Path(tmp) / f"stockage_{pairs}"
+            isolate_storage(storage)
+            for name, prepare, run in build_cases(root, storage):
+                elapsed, peak = measure(prepare, run, args.repetitions)
+                results.append({"cas": name, "paires": pairs, "secondes": elapsed, "pic_octets": peak})
+                print(f"{name:<16} {pairs:>8} {elapsed:>10.4f} {peak / 1024 / 1024:>9.1f}")
+
+    report = {
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "resultats": results
+    }
+    Path(args.sortie).write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f"Résultats: {args.sortie}")
+    if args.enregistrer_reference:
+        Path(args.reference).write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"Référence enregistrée: {args.reference}")
+        return 0
+
+    try:
+        baseline = json.loads(Path(args.reference).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        print("Pas de référence: comparaison ignorée (--enregistrer-reference pour en créer une)")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+        print(f"⚠️ {message}")
+    if not regressions:
+        print(f"✅ Aucune régression par rapport à {args.reference} (tolérance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
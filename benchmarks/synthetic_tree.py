@@ -0,0 +1,78 @@
+"""
+Générateur d'arborescences synthétiques au format des vraies données
+
+    python benchmarks/synthetic_tree.py DOSSIER --paires 100000 [--manquantes 0.02] [--par-dossier 2000]
+
+Un sous-dossier par classe de CLASSES_DISPONIBLES, chacun découpé en lots
+(sous-dossiers imbriqués lot_XXXX, profondeur 2) de --par-dossier paires
+au plus. Les noms suivent le schéma réel (<date>_<heure>_<n>_<id>_bbox.png /
+_crop.png); une part --manquantes des paires n'a qu'une des deux moitiés.
+Les fichiers sont vides: seuls les noms comptent pour le scan, les
+sauvegardes et l'export. Un fichier .synthetique.json décrit l'arbre, qui
+est réutilisé tel quel s'il correspond déjà aux paramètres demandés.
+"""
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from annotation_core import CLASSES_DISPONIBLES
+
+PAIRS_PER_FOLDER = 2000
+MISSING_RATIO = 0.02
+TREE_DEPTH = 2
+MARKER_NAME = ".synthetique.json"
+
+def make_synthetic_tree(root, pairs, missing_ratio=MISSING_RATIO, pairs_per_folder=PAIRS_PER_FOLDER, seed=0):
+    """
+    Crée (ou réutilise) l'arborescence de `pairs` paires sous `root`
+    Retourne le nombre de paires complètes (les moitiés orphelines sont exclues).
+    """
+    root = Path(root)
+    params = {"paires": pairs, "manquantes": missing_ratio, "par_dossier": pairs_per_folder, "graine": seed}
+    marker = root / MARKER_NAME
+    try:
+        existing = json.loads(marker.read_text(encoding='utf-8'))
+        if existing["parametres"] == params:
+            return existing["completes"]
+    except (OSError, ValueError, KeyError):
+        pass
+    if root.exists() and any(root.iterdir()):
+        raise FileExistsError(f"{root} n'est pas vide et n'est pas un arbre synthétique de mêmes paramètres")
+
+    rng = random.Random(seed)
+    complete = 0
+    per_class = -(-pairs // len(CLASSES_DISPONIBLES))
+    for c, label in enumerate(CLASSES_DISPONIBLES):
+        count = min(per_class, pairs - c * per_class)
+        for start in range(0, max(count, 0), pairs_per_folder):
+            folder = root / label / f"lot_{start // pairs_per_folder:04d}"
+            folder.mkdir(parents=True)
+            for p in range(start, min(start + pairs_per_folder, count)):
+                base = f"2025{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}_{rng.randint(0, 235959):06d}_{p:06d}_{882827021 + p}"
+                if rng.random() < missing_ratio:
+                    # Moitié orpheline (bbox ou crop seul)
+                    (folder / f"{base}{rng.choice(('_bbox', '_crop'))}.png").touch()
+                    continue
+                (folder / f"{base}_bbox.png").touch()
+                (folder / f"{base}_crop.png").touch()
+                complete += 1
+
+    marker.write_text(json.dumps({"parametres": params, "completes": complete}), encoding='utf-8')
+    return complete
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dossier")
+    parser.add_argument("--paires", type=int, default=10000)
+    parser.add_argument("--manquantes", type=float, default=MISSING_RATIO)
+    parser.add_argument("--par-dossier", type=int, default=PAIRS_PER_FOLDER)
+    args = parser.parse_args()
+    complete = make_synthetic_tree(args.dossier, args.paires, args.manquantes, args.par_dossier)
+    print(f"{complete} paires complètes dans {args.dossier} (profondeur {TREE_DEPTH})")
+
+if __name__ == "__main__":
+    main()
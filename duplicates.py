@@ -0,0 +1,169 @@
+"""
+Détection des quasi-doublons entre imagettes (crops) par empreinte perceptuelle
+Empreinte dHash 64 bits calculée avec NumPy, mise en cache par chemin + mtime,
+puis recherche des voisins par table de hachage multi-index (4 blocs de 16 bits).
+"""
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from annotation_core import SAVE_FOLDER
+
+HASH_CACHE_FILE = SAVE_FOLDER / "empreintes.sqlite"
+HASH_WORKERS = 8
+HASH_BATCH_SIZE = 256
+
+# Distance de Hamming maximale entre deux empreintes de quasi-doublons.
+# La recherche multi-index (4 blocs) est exacte jusqu'à 3 bits.
+DUPLICATE_MAX_DISTANCE = 3
+HASH_BLOCKS = 4
+
+# Nombre de bits à 1 de chaque octet (distance de Hamming par table)
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+def _load_thumbnail(path):
+    """Image en niveaux de gris réduite à 9x8 pixels (tableau uint8)"""
+    with Image.open(path) as img:
+        img.draft("L", (64, 64))
+        return np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.uint8)
+
+def dhash_batch(thumbnails):
+    """
+    Empreintes dHash d'un lot de miniatures 9x8 (tableau (n, 8, 9))
+    Chaque bit compare deux pixels voisins d'une ligne; retourne un tableau uint64.
+    """
+    bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(thumbnails), 64), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+def _open_cache():
+    SAVE_FOLDER.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(HASH_CACHE_FILE, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS empreintes (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            dhash INTEGER NOT NULL
+        )
+    """)
+    return conn
+
+def _to_signed(value):
+    """uint64 -> int64 (SQLite ne stocke que des entiers signés)"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def compute_hashes(paths, workers=HASH_WORKERS):
+    """
+    Empreintes dHash {path: int} des images, calculées seulement si absentes du cache
+    ou si le fichier a changé (mtime/taille). Les images illisibles sont omises.
+    """
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            continue
+
+    conn = _open_cache()
+    try:
+        hashes = {}
+        for path, mtime_ns, size, dhash in conn.execute("SELECT path, mtime_ns, size, dhash FROM empreintes"):
+            if stats.get(path) == (mtime_ns, size):
+                hashes[path] = dhash & 0xFFFFFFFFFFFFFFFF
+
+        missing = [path for path in stats if path not in hashes]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dhash") as executor:
+            for start in range(0, len(missing), HASH_BATCH_SIZE):
+                batch = missing[start:start + HASH_BATCH_SIZE]
+                thumbnails = list(executor.map(_safe_thumbnail, batch))
+                readable = [(path, thumb) for path, thumb in zip(batch, thumbnails) if thumb is not None]
+                if not readable:
+                    continue
+                values = dhash_batch(np.stack([thumb for _, thumb in readable]))
+                rows = []
+                for (path, _), value in zip(readable, values.tolist()):
+                    hashes[path] = value
+                    rows.append((path, stats[path][0], stats[path][1], _to_signed(value)))
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO empreintes (path, mtime_ns, size, dhash) VALUES (?, ?, ?, ?)",
+                        rows
+                    )
+    finally:
+        conn.close()
+    return hashes
+
+def _safe_thumbnail(path):
+    try:
+        return _load_thumbnail(path)
+    except (OSError, ValueError):
+        # Image illisible: ignorée ici
+        return None
+
+def find_near_duplicates(hashes, max_distance=DUPLICATE_MAX_DISTANCE):
+    """
+    Paires (i, j), i < j, d'empreintes à distance de Hamming <= max_distance
+    Table multi-index: deux empreintes à moins de HASH_BLOCKS bits de
+    différence partagent au moins un bloc de 16 bits identique; seules les
+    empreintes d'un même seau sont comparées.
+    """
+    if max_distance >= HASH_BLOCKS:
+        raise ValueError(f"max_distance doit être < {HASH_BLOCKS} pour une recherche exacte")
+
+    values = np.asarray(hashes, dtype=np.uint64)
+    block_bits = 64 // HASH_BLOCKS
+    mask = np.uint64((1 << block_bits) - 1)
+    pairs = set()
+    for block in range(HASH_BLOCKS):
+        chunks = (values >> np.uint64(block * block_bits)) & mask
+        order = np.argsort(chunks, kind="stable")
+        # Frontières des seaux (valeurs de bloc identiques)
+        boundaries = np.flatnonzero(np.diff(chunks[order])) + 1
+        for bucket in np.split(order, boundaries):
+            if len(bucket) < 2:
+                continue
+            bucket.sort()
+            bucket_values = values[bucket]
+            # Distances de Hamming vectorisées, par tranches de lignes pour borner la mémoire
+            for start in range(0, len(bucket), HASH_BATCH_SIZE):
+                xor = bucket_values[start:start + HASH_BATCH_SIZE, None] ^ bucket_values[None, :]
+                distances = _POPCOUNT[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1)
+                rows, cols = np.nonzero(distances <= max_distance)
+                rows += start
+                keep = cols > rows
+                pairs.update(zip(bucket[rows[keep]].tolist(), bucket[cols[keep]].tolist()))
+    return pairs
+
+def find_duplicate_groups(images_data, max_distance=DUPLICATE_MAX_DISTANCE):
+    """
+    Groupes de quasi-doublons (clés, dans l'ordre de images_data), d'après le crop
+    Les groupes peuvent traverser les sous-dossiers de classe.
+    """
+    hashes = compute_hashes([img["crop_path"] for img in images_data])
+    hashed = [img for img in images_data if img["crop_path"] in hashes]
+    pairs = find_near_duplicates([hashes[img["crop_path"]] for img in hashed], max_distance)
+
+    # Union-find sur les paires proches
+    parent = list(range(len(hashed)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i, img in enumerate(hashed):
+        groups.setdefault(find(i), []).append(img["key"])
+    return [keys for keys in groups.values() if len(keys) > 1]
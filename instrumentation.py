@@ -0,0 +1,209 @@
+"""
+Instrumentation des exécutions (reruns) de l'application
+Chronomètres par étape et compteurs (images décodées, octets lus,
+sauvegardes écrites...), historique des dernières exécutions et fichier
+texte au format Prometheus pour un collecteur local. La mesure se décide
+par exécution (chaque session choisit); hors exécution (threads de fond),
+ANNOTATION_PROFILAGE=1 l'active pour tout le processus. Sans mesure, chaque
+appel se réduit à un test d'attribut.
+
+    ANNOTATION_PROFILAGE=1 streamlit run add_images_to_dataset2026.py
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from annotation_core import SAVE_FOLDER
+
+PROFILING_ENABLED = os.environ.get("ANNOTATION_PROFILAGE", "") == "1"
+PROFILE_HISTORY = 200
+METRICS_FILE = SAVE_FOLDER / "metriques.prom"
+# Intervalle minimal entre deux écritures du fichier de métriques
+METRICS_WRITE_SECONDS = 10
+
+class _NullStage:
+    """Étape sans effet (profilage désactivé)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._add_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+class Profiler:
+    """
+    Mesures des exécutions, partagées par toutes les sessions du processus
+    L'exécution en cours est propre au thread (une session Streamlit = un
+    thread de script): begin_run indique si elle est mesurée. `enabled` est
+    la valeur par défaut et vaut pour les mesures faites hors exécution
+    (préchargement en arrière-plan), qui n'alimentent que les totaux.
+    """
+
+    def __init__(self, enabled=PROFILING_ENABLED, history=PROFILE_HISTORY, metrics_path=METRICS_FILE):
+        self.enabled = enabled
+        self.metrics_path = metrics_path
+        self.runs = deque(maxlen=history)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stage_totals = {}
+        self._counters = {}
+        self._run_count = 0
+        self._run_seconds = 0.0
+        self._last_write = 0.0
+
+    # ---------- exécutions ----------
+
+    def active(self):
+        """Vrai si le thread courant mesure (exécution mesurée, ou hors exécution avec `enabled`)"""
+        return getattr(self._local, "recording", self.enabled)
+
+    def begin_run(self, session, label, enabled=None):
+        """
+        Début d'une exécution; une exécution du même thread restée ouverte (st.rerun) est close
+        enabled: mesure de cette exécution (défaut: `enabled` du profileur)
+        """
+        if getattr(self._local, "run", None) is not None:
+            self.end_run(interrupted=True)
+        self._local.recording = self.enabled if enabled is None else enabled
+        if not self._local.recording:
+            return
+        self._local.run = {
+            "session": session,
+            "execution": label,
+            "heure": time.time(),
+            "debut": time.perf_counter(),
+            "etapes": {},
+            "compteurs": {},
+            "ouvertes": {}
+        }
+
+    def end_run(self, interrupted=False):
+        """Fin d'une exécution: historique, totaux et fichier de métriques (au plus toutes les METRICS_WRITE_SECONDS)"""
+        run = getattr(self._local, "run", None)
+        self._local.run = None
+        self._local.__dict__.pop("recording", None)
+        if run is None:
+            return
+        total = time.perf_counter() - run.pop("debut")
+        run.pop("ouvertes")
+        run["total"] = total
+        run["interrompue"] = interrupted
+        with self._lock:
+            self.runs.append(run)
+            self._run_count += 1
+            self._run_seconds += total
+            due = time.monotonic() - self._last_write >= METRICS_WRITE_SECONDS
+            if due:
+                self._last_write = time.monotonic()
+        if due:
+            self.write_metrics()
+
+    # ---------- étapes et compteurs ----------
+
+    def stage(self, name):
+        """Chronomètre une étape: with PROFILER.stage("scan"): ..."""
+        if not self.active():
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def start(self, name):
+        """Début d'une étape qui ne tient pas dans un bloc with (fermée par stop)"""
+        if not self.active():
+            return
+        run = getattr(self._local, "run", None)
+        if run is not None:
+            run["ouvertes"][name] = time.perf_counter()
+
+    def stop(self, name):
+        if not self.active():
+            return
+        run = getattr(self._local, "run", None)
+        if run is not None and name in run["ouvertes"]:
+            self._add_stage(name, time.perf_counter() - run["ouvertes"].pop(name))
+
+    def _add_stage(self, name, seconds):
+        run = getattr(self._local, "run", None)
+        if run is not None:
+            run["etapes"][name] = run["etapes"].get(name, 0.0) + seconds
+        with self._lock:
+            totals = self._stage_totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def count(self, name, n=1):
+        """Incrémente un compteur (exécution en cours et total du processus)"""
+        if not self.active():
+            return
+        run = getattr(self._local, "run", None)
+        if run is not None:
+            run["compteurs"][name] = run["compteurs"].get(name, 0) + n
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    # ---------- restitution ----------
+
+    def recent_runs(self, session, limit=20):
+        """Dernières exécutions d'une session, plus récentes en premier"""
+        with self._lock:
+            runs = [run for run in self.runs if run["session"] == session]
+        return runs[::-1][:limit]
+
+    def prometheus_text(self):
+        """Totaux du processus au format texte Prometheus"""
+        with self._lock:
+            stages = {name: tuple(values) for name, values in self._stage_totals.items()}
+            counters = dict(self._counters)
+            run_count, run_seconds = self._run_count, self._run_seconds
+        lines = [
+            "# HELP annotation_reruns_total Exécutions (reruns) mesurées",
+            "# TYPE annotation_reruns_total counter",
+            f"annotation_reruns_total {run_count}",
+            "# HELP annotation_rerun_seconds_total Durée cumulée des exécutions",
+            "# TYPE annotation_rerun_seconds_total counter",
+            f"annotation_rerun_seconds_total {run_seconds:.6f}",
+            "# HELP annotation_stage_seconds_total Durée cumulée par étape",
+            "# TYPE annotation_stage_seconds_total counter",
+        ]
+        lines += [f'annotation_stage_seconds_total{{etape="{name}"}} {seconds:.6f}'
+                  for name, (_, seconds) in sorted(stages.items())]
+        lines += [
+            "# HELP annotation_stage_calls_total Passages par étape",
+            "# TYPE annotation_stage_calls_total counter",
+        ]
+        lines += [f'annotation_stage_calls_total{{etape="{name}"}} {calls}'
+                  for name, (calls, _) in sorted(stages.items())]
+        lines += [
+            "# HELP annotation_events_total Compteurs d'événements",
+            "# TYPE annotation_events_total counter",
+        ]
+        lines += [f'annotation_events_total{{compteur="{name}"}} {value}'
+                  for name, value in sorted(counters.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        """Écrit le fichier de métriques (remplacement atomique); une erreur d'écriture est ignorée"""
+        try:
+            self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.metrics_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(self.prometheus_text(), encoding='utf-8')
+            os.replace(tmp_path, self.metrics_path)
+        except OSError:
+            pass
+
+PROFILER = Profiler()
@@ -0,0 +1,206 @@
+"""
+Vérification préalable de l'intégrité des paires d'images
+Chaque fichier est décodé dans un pool de processus (Image.verify puis
+chargement complet des pixels) et ses dimensions sont relevées; les résultats
+sont mis en cache par chemin + mtime + taille, si bien qu'une nouvelle
+vérification ne relit que les fichiers ajoutés ou modifiés. Les paires sont
+ensuite contrôlées (crop plus grand que la bbox, image minuscule) et les
+moitiés orphelines (_bbox sans _crop ou l'inverse, ignorées par le scan) sont
+listées. Le rapport est enregistré par dossier racine: la file d'annotation
+s'en sert pour sauter les paires invalides.
+"""
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from PIL import Image
+
+from annotation_core import (
+    SAVE_FOLDER,
+    SCAN_MAX_DEPTH,
+    get_absolute_path,
+    process_pool,
+    split_image_name,
+    walk_image_folders,
+)
+
+INTEGRITY_CACHE_FILE = SAVE_FOLDER / "integrite.sqlite"
+INTEGRITY_WORKERS = os.cpu_count() or 2
+# Fichiers vérifiés par tâche du pool (un aller-retour entre processus par lot)
+INTEGRITY_BATCH_SIZE = 64
+# Chemins par requête de lecture du cache (limite des paramètres SQLite)
+CACHE_QUERY_CHUNK = 500
+# Côté minimal (pixels) d'une image exploitable
+MIN_IMAGE_SIDE = 4
+
+def check_image(path):
+    """
+    Décode entièrement une image; retourne (largeur, hauteur, erreur)
+    erreur vaut None si l'image est lisible et assez grande.
+    """
+    try:
+        if os.path.getsize(path) == 0:
+            return 0, 0, "fichier vide"
+        with Image.open(path) as img:
+            # verify() contrôle la structure (sommes CRC du PNG) sans décoder les pixels
+            img.verify()
+        # verify() rend l'objet inutilisable: rouvrir pour le décodage complet (détecte la troncature)
+        with Image.open(path) as img:
+            img.load()
+            width, height = img.size
+    except Exception as e:
+        # Les décodeurs de Pillow lèvent des types très variés (SyntaxError, struct.error...)
+        return 0, 0, f"illisible ({type(e).__name__}: {e})"
+    if min(width, height) < MIN_IMAGE_SIDE:
+        return width, height, f"image trop petite ({width}x{height})"
+    return width, height, None
+
+def _check_batch(paths):
+    """Exécuté dans un processus du pool"""
+    return [check_image(path) for path in paths]
+
+def _open_cache():
+    SAVE_FOLDER.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(INTEGRITY_CACHE_FILE, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS fichiers (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            largeur INTEGER NOT NULL,
+            hauteur INTEGER NOT NULL,
+            erreur TEXT
+        );
+        CREATE TABLE IF NOT EXISTS rapports (
+            root TEXT PRIMARY KEY,
+            rapport TEXT NOT NULL
+        );
+    """)
+    return conn
+
+def check_files(paths, workers=INTEGRITY_WORKERS):
+    """
+    Résultats {path: (largeur, hauteur, erreur)} des fichiers, décodés seulement
+    s'ils sont absents du cache ou ont changé (mtime/taille)
+    Retourne aussi le nombre de fichiers réellement décodés.
+    """
+    results = {}
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            results[path] = (0, 0, "fichier absent")
+
+    conn = _open_cache()
+    try:
+        # Seules les entrées du catalogue sont lues, pas celles des autres dossiers vérifiés
+        known = list(stats)
+        for start in range(0, len(known), CACHE_QUERY_CHUNK):
+            chunk = known[start:start + CACHE_QUERY_CHUNK]
+            for path, mtime_ns, size, width, height, error in conn.execute(
+                    "SELECT path, mtime_ns, size, largeur, hauteur, erreur FROM fichiers "
+                    f"WHERE path IN ({','.join('?' * len(chunk))})", chunk):
+                if stats[path] == (mtime_ns, size):
+                    results[path] = (width, height, error)
+
+        missing = [path for path in stats if path not in results]
+        batches = [missing[start:start + INTEGRITY_BATCH_SIZE]
+                   for start in range(0, len(missing), INTEGRITY_BATCH_SIZE)]
+        if batches:
+            with process_pool(workers) as executor:
+                for batch, checks in zip(batches, executor.map(_check_batch, batches)):
+                    rows = []
+                    for path, check in zip(batch, checks):
+                        results[path] = check
+                        rows.append((path, *stats[path], *check))
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO fichiers (path, mtime_ns, size, largeur, hauteur, erreur) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            rows
+                        )
+    finally:
+        conn.close()
+    return results, len(missing)
+
+def pair_problems(bbox_check, crop_check):
+    """Problèmes d'une paire d'après les vérifications de ses deux moitiés: liste de [partie, message]"""
+    problems = [[part, check[2]] for part, check in (("bbox", bbox_check), ("crop", crop_check))
+                if check[2] is not None]
+    if not problems:
+        (bbox_width, bbox_height, _), (crop_width, crop_height, _) = bbox_check, crop_check
+        if crop_width > bbox_width or crop_height > bbox_height:
+            problems.append(["paire", f"crop plus grand que la bbox ({crop_width}x{crop_height} > "
+                                      f"{bbox_width}x{bbox_height})"])
+    return problems
+
+def _folder_orphans(root_path, folder):
+    """Moitiés sans leur partenaire dans un sous-dossier (exécuté dans un thread)"""
+    halves = {}
+    try:
+        with os.scandir(root_path / folder) as entries:
+            for entry in entries:
+                parsed = split_image_name(entry.name)
+                if parsed is not None and parsed[1] is not None and not entry.is_dir():
+                    halves.setdefault(parsed[0], {})[parsed[1]] = entry.name
+    except FileNotFoundError:
+        return []
+    return [f"{folder}/{files.get('bbox') or files.get('crop')}"
+            for files in halves.values() if len(files) == 1]
+
+def find_orphans(root_dir, max_depth=SCAN_MAX_DEPTH, workers=INTEGRITY_WORKERS):
+    """Chemins relatifs des moitiés orphelines, dans les sous-dossiers parcourus par le scan"""
+    root_path = get_absolute_path(root_dir)
+    folders = [folder for folder, _, _, _ in walk_image_folders(root_path, None, max_depth)]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="orphelines") as executor:
+        orphans = [path for paths in executor.map(lambda folder: _folder_orphans(root_path, folder), folders)
+                   for path in paths]
+    return sorted(orphans)
+
+def check_integrity(images_data, max_depth=SCAN_MAX_DEPTH, workers=INTEGRITY_WORKERS):
+    """
+    Vérifie toutes les paires du catalogue et enregistre le rapport du dossier racine
+    Rapport: {"racine", "date", "paires", "decodes", "invalides": {clé: [[partie, message], ...]},
+    "orphelines": [chemins relatifs]}
+    """
+    checks, decoded = check_files([path for img in images_data for path in (img["bbox_path"], img["crop_path"])],
+                                  workers)
+    invalid = {}
+    for img in images_data:
+        problems = pair_problems(checks[img["bbox_path"]], checks[img["crop_path"]])
+        if problems:
+            invalid[img["key"]] = problems
+
+    report = {
+        "racine": images_data.root,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "paires": len(images_data),
+        "decodes": decoded,
+        "invalides": invalid,
+        "orphelines": find_orphans(images_data.root, max_depth, workers)
+    }
+    conn = _open_cache()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO rapports (root, rapport) VALUES (?, ?)",
+                         (images_data.root, json.dumps(report, ensure_ascii=False)))
+    finally:
+        conn.close()
+    return report
+
+def load_report(root_dir):
+    """Dernier rapport enregistré pour le dossier racine (None s'il n'a jamais été vérifié)"""
+    if not INTEGRITY_CACHE_FILE.exists():
+        return None
+    conn = _open_cache()
+    try:
+        row = conn.execute("SELECT rapport FROM rapports WHERE root = ?",
+                           (str(get_absolute_path(root_dir)),)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
@@ -0,0 +1,274 @@
+"""
+Matérialisation du jeu de données annoté sur disque
+Chaque paire annotée (non ignorée) est placée dans le dossier de sa classe
+choisie, par clone (reflink) quand le système de fichiers le permet, sinon
+par copie (le lien physique, qui partagerait le fichier avec la source, est
+optionnel); les fichiers sont traités en parallèle.
+Chaque exécution qui change quelque chose écrit une nouvelle version v<N>/
+(dossiers de classe, manifeste avec empreintes SHA-256, dataset.json) puis
+bascule atomiquement le lien `current` vers elle: les versions précédentes
+restent intactes. Les fichiers inchangés sont liés depuis la version
+précédente, seuls les fichiers ajoutés ou déplacés sont lus à la source; une
+exécution interrompue reprend la version en cours là où elle s'est arrêtée.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from annotation_core import CLASSES_DISPONIBLES
+
+MANIFEST_NAME = "manifest.jsonl"
+DATASET_INFO_NAME = "dataset.json"
+# Lien symbolique vers la dernière version complète
+CURRENT_NAME = "current"
+MATERIALIZE_WORKERS = 8
+# Ordre de préférence: lien physique, clone copy-on-write, copie
+MATERIALIZE_MODES = ("lien", "reflink", "copie")
+
+# ioctl FICLONE (Linux: btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+def file_sha256(path):
+    """Empreinte SHA-256 du contenu d'un fichier (manifeste)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _reflink(source, target):
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+def place_file(source, target, mode="lien"):
+    """
+    Place `source` en `target` (remplacement atomique) selon le premier mode
+    disponible à partir de `mode`; retourne le mode effectivement utilisé.
+    """
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        for candidate in MATERIALIZE_MODES[MATERIALIZE_MODES.index(mode):]:
+            try:
+                if candidate == "lien":
+                    os.link(source, tmp_path)
+                elif candidate == "reflink":
+                    if not sys.platform.startswith("linux"):
+                        continue
+                    _reflink(source, tmp_path)
+                else:
+                    shutil.copy2(source, tmp_path)
+            except OSError as e:
+                tmp_path.unlink(missing_ok=True)
+                # Lien ou clone impossible ici (autre volume, non supporté): mode suivant
+                if candidate != "copie" and e.errno in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP,
+                                                        errno.ENOTTY, errno.EINVAL, errno.EMLINK):
+                    continue
+                raise
+            os.replace(tmp_path, target)
+            return candidate
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def version_path(dataset_path, version):
+    """Dossier d'une version du jeu de données"""
+    return Path(dataset_path) / f"v{version}"
+
+def current_version(dataset_path):
+    """Numéro de la version publiée (cible du lien `current`), None si aucune"""
+    try:
+        target = Path(os.readlink(Path(dataset_path) / CURRENT_NAME)).name
+    except OSError:
+        return None
+    return int(target[1:]) if target.startswith("v") and target[1:].isdigit() else None
+
+def _publish(dataset_path, version):
+    """Bascule atomique du lien `current` vers la version"""
+    tmp_path = dataset_path / f".{CURRENT_NAME}.{os.getpid()}.tmp"
+    tmp_path.unlink(missing_ok=True)
+    os.symlink(f"v{version}", tmp_path)
+    os.replace(tmp_path, dataset_path / CURRENT_NAME)
+
+def plan_dataset(images_data, responses):
+    """
+    Fichiers attendus {chemin relatif: chemin source} pour les paires annotées
+    Le sous-dossier source préfixe le nom pour éviter les collisions entre dossiers.
+    """
+    plan = {}
+    for img in images_data:
+        response = responses.get(img["key"], {})
+        label = response.get("label_choisi")
+        if response.get("ignored", False) or not response.get("annotated", False) or label not in CLASSES_DISPONIBLES:
+            continue
+        prefix = img["folder"].replace("/", "__")
+        for name, path in ((img["bbox_file"], img["bbox_path"]), (img["crop_file"], img["crop_path"])):
+            plan[f"{label}/{prefix}__{name}"] = path
+    return plan
+
+def load_manifest(dataset_path):
+    """{chemin relatif: entrée} (la dernière ligne d'un fichier l'emporte, les retraits effacent)"""
+    entries = {}
+    try:
+        with open(Path(dataset_path) / MANIFEST_NAME, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Dernière ligne tronquée par une interruption
+                    continue
+                if record.get("retire"):
+                    entries.pop(record["fichier"], None)
+                else:
+                    entries[record["fichier"]] = record
+    except FileNotFoundError:
+        pass
+    return entries
+
+def _is_current(entry, source, folder):
+    """Vrai si l'entrée du manifeste correspond à la source (mtime, taille) et que le fichier est en place"""
+    if entry is None or entry["source"] != str(source):
+        return False
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return False
+    return (stat.st_mtime_ns, stat.st_size) == (entry["mtime_ns"], entry["taille"]) \
+        and (folder / entry["fichier"]).exists()
+
+def _materialize_one(version_folder, relative, source, mode):
+    stat = os.stat(source)
+    target = version_folder / relative
+    target.parent.mkdir(parents=True, exist_ok=True)
+    used = place_file(source, target, mode)
+    return {
+        "fichier": relative,
+        "source": str(source),
+        "mtime_ns": stat.st_mtime_ns,
+        "taille": stat.st_size,
+        "sha256": file_sha256(target),
+        "mode": used
+    }
+
+def _keep_one(version_folder, previous_folder, entry):
+    """Reprend un fichier inchangé de la version précédente (lien entre versions, sans relire la source)"""
+    target = version_folder / entry["fichier"]
+    target.parent.mkdir(parents=True, exist_ok=True)
+    place_file(previous_folder / entry["fichier"], target, "lien")
+    return entry
+
+def materialize_dataset(images_data, responses, dataset_path, mode="reflink", workers=MATERIALIZE_WORKERS,
+                        root_directory=None, on_error=None):
+    """
+    Écrit une nouvelle version du jeu de données si les annotations ont changé
+    depuis la version publiée (un sous-dossier par classe dans v<N>/)
+    Chaque fichier placé est ajouté au manifeste de la version dès qu'il est
+    écrit; la version n'est publiée (lien `current`) que sans erreur.
+    Retourne {"version", "places", "retires", "inchanges", "erreurs"}:
+    version publiée, fichiers lus à la source, fichiers de la version
+    précédente abandonnés ou repris tels quels, échecs.
+    """
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(f"Mode inconnu: {mode} (attendu: {', '.join(MATERIALIZE_MODES)})")
+    dataset_path = Path(dataset_path)
+    dataset_path.mkdir(parents=True, exist_ok=True)
+    plan = plan_dataset(images_data, responses)
+
+    published = current_version(dataset_path)
+    previous_folder = version_path(dataset_path, published) if published is not None else None
+    previous = load_manifest(previous_folder) if previous_folder is not None else {}
+    kept = {relative for relative, source in plan.items()
+            if _is_current(previous.get(relative), source, previous_folder)}
+    stale = [relative for relative in previous if relative not in plan]
+    counts = {"version": published, "places": 0, "retires": len(stale), "inchanges": len(kept), "erreurs": 0}
+    if published is not None and len(kept) == len(plan) and not stale:
+        # Rien n'a changé depuis la version publiée
+        return counts
+
+    # Version suivante; un dossier déjà présent est celui d'une exécution interrompue: reprise
+    version = (published or 0) + 1
+    folder = version_path(dataset_path, version)
+    folder.mkdir(exist_ok=True)
+    manifest = load_manifest(folder)
+    for relative in list(manifest):
+        if relative not in plan:
+            # Entrée d'une exécution interrompue qui n'est plus voulue
+            (folder / relative).unlink(missing_ok=True)
+            del manifest[relative]
+    todo = [(relative, source) for relative, source in plan.items()
+            if not _is_current(manifest.get(relative), source, folder)]
+
+    with open(folder / MANIFEST_NAME, 'a', encoding='utf-8') as journal:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="materialize") as executor:
+            futures = {
+                (executor.submit(_keep_one, folder, previous_folder, previous[relative]) if relative in kept
+                 else executor.submit(_materialize_one, folder, relative, source, mode)): relative
+                for relative, source in todo
+            }
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except OSError as e:
+                    counts["erreurs"] += 1
+                    if on_error is not None:
+                        on_error(futures[future], e)
+                    continue
+                journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+                journal.flush()
+                manifest[record["fichier"]] = record
+    counts["places"] = sum(1 for relative in manifest if relative not in kept)
+
+    # Dossiers de classe vidés lors d'une reprise
+    for label in CLASSES_DISPONIBLES:
+        try:
+            (folder / label).rmdir()
+        except OSError:
+            pass
+
+    _write_manifest(folder, manifest)
+    if counts["erreurs"]:
+        # Version incomplète: non publiée, la prochaine exécution la reprend
+        return counts
+    previous_info = _read_dataset_info(previous_folder) if previous_folder is not None else {}
+    _write_dataset_info(folder, manifest, version, root_directory or previous_info.get("root_directory"))
+    _publish(dataset_path, version)
+    counts["version"] = version
+    return counts
+
+def _write_manifest(dataset_path, manifest):
+    """Réécrit le manifeste compacté (une ligne par fichier, ordre stable)"""
+    tmp_path = dataset_path / f".{MANIFEST_NAME}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for relative in sorted(manifest):
+            f.write(json.dumps(manifest[relative], ensure_ascii=False) + "\n")
+    os.replace(tmp_path, dataset_path / MANIFEST_NAME)
+
+def _read_dataset_info(folder):
+    try:
+        return json.loads((folder / DATASET_INFO_NAME).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+def _write_dataset_info(folder, manifest, version, root_directory):
+    """Numéro de version et effectifs par classe"""
+    classes = {label: 0 for label in CLASSES_DISPONIBLES}
+    for relative in manifest:
+        if relative.endswith("_crop" + Path(relative).suffix):
+            classes[relative.split("/", 1)[0]] += 1
+    info = {
+        "version": version,
+        "date": datetime.now().isoformat(),
+        "root_directory": root_directory,
+        "paires_par_classe": classes,
+        "fichiers": len(manifest)
+    }
+    info_path = folder / DATASET_INFO_NAME
+    tmp_path = info_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(info, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp_path, info_path)
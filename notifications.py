@@ -0,0 +1,335 @@
+"""
+Boîte d'envoi persistante des notifications de fin d'annotation
+Chaque notification est un fichier JSON dans OUTBOX_FOLDER. Un thread de
+fond les remet via un transport interchangeable (SMTP, dépôt de fichiers,
+webhook) avec reprise et délai exponentiel. Aucune dépendance à Streamlit.
+"""
+import os
+import json
+import logging
+import time
+import base64
+import smtplib
+import threading
+import urllib.request
+import uuid
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.base import MIMEBase
+from email import encoders
+from pathlib import Path
+
+from annotation_core import SAVE_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# ==================== CONFIGURATION ====================
+
+OUTBOX_FOLDER = SAVE_FOLDER / "outbox"
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BASE_SECONDS = 30
+OUTBOX_RETRY_MAX_SECONDS = 3600
+OUTBOX_POLL_SECONDS = 60
+# Un message réservé (en cours d'envoi) depuis plus longtemps est remis en file
+OUTBOX_CLAIM_TIMEOUT_SECONDS = 600
+
+# Configuration email: identifiants lus dans l'environnement, jamais dans le code
+SMTP_CONFIG = {
+    "server": os.environ.get("ANNOTATION_SMTP_SERVER", "smtp.gmail.com"),
+    "port": int(os.environ.get("ANNOTATION_SMTP_PORT", "587")),
+    "starttls": True,
+    "sender": os.environ.get("ANNOTATION_SMTP_SENDER"),
+    "password": os.environ.get("ANNOTATION_SMTP_PASSWORD"),
+    "receiver": os.environ.get("ANNOTATION_SMTP_RECEIVER")
+}
+# Expéditeur des fichiers .eml déposés quand SMTP n'est pas configuré
+DEFAULT_SENDER = "annotation@localhost"
+
+# Transport utilisé: "smtp", "fichier" (dépôt .eml dans DROP_FOLDER) ou "webhook"
+# Sans identifiants SMTP, les notifications sont déposées en fichiers; sans
+# destinataire, les emails sont désactivés (None).
+def default_transport(config=SMTP_CONFIG):
+    """Transport par défaut d'après la configuration email (None: notifications désactivées)"""
+    if not config["receiver"]:
+        return None
+    return "smtp" if config["sender"] and config["password"] else "fichier"
+
+NOTIFICATION_TRANSPORT = os.environ.get("ANNOTATION_NOTIFICATION_TRANSPORT") or default_transport()
+DROP_FOLDER = OUTBOX_FOLDER / "depot"
+WEBHOOK_URL = os.environ.get("ANNOTATION_WEBHOOK_URL")
+
+# ==================== MESSAGES ====================
+
+def completion_message(annotator_name, root_directory, total, completed, ignored, export_path):
+    """Construit la notification de fin d'annotation (sujet, corps, pièce jointe)"""
+    now = datetime.now()
+    body = f"""
+Bonjour,
+
+L'annotateur {annotator_name} a terminé l'annotation des images.
+
+📊 Statistiques:
+- Total d'images: {total}
+- Images annotées: {completed}
+- Images ignorées: {ignored}
+- Date de fin: {now.strftime('%Y-%m-%d %H:%M:%S')}
+- Dossier source: {root_directory}
+
+Les résultats détaillés sont disponibles en pièce jointe au format CSV.
+
+Cordialement,
+Système d'annotation automatique
+        """
+    return {
+        "subject": f"✅ Annotation terminée - {annotator_name} - {now.strftime('%Y-%m-%d %H:%M')}",
+        "body": body,
+        "attachment": str(export_path) if export_path else None
+    }
+
+def build_email(message, sender, receiver):
+    """Construit l'email MIME d'une notification (pièce jointe lue au moment de l'envoi)"""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = receiver
+    msg['Subject'] = message["subject"]
+    msg.attach(MIMEText(message["body"], 'plain'))
+
+    if message.get("attachment"):
+        attachment_path = Path(message["attachment"])
+        attachment = MIMEBase('application', 'octet-stream')
+        attachment.set_payload(attachment_path.read_bytes())
+        encoders.encode_base64(attachment)
+        attachment.add_header('Content-Disposition', f'attachment; filename={attachment_path.name}')
+        msg.attach(attachment)
+    return msg
+
+# ==================== TRANSPORTS ====================
+
+class SmtpTransport:
+    """Envoi SMTP sur une connexion réutilisée d'un message à l'autre"""
+
+    def __init__(self, config=SMTP_CONFIG, timeout=30):
+        self.config = config
+        self.timeout = timeout
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.config["server"], self.config["port"], timeout=self.timeout)
+        if self.config.get("starttls", True):
+            server.starttls()
+        if self.config.get("password"):
+            server.login(self.config["sender"], self.config["password"])
+        self._server = server
+
+    def send(self, message):
+        msg = build_email(message, self.config["sender"], self.config["receiver"])
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Connexion fermée par le serveur depuis le dernier envoi: une reconnexion
+            self._server = None
+            self._connect()
+            self._server.send_message(msg)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except smtplib.SMTPException:
+                pass
+            self._server = None
+
+class FileDropTransport:
+    """Dépose chaque notification sous forme de fichier .eml (tests, relais local)"""
+
+    def __init__(self, folder=DROP_FOLDER):
+        self.folder = Path(folder)
+
+    def send(self, message):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        msg = build_email(message, SMTP_CONFIG["sender"] or DEFAULT_SENDER, SMTP_CONFIG["receiver"])
+        path = self.folder / f"{message['id']}.eml"
+        tmp_path = path.with_suffix(".eml.tmp")
+        tmp_path.write_bytes(msg.as_bytes())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        pass
+
+class WebhookTransport:
+    """POST JSON de la notification (pièce jointe encodée en base64)"""
+
+    def __init__(self, url=WEBHOOK_URL, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, message):
+        payload = {"subject": message["subject"], "body": message["body"]}
+        if message.get("attachment"):
+            attachment_path = Path(message["attachment"])
+            payload["attachment_name"] = attachment_path.name
+            payload["attachment"] = base64.b64encode(attachment_path.read_bytes()).decode('ascii')
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+    def close(self):
+        pass
+
+def make_transport(kind=NOTIFICATION_TRANSPORT):
+    """
+    Instancie le transport configuré (dépôt de fichiers si SMTP est demandé sans identifiants)
+    Retourne None si les notifications sont désactivées: aucun transport, ou
+    un email demandé sans destinataire.
+    """
+    if kind is None or (kind in ("smtp", "fichier") and not SMTP_CONFIG["receiver"]):
+        return None
+    if kind == "smtp":
+        if not (SMTP_CONFIG["sender"] and SMTP_CONFIG["password"]):
+            return FileDropTransport()
+        return SmtpTransport()
+    if kind == "fichier":
+        return FileDropTransport()
+    if kind == "webhook":
+        return WebhookTransport()
+    raise ValueError(f"Transport de notification inconnu: {kind}")
+
+# ==================== BOÎTE D'ENVOI ====================
+
+class NotificationOutbox:
+    """
+    File de notifications sur disque, remise par un thread de fond
+    Un message en attente est un fichier <id>.json; il est réservé par
+    renommage atomique en <id>.envoi avant l'envoi (plusieurs processus
+    peuvent vider la même boîte). Après OUTBOX_MAX_ATTEMPTS échecs, il est
+    déplacé dans echecs/; une fois remis, dans envoyes/.
+    """
+
+    def __init__(self, folder, transport, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.folder = Path(folder)
+        self.transport = transport
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        for name in ("envoyes", "echecs"):
+            (self.folder / name).mkdir(parents=True, exist_ok=True)
+
+    def enqueue(self, message):
+        """Ajoute une notification à la file (écriture atomique) et réveille le thread"""
+        message = dict(message)
+        message.setdefault("id", f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}")
+        message.setdefault("attempts", 0)
+        message.setdefault("next_attempt", 0)
+        message.setdefault("last_error", None)
+        self._write(self.folder / f"{message['id']}.json", message)
+        self._wake.set()
+        return message["id"]
+
+    def _write(self, path, message):
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(message, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def pending(self):
+        """Notifications en attente (y compris celles en délai de reprise)"""
+        return sorted(self.folder.glob("*.json"))
+
+    def _recover_stale_claims(self):
+        now = time.time()
+        for claim in self.folder.glob("*.envoi"):
+            try:
+                if now - claim.stat().st_mtime > OUTBOX_CLAIM_TIMEOUT_SECONDS:
+                    os.replace(claim, claim.with_suffix(".json"))
+            except FileNotFoundError:
+                continue
+
+    def deliver_due(self):
+        """
+        Envoie les notifications dont l'échéance est passée
+        Retourne le délai (secondes) avant la prochaine échéance, ou None.
+        """
+        with self._lock:
+            self._recover_stale_claims()
+            next_due = None
+            try:
+                for path in self.pending():
+                    claim = path.with_suffix(".envoi")
+                    try:
+                        os.replace(path, claim)
+                    except FileNotFoundError:
+                        # Réservé par un autre processus
+                        continue
+
+                    try:
+                        with open(claim, 'r', encoding='utf-8') as f:
+                            message = json.load(f)
+                        wait_seconds = message["next_attempt"] - time.time()
+                    except (ValueError, KeyError, TypeError):
+                        # Message incomplet ou corrompu: écarté pour ne pas bloquer la file
+                        os.replace(claim, self.folder / "echecs" / path.name)
+                        continue
+                    if wait_seconds > 0:
+                        os.replace(claim, path)
+                        next_due = wait_seconds if next_due is None else min(next_due, wait_seconds)
+                        continue
+
+                    try:
+                        self.transport.send(message)
+                    except Exception as e:
+                        # Connexion possiblement dans un état incohérent: on repart de zéro
+                        self.transport.close()
+                        message["attempts"] += 1
+                        message["last_error"] = str(e)
+                        if message["attempts"] >= self.max_attempts:
+                            self._write(self.folder / "echecs" / path.name, message)
+                            claim.unlink()
+                            continue
+                        delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (message["attempts"] - 1),
+                                    OUTBOX_RETRY_MAX_SECONDS)
+                        message["next_attempt"] = time.time() + delay
+                        self._write(claim, message)
+                        os.replace(claim, path)
+                        next_due = delay if next_due is None else min(next_due, delay)
+                        continue
+
+                    message["sent_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    self._write(self.folder / "envoyes" / path.name, message)
+                    claim.unlink()
+            finally:
+                if not self.pending():
+                    # File vide: inutile de garder la connexion ouverte
+                    self.transport.close()
+            return next_due
+
+    def start(self):
+        """Démarre le thread de remise (une seule fois)"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                next_due = self.deliver_due()
+            except Exception:
+                # Le thread ne doit jamais s'arrêter: nouvel essai au prochain réveil
+                logger.exception("Échec de la remise des notifications")
+                next_due = None
+            timeout = OUTBOX_POLL_SECONDS if next_due is None else min(next_due, OUTBOX_POLL_SECONDS)
+            self._wake.wait(timeout)
@@ -0,0 +1,357 @@
+"""
+Pré-annotation par modèle (CPU) et file de revue par incertitude
+Les crops sont évalués par lots dans un pool de processus; descripteurs et
+prédictions sont mis en cache par empreinte du contenu (SHA-1), le lien
+chemin -> empreinte par chemin + mtime. Sans modèle externe, un classifieur
+par centroïdes sur des descripteurs couleur/texture est appris sur les
+décisions déjà prises (à défaut, sur les dossiers de classe).
+"""
+import hashlib
+import importlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from annotation_core import CLASSES_DISPONIBLES, SAVE_FOLDER, get_absolute_path, process_pool
+
+PREDICTIONS_FILE = SAVE_FOLDER / "predictions.sqlite"
+PRELABEL_WORKERS = os.cpu_count() or 2
+PRELABEL_BATCH_SIZE = 64
+# Clés par requête de lecture du cache (limite des paramètres SQLite)
+CACHE_QUERY_CHUNK = 500
+
+# Modèle externe optionnel "module:fabrique". La fabrique (sans argument)
+# retourne un objet ayant un attribut `name` (version du modèle, utilisée
+# comme clé de cache) et une méthode predict_proba(paths) retournant un
+# tableau (n, len(CLASSES_DISPONIBLES)). Exécutée une fois par processus.
+PRELABEL_MODEL = None
+
+# Descripteurs du classifieur intégré: histogramme couleur 4x4x4 + histogramme
+# des gradients (16 classes d'amplitude) sur une réduction à FEATURE_SIZE pixels
+FEATURE_SIZE = 64
+FEATURE_DIM = 64 + 16
+BUILTIN_MODEL_NAME = "centroides-v1"
+# Température du softmax sur les distances carrées aux centroïdes, exprimées
+# en unités de dispersion intra-classe (indépendante de l'échelle des descripteurs).
+# Sur le jeu d'exemple, la confiance moyenne égale alors la justesse un contre tous.
+CENTROID_TEMPERATURE = 2.0
+# Confiance minimale d'une prédiction pour signaler qu'elle contredit le label du dossier
+PRELABEL_MIN_CONFIDENCE = 0.6
+
+# ==================== DESCRIPTEURS ====================
+
+def file_digest(path):
+    """Empreinte SHA-1 du contenu d'un fichier"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def image_features(path):
+    """Descripteur couleur/texture normalisé (float32, FEATURE_DIM valeurs)"""
+    with Image.open(path) as img:
+        img.draft("RGB", (FEATURE_SIZE, FEATURE_SIZE))
+        pixels = np.asarray(img.convert("RGB").resize((FEATURE_SIZE, FEATURE_SIZE)), dtype=np.float32)
+
+    # Couleur: histogramme joint 4x4x4
+    bins = (pixels // 64).astype(np.int64)
+    colour = np.bincount((bins[..., 0] * 16 + bins[..., 1] * 4 + bins[..., 2]).ravel(), minlength=64)
+
+    # Texture: amplitude des gradients de la luminance
+    gray = pixels.mean(axis=2)
+    gx = np.diff(gray, axis=1)[:-1, :]
+    gy = np.diff(gray, axis=0)[:, :-1]
+    magnitude = np.hypot(gx, gy)
+    texture, _ = np.histogram(magnitude, bins=16, range=(0, 128))
+
+    features = np.concatenate([colour / colour.sum(), texture / max(texture.sum(), 1)]).astype(np.float32)
+    return features
+
+def _features_batch(paths):
+    """Exécuté dans un processus du pool: (digest, descripteur ou None) par chemin"""
+    results = []
+    for path in paths:
+        try:
+            results.append((file_digest(path), image_features(path)))
+        except (OSError, ValueError):
+            # Image absente ou illisible
+            results.append((None, None))
+    return results
+
+_worker_models = {}
+
+def load_model(spec):
+    """Instancie le modèle externe "module:fabrique" """
+    module_name, _, factory_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), factory_name)()
+
+def _predict_batch(spec, paths):
+    """Exécuté dans un processus du pool: probabilités du modèle externe (une fois chargé par processus)"""
+    model = _worker_models.get(spec)
+    if model is None:
+        model = _worker_models[spec] = load_model(spec)
+    return np.asarray(model.predict_proba(paths), dtype=np.float32)
+
+# ==================== CACHE ====================
+
+class PredictionStore:
+    """
+    Cache SQLite des empreintes, descripteurs et prédictions (une connexion par thread)
+    empreintes: path + mtime + taille -> sha1
+    descripteurs / probabilites: par sha1 (et nom de modèle)
+    predictions: classe prédite et confiance par paire d'un dossier racine
+    """
+
+    def __init__(self, path=PREDICTIONS_FILE):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS empreintes (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha1 TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS descripteurs (
+                    sha1 TEXT PRIMARY KEY,
+                    features BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS probabilites (
+                    sha1 TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    probs BLOB NOT NULL,
+                    PRIMARY KEY (sha1, model)
+                );
+                CREATE TABLE IF NOT EXISTS predictions (
+                    root TEXT NOT NULL,
+                    image_key TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    predicted TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    label_wrong REAL NOT NULL,
+                    PRIMARY KEY (root, image_key)
+                );
+            """)
+            self._local.conn = conn
+        return conn
+
+    def _select_in(self, query, values, *params):
+        """
+        Lignes de `query` (se terminant par "IN") pour les seules valeurs demandées
+        Les valeurs sont passées par paquets de CACHE_QUERY_CHUNK: le cache peut
+        contenir les fichiers d'autres dossiers racine, qui ne sont pas lus.
+        """
+        values = list(values)
+        rows = []
+        with self._conn() as conn:
+            for start in range(0, len(values), CACHE_QUERY_CHUNK):
+                chunk = values[start:start + CACHE_QUERY_CHUNK]
+                rows.extend(conn.execute(f"{query} ({','.join('?' * len(chunk))})", (*params, *chunk)))
+        return rows
+
+    def known_digests(self, stats):
+        """{path: sha1} pour les chemins dont mtime et taille sont inchangés"""
+        rows = self._select_in("SELECT path, mtime_ns, size, sha1 FROM empreintes WHERE path IN", stats)
+        return {path: sha1 for path, mtime_ns, size, sha1 in rows if stats[path] == (mtime_ns, size)}
+
+    def features(self, digests):
+        rows = self._select_in("SELECT sha1, features FROM descripteurs WHERE sha1 IN", set(digests))
+        return {sha1: np.frombuffer(blob, dtype=np.float32) for sha1, blob in rows}
+
+    def probabilities(self, model, digests):
+        rows = self._select_in("SELECT sha1, probs FROM probabilites WHERE model = ? AND sha1 IN",
+                               set(digests), model)
+        return {sha1: np.frombuffer(blob, dtype=np.float32) for sha1, blob in rows}
+
+    def save_features(self, stats, rows):
+        """rows: (path, sha1, features)"""
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO empreintes (path, mtime_ns, size, sha1) VALUES (?, ?, ?, ?)",
+                [(path, *stats[path], sha1) for path, sha1, _ in rows]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO descripteurs (sha1, features) VALUES (?, ?)",
+                [(sha1, features.tobytes()) for _, sha1, features in rows]
+            )
+
+    def save_probabilities(self, model, rows):
+        """rows: (sha1, probs)"""
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO probabilites (sha1, model, probs) VALUES (?, ?, ?)",
+                [(sha1, model, probs.astype(np.float32).tobytes()) for sha1, probs in rows]
+            )
+
+    def save_predictions(self, root, model, predictions):
+        root = str(get_absolute_path(root))
+        with self._conn() as conn:
+            conn.execute("DELETE FROM predictions WHERE root = ?", (root,))
+            conn.executemany(
+                "INSERT INTO predictions (root, image_key, model, predicted, confidence, label_wrong) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(root, key, model, p["predicted"], p["confidence"], p["label_wrong"])
+                 for key, p in predictions.items()]
+            )
+
+    def load_predictions(self, root):
+        """{clé: {"predicted", "confidence", "label_wrong"}} de la dernière pré-annotation du dossier"""
+        with self._conn() as conn:
+            rows = conn.execute(
+                "SELECT image_key, predicted, confidence, label_wrong FROM predictions WHERE root = ?",
+                (str(get_absolute_path(root)),)
+            ).fetchall()
+        return {key: {"predicted": predicted, "confidence": confidence, "label_wrong": label_wrong}
+                for key, predicted, confidence, label_wrong in rows}
+
+# ==================== PRÉ-ANNOTATION ====================
+
+def _batches(items, size=PRELABEL_BATCH_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def compute_features(paths, store, workers=PRELABEL_WORKERS):
+    """{path: (sha1, descripteur)} des images lisibles; seules les nouvelles sont décodées"""
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            continue
+
+    digests = store.known_digests(stats)
+    cached = store.features(digests.values())
+    result = {path: (sha1, cached[sha1]) for path, sha1 in digests.items() if sha1 in cached}
+
+    missing = [path for path in stats if path not in result]
+    if missing:
+        with process_pool(workers) as executor:
+            for batch, rows in zip(_batches(missing), executor.map(_features_batch, _batches(missing))):
+                saved = [(path, sha1, features) for path, (sha1, features) in zip(batch, rows) if sha1 is not None]
+                store.save_features(stats, saved)
+                result.update((path, (sha1, features)) for path, sha1, features in saved)
+    return result
+
+def centroid_probabilities(features, labels):
+    """
+    Probabilités par classe (softmax des distances aux centroïdes)
+    features: (n, d); labels: classe d'apprentissage de chaque ligne (ou None)
+    Chaque exemple étiqueté est comparé au centroïde de sa classe calculé sans
+    lui (validation croisée un contre tous): sinon il s'attire lui-même et sa
+    confiance est surestimée, surtout dans les petites classes.
+    """
+    labels = list(labels)
+    centroids = []
+    counts = []
+    for label in CLASSES_DISPONIBLES:
+        rows = [i for i, l in enumerate(labels) if l == label]
+        # Classe sans exemple: centroïde inatteignable
+        centroids.append(features[rows].mean(axis=0) if rows else np.full(features.shape[1], np.inf))
+        counts.append(len(rows))
+    centroids = np.stack(centroids)
+    distances = ((features[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=-1)
+    # Centroïde de la classe sans l'exemple: x - (n.c - x)/(n - 1) = n/(n - 1) (x - c)
+    own = []
+    for i, label in enumerate(labels):
+        if label not in CLASSES_DISPONIBLES:
+            continue
+        column = CLASSES_DISPONIBLES.index(label)
+        n = counts[column]
+        distances[i, column] = distances[i, column] * (n / (n - 1)) ** 2 if n > 1 else np.inf
+        if n > 1:
+            own.append(distances[i, column])
+    # Dispersion intra-classe: distance carrée moyenne d'un exemple au centroïde des autres
+    spread = max(float(np.mean(own)), 1e-12) if own else 1.0
+    logits = -np.nan_to_num(distances / spread, posinf=np.finfo(np.float32).max) / CENTROID_TEMPERATURE
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+def predict_pairs(images_data, responses=None, model_spec=PRELABEL_MODEL, workers=PRELABEL_WORKERS, store=None):
+    """
+    Évalue les crops du catalogue et enregistre une prédiction par paire
+    Retourne {clé: {"predicted", "confidence", "label_wrong"}}, label_wrong étant
+    la probabilité que le label du dossier (label_initial) soit faux.
+    """
+    store = store or PredictionStore()
+    responses = responses or {}
+    paths = [img["crop_path"] for img in images_data]
+    features = compute_features(paths, store, workers)
+    scored = [img for img in images_data if img["crop_path"] in features]
+    if not scored:
+        return {}
+
+    if model_spec:
+        model_name = load_model(model_spec).name
+        digests = [features[img["crop_path"]][0] for img in scored]
+        cached = store.probabilities(model_name, digests)
+        missing = sorted({d for d in digests if d not in cached})
+        if missing:
+            path_of = {features[img["crop_path"]][0]: img["crop_path"] for img in scored}
+            with process_pool(workers) as executor:
+                batches = _batches(missing)
+                path_batches = [[path_of[d] for d in batch] for batch in batches]
+                for batch, probs in zip(batches, executor.map(_predict_batch, [model_spec] * len(batches),
+                                                              path_batches)):
+                    store.save_probabilities(model_name, list(zip(batch, probs)))
+                    cached.update(zip(batch, probs))
+        probs = np.stack([cached[d] for d in digests])
+    else:
+        # Apprentissage sur les décisions humaines, à défaut sur le dossier de classe
+        model_name = BUILTIN_MODEL_NAME
+        labels = []
+        for img in scored:
+            response = responses.get(img["key"], {})
+            if response.get("annotated", False) and response.get("label_choisi") in CLASSES_DISPONIBLES:
+                labels.append(response["label_choisi"])
+            elif response.get("ignored", False):
+                labels.append(None)
+            else:
+                labels.append(img["label_initial"] if img["label_initial"] in CLASSES_DISPONIBLES else None)
+        probs = centroid_probabilities(np.stack([features[img["crop_path"]][1] for img in scored]), labels)
+
+    predictions = {}
+    for img, row in zip(scored, probs):
+        best = int(np.argmax(row))
+        initial = img["label_initial"]
+        initial_prob = float(row[CLASSES_DISPONIBLES.index(initial)]) if initial in CLASSES_DISPONIBLES else 0.0
+        predictions[img["key"]] = {
+            "predicted": CLASSES_DISPONIBLES[best],
+            "confidence": float(row[best]),
+            "label_wrong": 1.0 - initial_prob
+        }
+    store.save_predictions(images_data.root, model_name, predictions)
+    return predictions
+
+def contradicts_folder(prediction, label_initial):
+    """Vrai si la prédiction, assez confiante, désigne une autre classe que le dossier"""
+    return prediction["confidence"] >= PRELABEL_MIN_CONFIDENCE and prediction["predicted"] != label_initial
+
+def review_order(images_data, predictions, responses=None):
+    """
+    Positions du catalogue dans l'ordre de revue: images non traitées d'abord,
+    puis par probabilité décroissante que le label du dossier soit faux.
+    Les images sans prédiction viennent en dernier, dans l'ordre du dossier.
+    """
+    responses = responses or {}
+
+    def priority(position):
+        key = images_data.key_of(position)
+        response = responses.get(key, {})
+        processed = response.get("annotated", False) or response.get("ignored", False)
+        prediction = predictions.get(key)
+        return (processed, prediction is None, -(prediction["label_wrong"] if prediction else 0.0), position)
+
+    return sorted(range(len(images_data)), key=priority)
@@ -0,0 +1,171 @@
+"""
+Export des paires annotées en fichiers de shards pour l'entraînement
+Format "tar": archives séquentielles de style WebDataset (<clé>.crop.png,
+<clé>.bbox.png optionnel, <clé>.cls), de taille bornée, avec un index des
+positions de chaque fichier. Format "npy": tableau uint8 (n, S, S, 3) des
+crops redimensionnés, ouvert en mémoire partagée, et tableau des labels.
+Les shards sont écrits en parallèle (un processus par shard ou par bloc) et
+chaque shard respecte les proportions globales des classes.
+"""
+import io
+import json
+import os
+import random
+import tarfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from annotation_core import CLASSES_DISPONIBLES, process_pool
+
+SHARD_FORMATS = ("tar", "npy")
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+SHARD_WORKERS = os.cpu_count() or 2
+# Côté des crops du format npy (redimensionnés et complétés, proportions conservées)
+SHARD_IMAGE_SIZE = 128
+# Lignes traitées par tâche pour le format npy
+NPY_BLOCK_ROWS = 1024
+SHARD_INDEX_NAME = "index.json"
+SHARD_SEED = 0
+
+def shard_samples(images_data, responses):
+    """Échantillons (clé, label, crop, bbox) des paires annotées et non ignorées"""
+    samples = []
+    for img in images_data:
+        response = responses.get(img["key"], {})
+        label = response.get("label_choisi")
+        if response.get("ignored", False) or not response.get("annotated", False) or label not in CLASSES_DISPONIBLES:
+            continue
+        samples.append((img["key"], label, img["crop_path"], img["bbox_path"]))
+    return samples
+
+def stratified_order(samples, seed=SHARD_SEED):
+    """
+    Ordre où chaque classe est répartie régulièrement (mélange reproductible
+    à l'intérieur de chaque classe): tout découpage en tranches contiguës
+    conserve les proportions des classes.
+    """
+    rng = random.Random(seed)
+    by_class = {}
+    for sample in samples:
+        by_class.setdefault(sample[1], []).append(sample)
+    placed = []
+    for members in by_class.values():
+        rng.shuffle(members)
+        placed.extend(((j + 0.5) / len(members), sample) for j, sample in enumerate(members))
+    placed.sort(key=lambda item: (item[0], item[1][0]))
+    return [sample for _, sample in placed]
+
+def _sample_name(key):
+    """Clé -> préfixe de nom dans l'archive (sans '.' ni '/', réservés au format)"""
+    return key.replace("/", "__").replace(".", "_")
+
+def plan_tar_shards(samples, with_bbox=False, max_bytes=SHARD_MAX_BYTES):
+    """Découpe l'ordre stratifié en shards d'au plus max_bytes (taille des fichiers sources)"""
+    shards, current, size = [], [], 0
+    for sample in samples:
+        sample_size = os.path.getsize(sample[2]) + (os.path.getsize(sample[3]) if with_bbox else 0)
+        if current and size + sample_size > max_bytes:
+            shards.append(current)
+            current, size = [], 0
+        current.append(sample)
+        size += sample_size
+    if current:
+        shards.append(current)
+    return shards
+
+def _write_tar_shard(path, samples, with_bbox):
+    """Exécuté dans un processus du pool: écrit un shard et retourne ses entrées d'index"""
+    entries = []
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        # PAX: les noms de plus de 100 caractères (clés longues) passent dans un en-tête étendu
+        with tarfile.open(tmp_path, "w", format=tarfile.PAX_FORMAT) as tar:
+            for key, label, crop_path, bbox_path in samples:
+                name = _sample_name(key)
+                entry = {"cle": key, "label": label, "shard": path.name}
+                members = [("crop", crop_path)] + ([("bbox", bbox_path)] if with_bbox else [])
+                for part, source in members:
+                    info = tar.gettarinfo(source, arcname=f"{name}.{part}{Path(source).suffix}")
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    with open(source, 'rb') as f:
+                        tar.addfile(info, f)
+                    # Les données précèdent la position courante, complétées à un bloc de 512 octets
+                    entry[part] = [tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE, info.size]
+                data = str(CLASSES_DISPONIBLES.index(label)).encode('ascii')
+                info = tarfile.TarInfo(f"{name}.cls")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+                entries.append(entry)
+    except BaseException:
+        # Shard incomplet: pas de fichier .tmp laissé dans le dossier de sortie
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, path)
+    return entries
+
+def _fit_image(path, size):
+    with Image.open(path) as img:
+        img.draft("RGB", (size, size))
+        return np.asarray(ImageOps.pad(img.convert("RGB"), (size, size)), dtype=np.uint8)
+
+def _write_npy_block(images_path, start, paths, size):
+    """Exécuté dans un processus du pool: remplit les lignes [start, start + len(paths)) du tableau"""
+    images = np.load(images_path, mmap_mode="r+")
+    failed = []
+    for i, path in enumerate(paths):
+        try:
+            images[start + i] = _fit_image(path, size)
+        except (OSError, ValueError):
+            # Crop illisible: ligne laissée à zéro et signalée dans l'index
+            failed.append(start + i)
+    images.flush()
+    return failed
+
+def export_shards(images_data, responses, output_dir, fmt="tar", with_bbox=False, max_bytes=SHARD_MAX_BYTES,
+                  image_size=SHARD_IMAGE_SIZE, workers=SHARD_WORKERS):
+    """
+    Écrit les shards et leur index dans `output_dir`; retourne l'index
+    tar: shard-00000.tar, ... + index.json (positions de chaque fichier)
+    npy: images.npy (n, S, S, 3) uint8, labels.npy (n,) int16 + index.json (clés)
+    """
+    if fmt not in SHARD_FORMATS:
+        raise ValueError(f"Format de shards inconnu: {fmt} (attendu: {', '.join(SHARD_FORMATS)})")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    samples = stratified_order(shard_samples(images_data, responses))
+    index = {"format": fmt, "classes": CLASSES_DISPONIBLES, "echantillons": len(samples)}
+
+    with process_pool(workers) as executor:
+        if fmt == "tar":
+            shards = plan_tar_shards(samples, with_bbox, max_bytes)
+            paths = [output_dir / f"shard-{i:05d}.tar" for i in range(len(shards))]
+            results = executor.map(_write_tar_shard, paths, shards, [with_bbox] * len(shards))
+            index["shards"] = []
+            for path, shard, entries in zip(paths, shards, results):
+                counts = {}
+                for _, label, _, _ in shard:
+                    counts[label] = counts.get(label, 0) + 1
+                index["shards"].append({"fichier": path.name, "octets": path.stat().st_size,
+                                        "classes": counts, "entrees": entries})
+        else:
+            images_path = output_dir / "images.npy"
+            images = np.lib.format.open_memmap(images_path, mode="w+", dtype=np.uint8,
+                                               shape=(len(samples), image_size, image_size, 3))
+            del images
+            starts = list(range(0, len(samples), NPY_BLOCK_ROWS))
+            blocks = [[sample[2] for sample in samples[start:start + NPY_BLOCK_ROWS]] for start in starts]
+            failed = [row for rows in executor.map(_write_npy_block, [images_path] * len(starts), starts,
+                                                     blocks, [image_size] * len(starts))
+                      for row in rows]
+            labels = np.array([CLASSES_DISPONIBLES.index(label) for _, label, _, _ in samples], dtype=np.int16)
+            np.save(output_dir / "labels.npy", labels)
+            index.update({"taille_image": image_size, "cles": [key for key, _, _, _ in samples],
+                          "illisibles": failed})
+
+    tmp_path = output_dir / f"{SHARD_INDEX_NAME}.tmp"
+    tmp_path.write_text(json.dumps(index, ensure_ascii=False), encoding='utf-8')
+    os.replace(tmp_path, output_dir / SHARD_INDEX_NAME)
+    return index
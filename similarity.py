@@ -0,0 +1,155 @@
+"""
+Index vectoriel des crops pour la recherche des plus proches voisins
+Les descripteurs couleur/texture de la pré-annotation (mis en cache par
+empreinte du contenu) sont transformés en vecteurs unitaires (distance de
+Hellinger) et stockés dans un fichier float32 brut, ouvert en mémoire
+partagée (memmap). Les mises à jour ajoutent des lignes en fin de fichier;
+les lignes des paires supprimées ou modifiées sont marquées mortes puis
+éliminées par compactage.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from annotation_core import SAVE_FOLDER, get_absolute_path
+from prelabel import FEATURE_DIM, PRELABEL_WORKERS, PredictionStore, compute_features
+
+SIMILARITY_FOLDER = SAVE_FOLDER / "index_similarite"
+SIMILAR_COUNT = 20
+# Lignes comparées par bloc lors d'une requête (mémoire bornée)
+QUERY_CHUNK_ROWS = 65536
+# Compactage quand les lignes mortes dépassent cette part du fichier
+COMPACT_DEAD_RATIO = 0.25
+
+def embed(features):
+    """Descripteurs (histogrammes normalisés) -> vecteurs unitaires (produit scalaire = similarité de Hellinger)"""
+    vectors = np.sqrt(np.maximum(features, 0)).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class SimilarityIndex:
+    """
+    Index k plus proches voisins d'un dossier racine
+    <nom>.vecteurs: lignes float32 de FEATURE_DIM valeurs
+    <nom>.json: [clé, sha1] par ligne (null pour une ligne morte)
+    """
+
+    def __init__(self, root_path, folder=SIMILARITY_FOLDER):
+        root = str(get_absolute_path(root_path))
+        name = hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]
+        self.root = root
+        self.vectors_path = folder / f"{name}.vecteurs"
+        self.meta_path = folder / f"{name}.json"
+        self._lock = threading.Lock()
+        self._rows = []
+        self._row_of = {}
+        self._vectors = None
+        self._load()
+
+    def _load(self):
+        try:
+            meta = json.loads(self.meta_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            meta = {"dim": FEATURE_DIM, "rows": []}
+        if meta.get("dim") != FEATURE_DIM:
+            # Descripteurs d'une autre version: index à reconstruire
+            meta = {"dim": FEATURE_DIM, "rows": []}
+        rows = meta["rows"]
+        row_bytes = FEATURE_DIM * 4
+        try:
+            # Lignes écrites sans métadonnées (interruption): ignorées
+            available = self.vectors_path.stat().st_size // row_bytes
+        except OSError:
+            available = 0
+        rows = rows[:available]
+        self._rows = [tuple(row) if row else None for row in rows]
+        self._row_of = {row[0]: i for i, row in enumerate(self._rows) if row}
+        self._vectors = (np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(rows), FEATURE_DIM))
+                         if rows else np.empty((0, FEATURE_DIM), dtype=np.float32))
+        self._alive = np.array([row is not None for row in self._rows], dtype=bool)
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def __contains__(self, key):
+        return key in self._row_of
+
+    def _write_meta(self):
+        tmp_path = self.meta_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"dim": FEATURE_DIM, "rows": self._rows}), encoding='utf-8')
+        os.replace(tmp_path, self.meta_path)
+
+    def update(self, images_data, store=None, workers=PRELABEL_WORKERS):
+        """
+        Aligne l'index sur le catalogue: seules les paires nouvelles ou dont le
+        crop a changé sont décodées (descripteurs en cache) et ajoutées.
+        Retourne (ajoutées, retirées).
+        """
+        with self._lock:
+            features = compute_features([img["crop_path"] for img in images_data], store or PredictionStore(), workers)
+            wanted = {}
+            for img in images_data:
+                entry = features.get(img["crop_path"])
+                if entry is not None:
+                    wanted[img["key"]] = entry
+
+            removed = 0
+            for key, row in list(self._row_of.items()):
+                entry = wanted.get(key)
+                if entry is None or entry[0] != self._rows[row][1]:
+                    self._rows[row] = None
+                    del self._row_of[key]
+                    removed += 1
+            added = [(key, sha1, vector) for key, (sha1, vector) in wanted.items() if key not in self._row_of]
+
+            self.vectors_path.parent.mkdir(parents=True, exist_ok=True)
+            dead = len(self._rows) - len(self._row_of)
+            if dead > COMPACT_DEAD_RATIO * (len(self._rows) + len(added)):
+                self._compact(added)
+            elif added:
+                with open(self.vectors_path, 'ab') as f:
+                    f.truncate(len(self._rows) * FEATURE_DIM * 4)
+                    f.write(embed(np.stack([vector for _, _, vector in added])).tobytes())
+                self._rows.extend((key, sha1) for key, sha1, _ in added)
+            if added or removed:
+                self._write_meta()
+                self._load()
+            return len(added), removed
+
+    def _compact(self, added):
+        """Réécrit le fichier avec les seules lignes vivantes (et les ajouts)"""
+        live = [i for i, row in enumerate(self._rows) if row is not None]
+        parts = [np.asarray(self._vectors[live])] if live else []
+        if added:
+            parts.append(embed(np.stack([vector for _, _, vector in added])))
+        rows = [self._rows[i] for i in live] + [(key, sha1) for key, sha1, _ in added]
+        tmp_path = self.vectors_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            for part in parts:
+                f.write(part.astype(np.float32).tobytes())
+        self._vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self._rows = rows
+
+    def neighbours(self, key, k=SIMILAR_COUNT):
+        """Les k clés les plus proches de `key` et leur similarité (décroissante), la clé exclue"""
+        with self._lock:
+            row = self._row_of.get(key)
+            if row is None:
+                raise LookupError(f"{key} n'est pas dans l'index de similarité")
+            vectors, alive = self._vectors, self._alive.copy()
+            alive[row] = False
+            query = np.asarray(vectors[row])
+            scores = np.full(len(alive), -np.inf, dtype=np.float32)
+            for start in range(0, len(alive), QUERY_CHUNK_ROWS):
+                scores[start:start + QUERY_CHUNK_ROWS] = np.asarray(vectors[start:start + QUERY_CHUNK_ROWS]) @ query
+            scores[~alive] = -np.inf
+            k = min(k, int(alive.sum()))
+            if k <= 0:
+                return []
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [(self._rows[i][0], float(scores[i])) for i in best]
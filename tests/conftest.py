@@ -0,0 +1,20 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import annotation_core as core
+import annotation_store
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Sauvegardes, index et exports redirigés vers un dossier temporaire"""
+    folder = tmp_path / "sauvegardes"
+    folder.mkdir()
+    for module in (core, annotation_store):
+        monkeypatch.setattr(module, "SAVE_FOLDER", folder)
+        monkeypatch.setattr(module, "INDEX_FILE", folder / "index_images.sqlite")
+    monkeypatch.setattr(core, "EXPORT_FOLDER", folder / "exports")
+    return folder
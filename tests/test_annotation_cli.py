@@ -0,0 +1,11 @@
+import subprocess
+import sys
+from pathlib import Path
+
+def test_light_commands_do_not_load_heavy_modules():
+    # Processus neuf: les tests voisins ont déjà chargé numpy et PIL dans celui-ci
+    code = ("import sys, annotation_cli; annotation_cli.build_parser().parse_args(['stats', 'x']); "
+            "print(sorted(name for name in ('numpy', 'PIL', 'smtplib') if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parent.parent,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,259 @@
+import csv
+import json
+import os
+import random
+import threading
+import time
+
+import pytest
+
+import annotation_core as core
+
+def _pair(folder, base_name, suffix=".png"):
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / f"{base_name}_bbox{suffix}").write_bytes(b"bbox")
+    (folder / f"{base_name}_crop{suffix}").write_bytes(b"crop")
+
+def _tree(root):
+    for label in core.CLASSES_DISPONIBLES:
+        for i in range(3):
+            _pair(root / label, f"img{i}")
+
+def test_index_diff_reports_added_removed_and_rereads_changed_folders_only(storage, tmp_path, monkeypatch):
+    root = tmp_path / "racine"
+    _tree(root)
+    first, diff = core.refresh_directory_index(root)
+    assert len(first) == 3 * len(core.CLASSES_DISPONIBLES)
+    assert len(diff["ajoutees"]) == len(first) and diff["supprimees"] == []
+
+    first_label, second_label, third_label = core.CLASSES_DISPONIBLES[:3]
+    _pair(root / first_label, "nouvelle")
+    (root / second_label / "img1_bbox.png").unlink()
+    # Paire modifiée: même nom de base, crop remplacé par un autre format
+    (root / third_label / "img2_crop.png").unlink()
+    (root / third_label / "img2_crop.jpg").write_bytes(b"crop")
+
+    read = []
+    group = core.group_image_pairs
+    monkeypatch.setattr(core, "group_image_pairs", lambda names: read.append(sorted(names)) or group(names))
+    images_data, diff = core.refresh_directory_index(root)
+    assert diff == {"ajoutees": [(first_label, "nouvelle")], "supprimees": [(second_label, "img1")]}
+    # Le quatrième dossier, inchangé, est repris de l'index sans être relu
+    assert len(read) == 3
+    changed = images_data[images_data.position(core.image_key(third_label, "img2"))]
+    assert changed.crop_file == "img2_crop.jpg"
+
+    # Aucun changement: rien n'est relu
+    read.clear()
+    again, diff = core.refresh_directory_index(root)
+    assert diff == {"ajoutees": [], "supprimees": []} and read == []
+    assert again == images_data
+    assert again == core.scan_images_directory_full(root)
+
+def test_responses_follow_their_pair_when_positions_shift(storage, tmp_path):
+    root = tmp_path / "racine"
+    _tree(root)
+    images_data = core.scan_images_directory(root)
+    label = core.CLASSES_DISPONIBLES[0]
+    key = core.image_key(label, "img1")
+    responses = {key: {"label_choisi": label, "commentaire": "", "annotated": True, "ignored": False}}
+    core.write_snapshot("alice", str(root), responses, images_data.position(key), key, len(images_data))
+
+    # Une paire ajoutée peut décaler les positions (ordre de lecture du dossier), pas les clés
+    _pair(root / label, "img0a")
+    save_data, images_data, loaded = core.load_session("alice")
+    assert not save_data["legacy_keys"]
+    assert loaded[key]["label_choisi"] == label
+    assert images_data.key_of(images_data.position(key)) == key
+    assert sum(1 for response in loaded.values() if response["annotated"]) == 1
+    assert set(loaded) == {img["key"] for img in images_data}
+
+def test_positional_saves_are_migrated_to_keys(tmp_path):
+    root = tmp_path / "racine"
+    _tree(root)
+    images_data = core.scan_images_directory_full(root)
+    legacy = {"0": {"label_choisi": "a"}, 2: {"label_choisi": "b"}, "999": {"label_choisi": "perdu"}}
+    migrated = core.migrate_legacy_responses(legacy, images_data)
+    assert migrated == {images_data.key_of(0): {"label_choisi": "a"}, images_data.key_of(2): {"label_choisi": "b"}}
+
+def _walk_reference(root, max_depth):
+    """Paires attendues d'après os.walk (profondeur 1 = sous-dossiers de la racine)"""
+    expected = set()
+    for path, _, files in os.walk(root):
+        folder = os.path.relpath(path, root).replace(os.sep, "/")
+        if folder == "." or folder.count("/") + 1 > max_depth:
+            continue
+        expected.update((folder, base_name) for base_name, _, _ in core.group_image_pairs(files))
+    return expected
+
+def test_parallel_walk_matches_os_walk_at_each_depth(tmp_path):
+    root = tmp_path / "racine"
+    _tree(root)
+    for label in core.CLASSES_DISPONIBLES[:2]:
+        _pair(root / label / "lot1", "profonde")
+        _pair(root / label / "lot1" / "sous_lot", "tres_profonde")
+    # Moitié seule et fichier hors format: ignorés
+    (root / core.CLASSES_DISPONIBLES[0] / "seule_bbox.png").write_bytes(b"bbox")
+    (root / core.CLASSES_DISPONIBLES[0] / "notes.txt").write_text("x")
+
+    for max_depth in (1, 2, 3):
+        for workers in (1, 4):
+            walked = {(folder, base_name)
+                      for folder, _, pairs, _ in core.walk_image_folders(root, None, max_depth, workers)
+                      for base_name, _, _ in pairs}
+            assert walked == _walk_reference(root, max_depth)
+        catalogue = core.scan_images_directory_full(root, max_depth)
+        assert {(img.folder, img.base_name) for img in catalogue} == _walk_reference(root, max_depth)
+    assert core.image_key(f"{core.CLASSES_DISPONIBLES[0]}/lot1", "profonde") in \
+        {img["key"] for img in core.scan_images_directory_full(root, 2)}
+
+def _responses(images_data):
+    """Une paire annotée, une ignorée, les autres sans réponse"""
+    return {
+        images_data.key_of(0): {"label_choisi": core.CLASSES_DISPONIBLES[1], "commentaire": "vu, « net »",
+                                "annotated": True, "ignored": False},
+        images_data.key_of(1): {"label_choisi": None, "commentaire": "", "annotated": False, "ignored": True},
+    }
+
+def test_export_streams_csv_and_jsonl_rows(tmp_path):
+    root = tmp_path / "racine"
+    _tree(root)
+    images_data = core.scan_images_directory_full(root)
+    responses = _responses(images_data)
+    expected = list(core.export_rows(images_data, responses))
+    assert [row["statut"] for row in expected[:3]] == ["Annoté", "Ignoré", "Non annoté"]
+    assert expected[1]["label_choisi"] == "IGNORÉ"
+
+    path = core.export_annotations(images_data, responses, tmp_path / "export.csv", "csv")
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == core.EXPORT_COLUMNS
+    assert rows == [{name: "" if value is None else str(value) for name, value in row.items()} for row in expected]
+
+    path = core.export_annotations(images_data, responses, tmp_path / "export.jsonl", "jsonl")
+    assert [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()] == expected
+    assert [len(chunk) for chunk in core.iter_export_chunks(images_data, responses, chunk_size=5)] == [5, 5, 2]
+
+def test_failed_export_leaves_no_partial_file(tmp_path):
+    root = tmp_path / "racine"
+    _tree(root)
+    images_data = core.scan_images_directory_full(root)
+
+    class Failing(dict):
+        """Réponses dont la lecture échoue après quelques lignes"""
+        reads = 0
+
+        def get(self, key, default=None):
+            Failing.reads += 1
+            if Failing.reads > 3:
+                raise OSError("disque plein")
+            return default
+
+    target = tmp_path / "export.csv"
+    with pytest.raises(OSError):
+        core.export_annotations(images_data, Failing(), target, "csv")
+    assert not target.exists()
+    assert list(tmp_path.glob("export.csv*")) == []
+
+def _counters(stats):
+    return stats.total, stats.annotated, stats.ignored, stats.processed, stats.folders
+
+def test_running_counters_match_a_recount_after_random_changes(tmp_path):
+    root = tmp_path / "racine"
+    _tree(root)
+    _pair(root / core.CLASSES_DISPONIBLES[0] / "lot1", "profonde")
+    images_data = core.scan_images_directory_full(root, 2)
+    rng = random.Random(0)
+    states = [
+        core.empty_response(),
+        {"label_choisi": core.CLASSES_DISPONIBLES[2], "commentaire": "", "annotated": True, "ignored": False},
+        {"label_choisi": None, "commentaire": "", "annotated": False, "ignored": True},
+        {"label_choisi": core.CLASSES_DISPONIBLES[0], "commentaire": "à revoir", "annotated": False, "ignored": False},
+    ]
+    responses = {}
+    stats = core.AnnotationStats.from_responses(images_data, responses)
+    assert _counters(stats)[:4] == (len(images_data), 0, 0, 0)
+
+    for _ in range(200):
+        img = images_data[rng.randrange(len(images_data))]
+        before = responses.get(img["key"], {})
+        after = dict(rng.choice(states))
+        stats.record_change(img["folder"], before, after)
+        responses[img["key"]] = after
+        assert _counters(stats) == _counters(core.AnnotationStats.from_responses(images_data, responses))
+
+    # Recomptage direct, paire par paire; une réponse sans paire au catalogue n'est pas comptée
+    responses["absent/img9"] = states[1]
+    recount = core.AnnotationStats.from_responses(images_data, responses)
+    for folder, counts in recount.folders.items():
+        decisions = [responses.get(img["key"], {}) for img in images_data.folder_pairs(folder)]
+        assert counts == {"total": len(decisions),
+                          "annotated": sum(bool(d.get("annotated")) for d in decisions),
+                          "ignored": sum(bool(d.get("ignored")) for d in decisions)}
+    assert list(recount.folders) == images_data.folders()
+    assert _counters(recount) == _counters(stats)
+
+def _decision(label=None, ignored=False):
+    return {"label_choisi": label, "commentaire": "", "annotated": label is not None, "ignored": ignored}
+
+def test_merge_keeps_the_latest_decision_and_lists_conflicts():
+    a, b, c = core.CLASSES_DISPONIBLES[:3]
+    sessions = [
+        {"date_sauvegarde": "2026-01-02 10:00:00", "responses": {
+            "x/1": _decision(b), "x/2": _decision(a), "x/3": _decision(), "x/4": _decision(c)}},
+        {"date_sauvegarde": "2026-01-01 09:00:00", "responses": {
+            "x/1": _decision(a), "x/2": _decision(a), "x/3": _decision(c), "x/4": _decision(ignored=True)}},
+        {"date_sauvegarde": "2026-01-03 08:00:00", "responses": {
+            "x/1": _decision(), "x/5": _decision()}},
+    ]
+    merged, conflicts = core.merge_responses(sessions)
+    # La plus récente des réponses traitées l'emporte; une réponse vierge n'efface rien
+    assert merged["x/1"] == _decision(b)
+    assert merged["x/3"] == _decision(c)
+    assert merged["x/4"] == _decision(c)
+    assert merged["x/5"] == _decision()
+    assert conflicts == ["x/1", "x/4"]
+    # L'ordre des sauvegardes passées n'importe pas
+    assert core.merge_responses(sessions[::-1]) == (merged, conflicts)
+
+def test_catalogue_cache_scans_once_for_concurrent_sessions(storage, tmp_path, monkeypatch):
+    root = tmp_path / "racine"
+    _tree(root)
+    scans = []
+    scan = core.scan_images_directory
+
+    def slow_scan(root_dir, max_depth):
+        scans.append(root_dir)
+        # Scan assez long pour que toutes les sessions arrivent pendant qu'il tourne
+        time.sleep(0.2)
+        return scan(root_dir, max_depth)
+
+    monkeypatch.setattr(core, "scan_images_directory", slow_scan)
+    cache = core.CatalogueCache()
+    barrier = threading.Barrier(8)
+    results = []
+
+    def session():
+        barrier.wait()
+        results.append(cache.get(root))
+
+    threads = [threading.Thread(target=session) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(scans) == 1
+    assert all(catalogue is results[0] for catalogue in results)
+    assert cache.get(str(root)) is results[0] and len(scans) == 1
+
+    # Un dossier modifié invalide le catalogue partagé
+    _pair(root / core.CLASSES_DISPONIBLES[1], "nouvelle")
+    updated = cache.get(root)
+    assert len(scans) == 2 and updated is not results[0]
+    assert updated.position(core.image_key(core.CLASSES_DISPONIBLES[1], "nouvelle")) is not None
+    assert cache.get(root) is updated and len(scans) == 2
+
+    # mtime modifié sans ajout ni suppression: nouveau scan, même exemplaire partagé
+    folder = root / core.CLASSES_DISPONIBLES[2]
+    (folder / "notes.txt").write_text("x")
+    assert cache.get(root) is updated and len(scans) == 3
@@ -0,0 +1,43 @@
+import threading
+
+import annotation_core as core
+from annotation_store import AnnotationStore
+
+def _decision(label=None, ignored=False):
+    return {"label_choisi": label, "commentaire": "", "annotated": label is not None, "ignored": ignored}
+
+def test_concurrent_annotators_are_all_recorded(storage, tmp_path):
+    root = tmp_path / "racine"
+    folder = root / core.CLASSES_DISPONIBLES[0]
+    folder.mkdir(parents=True)
+    for i in range(40):
+        (folder / f"img{i}_bbox.png").touch()
+        (folder / f"img{i}_crop.png").touch()
+    images_data = core.scan_images_directory(root)
+    keys = [img["key"] for img in images_data]
+    store = AnnotationStore(storage / "annotations.sqlite")
+    a, b = core.CLASSES_DISPONIBLES[:2]
+
+    def annotate(name, label):
+        # Une écriture par réponse, comme l'application, depuis plusieurs threads à la fois
+        for key in keys[:30]:
+            store.record_responses(root, name, {key: _decision(label)})
+
+    threads = [threading.Thread(target=annotate, args=(name, label))
+               for name, label in (("alice", a), ("bob", a), ("carol", b))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    disagreements = store.disagreements(root)
+    assert [key for key, _ in disagreements] == sorted(keys[:30])
+    assert disagreements[0][1] == {"alice": a, "bob": a, "carol": b}
+    assert store.unlabelled_keys(root) == keys[30:]
+
+    # Décisions alignées et annulation: la paire n'est plus en désaccord, puis redevient à traiter
+    store.record_responses(root, "carol", {keys[0]: _decision(a), keys[1]: _decision()})
+    store.record_responses(root, "alice", {keys[1]: _decision()})
+    store.record_responses(root, "bob", {keys[1]: _decision()})
+    assert [key for key, _ in store.disagreements(root)] == sorted(keys[2:30])
+    assert store.unlabelled_keys(root) == [keys[1]] + keys[30:]
@@ -0,0 +1,51 @@
+import pytest
+
+import annotation_core as core
+from annotation_store import AnnotationStore
+
+@pytest.fixture
+def team(storage, tmp_path):
+    """Dossier de 6 paires synchronisé avec la table de distribution"""
+    root = tmp_path / "racine"
+    for i in range(6):
+        folder = root / core.CLASSES_DISPONIBLES[i % 2]
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"img{i}_bbox.png").touch()
+        (folder / f"img{i}_crop.png").touch()
+    core.scan_images_directory(root)
+    store = AnnotationStore(storage / "annotations.sqlite")
+    store.sync_dispatch(root)
+    return store, root
+
+def test_batches_do_not_overlap(team):
+    store, root = team
+    alice = store.lease_batch(root, "alice", batch_size=4)
+    bob = store.lease_batch(root, "bob", batch_size=4)
+    assert len(alice) == 4 and len(bob) == 2
+    assert not set(alice) & set(bob)
+    assert store.lease_batch(root, "carol", batch_size=4) == []
+    # Nouvelle demande: les baux en cours de l'annotateur sont rendus, sans doublon
+    assert sorted(store.lease_batch(root, "alice", batch_size=4)) == sorted(alice)
+
+def test_expired_leases_are_redistributed(team):
+    store, root = team
+    alice = store.lease_batch(root, "alice", batch_size=6, lease_seconds=-1)
+    assert len(alice) == 6
+    assert sorted(store.lease_batch(root, "bob", batch_size=6)) == sorted(alice)
+
+def test_released_and_decided_pairs(team):
+    store, root = team
+    alice = store.lease_batch(root, "alice", batch_size=3)
+    store.record_responses(root, "alice", {alice[0]: {"label_choisi": "faiencage", "annotated": True,
+                                                      "ignored": False, "commentaire": ""}})
+    store.release_leases(root, "alice")
+    bob = store.lease_batch(root, "bob", batch_size=6)
+    assert alice[0] not in bob
+    assert len(bob) == 5
+
+def test_overlap_gives_each_pair_to_two_annotators(team):
+    store, root = team
+    alice = store.lease_batch(root, "alice", batch_size=6, overlap_rate=1.0)
+    bob = store.lease_batch(root, "bob", batch_size=6, overlap_rate=1.0)
+    assert sorted(alice) == sorted(bob) and len(alice) == 6
+    assert store.lease_batch(root, "carol", batch_size=6, overlap_rate=1.0) == []
@@ -0,0 +1,26 @@
+import random
+
+import numpy as np
+import pytest
+
+from duplicates import find_near_duplicates
+
+def _brute_force(values, max_distance):
+    return {(i, j) for i in range(len(values)) for j in range(i + 1, len(values))
+            if bin(values[i] ^ values[j]).count("1") <= max_distance}
+
+@pytest.mark.parametrize("max_distance", [0, 1, 3])
+def test_multi_index_matches_brute_force(max_distance):
+    rng = random.Random(max_distance)
+    values = [rng.getrandbits(64) for _ in range(150)]
+    # Quasi-copies: quelques bits retournés, dans des blocs différents
+    for _ in range(150):
+        flipped = rng.choice(values)
+        for bit in rng.sample(range(64), rng.randint(0, 4)):
+            flipped ^= 1 << bit
+        values.append(flipped)
+    assert find_near_duplicates(values, max_distance) == _brute_force(values, max_distance)
+
+def test_distance_beyond_blocks_is_rejected():
+    with pytest.raises(ValueError):
+        find_near_duplicates(np.zeros(2, dtype=np.uint64), 4)
@@ -0,0 +1,54 @@
+import threading
+
+from instrumentation import Profiler
+
+def _run(profiler, session, enabled, barrier):
+    """Une exécution de script dans son propre thread, comme une session Streamlit"""
+    profiler.begin_run(session, "normal", enabled=enabled)
+    barrier.wait()
+    with profiler.stage("scan"):
+        profiler.count("images_decodees", 2)
+    profiler.start("vue_principale")
+    profiler.stop("vue_principale")
+    barrier.wait()
+    profiler.end_run()
+
+def test_runs_are_measured_per_thread(tmp_path):
+    profiler = Profiler(enabled=False, metrics_path=tmp_path / "metriques.prom")
+    barrier = threading.Barrier(4)
+    threads = [threading.Thread(target=_run, args=(profiler, session, enabled, barrier))
+               for session, enabled in (("alice", True), ("alice", True), ("bob", False), ("carol", None))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    alice = profiler.recent_runs("alice")
+    assert len(alice) == 2
+    assert all(set(run["etapes"]) == {"scan", "vue_principale"} for run in alice)
+    assert all(run["compteurs"] == {"images_decodees": 2} for run in alice)
+    # Exécutions non mesurées (explicitement, ou par défaut du profileur): rien d'enregistré
+    assert profiler.recent_runs("bob") == [] and profiler.recent_runs("carol") == []
+    # Hors exécution, le thread principal suit `enabled`
+    assert not profiler.active()
+
+    text = profiler.prometheus_text()
+    assert "annotation_reruns_total 2\n" in text
+    assert 'annotation_stage_calls_total{etape="scan"} 2\n' in text
+    assert 'annotation_events_total{compteur="images_decodees"} 4\n' in text
+    # Le premier end_run écrit le fichier de métriques
+    assert (tmp_path / "metriques.prom").read_text(encoding='utf-8').startswith("# HELP annotation_reruns_total")
+
+def test_rerun_closes_the_open_run_as_interrupted(tmp_path):
+    profiler = Profiler(enabled=True, metrics_path=tmp_path / "metriques.prom")
+    profiler.begin_run("alice", "normal")
+    profiler.count("sauvegardes_ecrites")
+    profiler.begin_run("alice", "rapide", enabled=False)
+    assert not profiler.active()
+    profiler.count("sauvegardes_ecrites")
+    profiler.end_run()
+    assert profiler.active()
+
+    (run,) = profiler.recent_runs("alice")
+    assert run["execution"] == "normal" and run["interrompue"]
+    assert 'annotation_events_total{compteur="sauvegardes_ecrites"} 1\n' in profiler.prometheus_text()
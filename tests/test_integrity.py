@@ -0,0 +1,31 @@
+from PIL import Image
+
+import annotation_core as core
+import integrity
+
+def test_report_flags_bad_pairs_and_rechecks_only_changed_files(storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(integrity, "SAVE_FOLDER", storage)
+    monkeypatch.setattr(integrity, "INTEGRITY_CACHE_FILE", storage / "integrite.sqlite")
+    folder = tmp_path / "racine" / "faiencage"
+    folder.mkdir(parents=True)
+    for i in range(3):
+        Image.new("RGB", (40, 30)).save(folder / f"img{i}_bbox.png")
+        Image.new("RGB", (12, 10)).save(folder / f"img{i}_crop.png")
+    (folder / "img1_crop.png").write_bytes(b"")
+    Image.new("RGB", (50, 10)).save(folder / "img2_crop.png")
+    Image.new("RGB", (40, 30)).save(folder / "seule_bbox.png")
+
+    images_data = core.scan_images_directory(tmp_path / "racine")
+    report = integrity.check_integrity(images_data, workers=2)
+    assert report["decodes"] == 6
+    assert report["invalides"] == {
+        "faiencage/img1": [["crop", "fichier vide"]],
+        "faiencage/img2": [["paire", "crop plus grand que la bbox (50x10 > 40x30)"]],
+    }
+    assert report["orphelines"] == ["faiencage/seule_bbox.png"]
+    assert integrity.load_report(tmp_path / "racine") == report
+
+    Image.new("RGB", (12, 10)).save(folder / "img1_crop.png")
+    report = integrity.check_integrity(images_data, workers=2)
+    assert report["decodes"] == 1
+    assert list(report["invalides"]) == ["faiencage/img2"]
@@ -0,0 +1,44 @@
+import annotation_core as core
+
+def _snapshot():
+    core.write_snapshot("testeur", "/tmp", {}, 0, None, 2)
+
+def test_replay_after_truncated_line(storage):
+    _snapshot()
+    core.append_journal_line("testeur", {"k": "a/img1", "f": {"label_choisi": "faiencage", "annotated": True}})
+    journal_path = core.get_journal_filepath("testeur")
+    # Écriture interrompue au milieu d'une ligne
+    with open(journal_path, 'ab') as f:
+        f.write(b'{"k":"a/img9","f":{"lab')
+    core.append_journal_line("testeur", {"k": "a/img2", "f": {"label_choisi": "fissure", "annotated": True}})
+
+    save_data, _ = core.load_progress("testeur")
+    assert save_data['journal_length'] == 2
+    assert save_data['responses']["a/img1"]["label_choisi"] == "faiencage"
+    assert save_data['responses']["a/img2"]["label_choisi"] == "fissure"
+    assert "a/img9" not in save_data['responses']
+
+def test_truncate_then_append(storage):
+    _snapshot()
+    core.append_journal_line("testeur", {"k": "a/img1", "f": {"annotated": True}})
+    journal_path = core.get_journal_filepath("testeur")
+    with open(journal_path, 'ab') as f:
+        f.write(b'{"k":"a/im')
+
+    save_data, _ = core.load_progress("testeur")
+    core.truncate_journal("testeur", save_data['journal_valid_bytes'])
+    assert journal_path.read_bytes().endswith(b"}\n")
+
+    core.append_journal_line("testeur", {"k": "a/img2", "f": {"annotated": True}, "i": 1, "ck": "a/img2"})
+    save_data, _ = core.load_progress("testeur")
+    assert save_data['journal_length'] == 2
+    assert save_data['current_key'] == "a/img2"
+    assert save_data['responses']["a/img2"]["annotated"]
+
+def test_snapshot_clears_journal(storage):
+    _snapshot()
+    core.append_journal_line("testeur", {"k": "a/img1", "f": {"annotated": True}})
+    _snapshot()
+    save_data, _ = core.load_progress("testeur")
+    assert save_data['journal_length'] == 0
+    assert save_data['journal_valid_bytes'] is None
@@ -0,0 +1,89 @@
+import json
+import os
+
+import annotation_core as core
+import materialize
+from materialize import CURRENT_NAME, DATASET_INFO_NAME, current_version, load_manifest, materialize_dataset
+
+def _session(storage, tmp_path, count=4):
+    root = tmp_path / "racine"
+    folder = root / "faiencage"
+    folder.mkdir(parents=True)
+    for i in range(count):
+        (folder / f"img{i}_bbox.png").write_bytes(b"bbox%d" % i)
+        (folder / f"img{i}_crop.png").write_bytes(b"crop%d" % i)
+    images_data = core.scan_images_directory(root)
+    responses = {img["key"]: {"label_choisi": "faiencage", "annotated": True, "ignored": False}
+                 for img in images_data}
+    return images_data, responses
+
+def _info(folder):
+    return json.loads((folder / DATASET_INFO_NAME).read_text(encoding='utf-8'))
+
+def test_second_run_is_a_no_op(storage, tmp_path):
+    images_data, responses = _session(storage, tmp_path)
+    dataset = tmp_path / "dataset"
+
+    first = materialize_dataset(images_data, responses, dataset, workers=2)
+    assert first == {"version": 1, "places": 8, "retires": 0, "inchanges": 0, "erreurs": 0}
+    assert current_version(dataset) == 1
+    current = dataset / CURRENT_NAME
+    assert _info(current)["version"] == 1 and _info(current)["paires_par_classe"]["faiencage"] == 4
+    # Clone ou copie par défaut: le jeu de données ne partage pas les fichiers sources
+    placed = current / "faiencage" / "faiencage__img0_crop.png"
+    assert placed.read_bytes() == b"crop0"
+    assert not os.path.samefile(placed, images_data[0]["crop_path"])
+
+    second = materialize_dataset(images_data, responses, dataset, workers=2)
+    assert second == {"version": 1, "places": 0, "retires": 0, "inchanges": 8, "erreurs": 0}
+    assert not (dataset / "v2").exists()
+
+def test_relabel_writes_a_new_version_and_keeps_the_previous_one(storage, tmp_path):
+    images_data, responses = _session(storage, tmp_path)
+    dataset = tmp_path / "dataset"
+    materialize_dataset(images_data, responses, dataset, workers=2)
+
+    key = images_data[0]["key"]
+    responses[key] = dict(responses[key], label_choisi="joint_ouvert")
+    responses[images_data[1]["key"]] = {"label_choisi": None, "annotated": False, "ignored": True}
+    counts = materialize_dataset(images_data, responses, dataset, workers=2)
+    assert counts == {"version": 2, "places": 2, "retires": 4, "inchanges": 4, "erreurs": 0}
+    current = dataset / CURRENT_NAME
+    assert os.readlink(current) == "v2"
+    assert sorted(p.name for p in (current / "joint_ouvert").iterdir()) == [
+        "faiencage__img0_bbox.png", "faiencage__img0_crop.png"]
+    assert len(load_manifest(current)) == 6
+    assert _info(current)["version"] == 2
+
+    # La version précédente reste intacte; les fichiers inchangés sont partagés entre versions
+    assert len(load_manifest(dataset / "v1")) == 8
+    assert len(list((dataset / "v1" / "faiencage").iterdir())) == 8
+    assert os.path.samefile(dataset / "v1" / "faiencage" / "faiencage__img3_crop.png",
+                            current / "faiencage" / "faiencage__img3_crop.png")
+
+def test_interrupted_version_is_resumed_and_published_once_complete(storage, tmp_path, monkeypatch):
+    images_data, responses = _session(storage, tmp_path)
+    dataset = tmp_path / "dataset"
+    place = materialize._materialize_one
+    calls = []
+
+    def failing(folder, relative, source, mode):
+        calls.append(relative)
+        if relative.endswith("img2_crop.png"):
+            raise OSError("disque plein")
+        return place(folder, relative, source, mode)
+
+    monkeypatch.setattr(materialize, "_materialize_one", failing)
+    errors = []
+    counts = materialize_dataset(images_data, responses, dataset, workers=2,
+                                 on_error=lambda relative, e: errors.append(relative))
+    assert counts["erreurs"] == 1 and counts["version"] is None
+    assert errors == ["faiencage/faiencage__img2_crop.png"]
+    assert current_version(dataset) is None and len(load_manifest(dataset / "v1")) == 7
+
+    monkeypatch.setattr(materialize, "_materialize_one", lambda *args: calls.append(args[1]) or place(*args))
+    calls.clear()
+    counts = materialize_dataset(images_data, responses, dataset, workers=2)
+    assert calls == ["faiencage/faiencage__img2_crop.png"]
+    assert counts == {"version": 1, "places": 8, "retires": 0, "inchanges": 0, "erreurs": 0}
+    assert current_version(dataset) == 1
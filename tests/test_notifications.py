@@ -0,0 +1,31 @@
+from notifications import (
+    SMTP_CONFIG,
+    FileDropTransport,
+    NotificationOutbox,
+    WebhookTransport,
+    default_transport,
+    make_transport,
+)
+
+def test_corrupt_messages_do_not_block_outbox(tmp_path):
+    outbox = NotificationOutbox(tmp_path / "outbox", FileDropTransport(tmp_path / "depot"))
+    (tmp_path / "outbox" / "tronque.json").write_text('{"subject": ', encoding='utf-8')
+    (tmp_path / "outbox" / "incomplet.json").write_text('{}', encoding='utf-8')
+    outbox.enqueue({"subject": "Fin", "body": "Terminé"})
+
+    assert outbox.deliver_due() is None
+    assert outbox.pending() == []
+    assert sorted(p.name for p in (tmp_path / "outbox" / "echecs").iterdir()) == ["incomplet.json", "tronque.json"]
+    assert len(list((tmp_path / "outbox" / "envoyes").iterdir())) == 1
+    assert len(list((tmp_path / "depot").glob("*.eml"))) == 1
+
+def test_notifications_are_disabled_without_a_receiver(monkeypatch):
+    config = {"sender": "annotation@example.org", "password": "secret", "receiver": None}
+    assert default_transport(config) is None
+    assert default_transport(dict(config, receiver="equipe@example.org")) == "smtp"
+    assert default_transport(dict(config, password=None, receiver="equipe@example.org")) == "fichier"
+
+    monkeypatch.setitem(SMTP_CONFIG, "receiver", None)
+    assert make_transport(None) is None
+    assert make_transport("smtp") is None and make_transport("fichier") is None
+    assert isinstance(make_transport("webhook"), WebhookTransport)
@@ -0,0 +1,51 @@
+import numpy as np
+
+import prelabel
+from annotation_core import CLASSES_DISPONIBLES
+from prelabel import PredictionStore, centroid_probabilities
+
+def _clusters(rng, per_class=6):
+    """Nuages bien séparés, un par classe"""
+    centres = np.eye(len(CLASSES_DISPONIBLES), 8, dtype=np.float32) * 4
+    features = np.concatenate([centre + rng.normal(0, 0.3, (per_class, 8)) for centre in centres])
+    labels = [label for label in CLASSES_DISPONIBLES for _ in range(per_class)]
+    return features.astype(np.float32), labels
+
+def test_mislabelled_example_does_not_attract_its_own_centroid():
+    rng = np.random.default_rng(0)
+    features, labels = _clusters(rng, per_class=3)
+    # Un exemple du deuxième nuage rangé dans le dossier de la première classe
+    features = np.vstack([features, features[3] + 0.01])
+    labels.append(CLASSES_DISPONIBLES[0])
+    probs = centroid_probabilities(features, labels)
+    assert int(np.argmax(probs[-1])) == 1
+
+def test_singleton_class_is_not_predicted_for_its_only_example():
+    rng = np.random.default_rng(1)
+    features, labels = _clusters(rng)
+    features = np.vstack([features, rng.normal(0, 0.3, (1, 8)).astype(np.float32)])
+    labels.append(CLASSES_DISPONIBLES[0])
+    labels[:6] = [None] * 6
+    probs = centroid_probabilities(features, labels)
+    # Sans autre exemple de sa classe, son propre dossier n'a aucune probabilité
+    assert probs[-1, 0] == 0.0
+    np.testing.assert_allclose(probs.sum(axis=1), 1.0, rtol=1e-6)
+
+def test_cache_reads_only_requested_digests_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(prelabel, "CACHE_QUERY_CHUNK", 3)
+    store = PredictionStore(tmp_path / "predictions.sqlite")
+    stats = {f"/crops/{i}.png": (i, 100 + i) for i in range(10)}
+    store.save_features(stats, [(path, f"sha{i}", np.full(4, i, dtype=np.float32))
+                                for i, path in enumerate(stats)])
+    store.save_probabilities("m", [(f"sha{i}", np.full(4, 0.25)) for i in range(10)])
+
+    # Un fichier modifié depuis (mtime différent) n'est pas reconnu
+    changed = dict(stats, **{"/crops/4.png": (99, 104)})
+    wanted = {path: changed[path] for path in list(changed)[2:9]}
+    assert store.known_digests(wanted) == {f"/crops/{i}.png": f"sha{i}" for i in (2, 3, 5, 6, 7, 8)}
+
+    features = store.features([f"sha{i}" for i in range(1, 8)] + ["inconnue"])
+    assert sorted(features) == [f"sha{i}" for i in range(1, 8)]
+    assert features["sha5"].tolist() == [5.0] * 4
+    assert sorted(store.probabilities("m", ["sha0", "sha9"])) == ["sha0", "sha9"]
+    assert store.probabilities("autre", ["sha0"]) == {}
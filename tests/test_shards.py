@@ -0,0 +1,39 @@
+import json
+
+from PIL import Image
+
+import annotation_core as core
+from shards import export_shards
+
+def _tree(root, count=6):
+    for i in range(count):
+        folder = root / core.CLASSES_DISPONIBLES[i % 2]
+        folder.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (40, 30), (i * 20, 0, 0)).save(folder / f"img{i:04d}_bbox.png")
+        Image.new("RGB", (12, 10), (0, i * 20, 0)).save(folder / f"img{i:04d}_crop.png")
+
+def test_tar_index_offsets_point_at_file_data(storage, tmp_path):
+    _tree(tmp_path / "racine")
+    # Nom de base au-delà des 100 caractères d'un en-tête tar ustar
+    folder = tmp_path / "racine" / core.CLASSES_DISPONIBLES[0]
+    long_name = "camera_" + "0123456789" * 12
+    Image.new("RGB", (40, 30)).save(folder / f"{long_name}_bbox.png")
+    Image.new("RGB", (12, 10)).save(folder / f"{long_name}_crop.png")
+    images_data = core.scan_images_directory(tmp_path / "racine")
+    responses = {img["key"]: {"label_choisi": img["label_initial"], "annotated": True, "ignored": False}
+                 for img in images_data}
+
+    index = export_shards(images_data, responses, tmp_path / "shards", "tar", with_bbox=True,
+                          max_bytes=600, workers=2)
+    assert index["echantillons"] == len(images_data)
+    assert len(index["shards"]) > 1
+    assert json.loads((tmp_path / "shards" / "index.json").read_text(encoding='utf-8')) == index
+
+    sources = {img["key"]: img for img in images_data}
+    for shard in index["shards"]:
+        data = (tmp_path / "shards" / shard["fichier"]).read_bytes()
+        for entry in shard["entrees"]:
+            for part in ("crop", "bbox"):
+                offset, size = entry[part]
+                with open(sources[entry["cle"]][f"{part}_path"], 'rb') as f:
+                    assert data[offset:offset + size] == f.read()
@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import annotation_core as core
+import similarity
+from prelabel import FEATURE_DIM, PredictionStore, compute_features
+from similarity import SimilarityIndex, embed
+
+def _tree(root, count=8, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        _write_pair(root, i, rng)
+
+def _write_pair(root, i, rng):
+    folder = root / core.CLASSES_DISPONIBLES[i % 2]
+    folder.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (40, 30)).save(folder / f"img{i:04d}_bbox.png")
+    Image.fromarray(rng.integers(0, 256, (24, 24, 3), dtype=np.uint8)).save(folder / f"img{i:04d}_crop.png")
+
+def _remove_pair(root, i):
+    folder = root / core.CLASSES_DISPONIBLES[i % 2]
+    for part in ("bbox", "crop"):
+        (folder / f"img{i:04d}_{part}.png").unlink()
+
+@pytest.fixture
+def index(storage, tmp_path):
+    root = tmp_path / "racine"
+    _tree(root)
+    store = PredictionStore(storage / "predictions.sqlite")
+    index = SimilarityIndex(root, folder=storage / "similarite")
+    assert index.update(core.scan_images_directory(root), store, workers=2) == (8, 0)
+    return root, store, index
+
+def _file_rows(index):
+    return index.vectors_path.stat().st_size // (FEATURE_DIM * 4)
+
+def _meta_rows(index):
+    return json.loads(index.meta_path.read_text(encoding='utf-8'))["rows"]
+
+def test_removed_pair_is_tombstoned_until_compaction(index):
+    root, store, index = index
+    _remove_pair(root, 3)
+    removed_key = f"{core.CLASSES_DISPONIBLES[1]}/img0003"
+    row = [key for key, _ in _meta_rows(index)].index(removed_key)
+    assert index.update(core.scan_images_directory(root), store, workers=2) == (0, 1)
+
+    # Une ligne morte sur huit: pas de compactage, la ligne reste dans le fichier
+    assert _file_rows(index) == 8
+    assert _meta_rows(index)[row] is None
+    assert len(index) == 7 and removed_key not in index
+    with pytest.raises(LookupError):
+        index.neighbours(removed_key)
+    assert removed_key not in [key for key, _ in index.neighbours(f"{core.CLASSES_DISPONIBLES[0]}/img0000", 10)]
+
+    # Un crop modifié: ancienne ligne morte, nouvelle ligne en fin de fichier
+    _write_pair(root, 5, np.random.default_rng(42))
+    assert index.update(core.scan_images_directory(root), store, workers=2) == (1, 1)
+    reopened = SimilarityIndex(root, folder=index.vectors_path.parent)
+    assert _file_rows(reopened) == 9
+    assert [row is None for row in _meta_rows(reopened)].count(True) == 2
+    assert len(reopened) == 7
+
+def test_compaction_once_a_quarter_of_rows_are_dead(index):
+    root, store, index = index
+    for i in (1, 2, 4):
+        _remove_pair(root, i)
+    # Trois lignes mortes sur huit: au-delà du quart, le fichier est réécrit
+    assert 3 > similarity.COMPACT_DEAD_RATIO * 8
+    assert index.update(core.scan_images_directory(root), store, workers=2) == (0, 3)
+    assert _file_rows(index) == 5
+    assert None not in _meta_rows(index)
+    reopened = SimilarityIndex(root, folder=index.vectors_path.parent)
+    assert len(reopened) == 5
+    assert len(reopened.neighbours(f"{core.CLASSES_DISPONIBLES[0]}/img0000", 10)) == 4
+
+def test_neighbours_match_brute_force_cosine(index, monkeypatch):
+    root, store, index = index
+    # Requête par blocs plus petits que l'index
+    monkeypatch.setattr(similarity, "QUERY_CHUNK_ROWS", 3)
+    images_data = core.scan_images_directory(root)
+    features = compute_features([img["crop_path"] for img in images_data], store, workers=2)
+    keys = [img["key"] for img in images_data]
+    vectors = embed(np.stack([features[img["crop_path"]][1] for img in images_data]))
+
+    for row, key in enumerate(keys):
+        scores = vectors @ vectors[row]
+        expected = sorted((i for i in range(len(keys)) if i != row), key=lambda i: -scores[i])[:5]
+        neighbours = index.neighbours(key, 5)
+        assert [k for k, _ in neighbours] == [keys[i] for i in expected]
+        np.testing.assert_allclose([s for _, s in neighbours], scores[expected], rtol=1e-5)
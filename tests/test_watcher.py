@@ -0,0 +1,80 @@
+import os
+
+import pytest
+from PIL import Image
+
+import annotation_core as core
+import watcher as watcher_module
+from watcher import DirectoryWatcher, WatcherRegistry
+
+def _save(folder, name):
+    folder.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (8, 8)).save(folder / name)
+
+def _tree(root, count=4):
+    for i in range(count):
+        folder = root / core.CLASSES_DISPONIBLES[i % 2]
+        _save(folder, f"img{i:04d}_bbox.png")
+        _save(folder, f"img{i:04d}_crop.png")
+
+@pytest.fixture
+def catalogue(tmp_path, monkeypatch):
+    # Relevé périodique: les fichiers venant d'être écrits sont pris en compte tout de suite
+    monkeypatch.setattr(watcher_module, "WATCH_SETTLE_SECONDS", 0)
+    _tree(tmp_path / "racine")
+    return core.scan_images_directory(tmp_path / "racine")
+
+def test_polling_tracks_half_pairs_and_apply_resets_counts(catalogue, tmp_path):
+    root = tmp_path / "racine"
+    folder = root / core.CLASSES_DISPONIBLES[0]
+    watcher = DirectoryWatcher(catalogue)
+    watcher.poll_once()
+    assert watcher.status(catalogue) == (0, 0, 0)
+
+    # Une moitié seule reste en attente
+    _save(folder, "nouvelle_bbox.png")
+    watcher.poll_once()
+    assert watcher.status(catalogue) == (0, 0, 1)
+
+    # Son partenaire arrive: la paire est ajoutée
+    _save(folder, "nouvelle_crop.png")
+    watcher.poll_once()
+    assert watcher.status(catalogue) == (1, 0, 0)
+
+    for part in ("bbox", "crop"):
+        os.unlink(folder / f"img0000_{part}.png")
+    watcher.poll_once()
+    assert watcher.status(catalogue) == (1, 1, 0)
+
+    updated = watcher.apply()
+    assert updated is not catalogue
+    assert watcher.status(updated) == (0, 0, 0)
+    assert watcher.status(catalogue) is None
+    new_key = core.image_key(core.CLASSES_DISPONIBLES[0], "nouvelle")
+    assert updated.position(new_key) is not None
+    assert updated.position(core.image_key(core.CLASSES_DISPONIBLES[0], "img0000")) is None
+    assert {img["key"] for img in updated} == {img["key"] for img in core.scan_images_directory(root)}
+
+def test_registry_stops_a_watcher_once_no_session_uses_it(catalogue, tmp_path):
+    other_root = tmp_path / "autre"
+    _tree(other_root, 2)
+    other = core.scan_images_directory(other_root)
+    registry = WatcherRegistry()
+    try:
+        first = registry.acquire("a", catalogue)
+        assert registry.acquire("b", catalogue) is first
+        assert first._thread.is_alive()
+
+        # "a" change de dossier: "b" suit encore le premier
+        second = registry.acquire("a", other)
+        assert second is not first and len(registry) == 2
+        assert first._thread.is_alive()
+
+        registry.release("b")
+        assert not first._thread.is_alive()
+        assert len(registry) == 1
+        # Une nouvelle session sur ce dossier obtient une surveillance neuve
+        assert registry.acquire("c", catalogue) is not first
+    finally:
+        registry.close()
+    assert not second._thread.is_alive()
@@ -0,0 +1,436 @@
+"""
+Surveillance d'un dossier racine pendant l'annotation
+Les paires ajoutées ou supprimées sont suivies par rapport à un catalogue de
+référence, sans rescan: inotify sous Linux (fichier compté une fois fermé
+en écriture ou déplacé dans le dossier), sinon relevé périodique des mtime
+des dossiers. Une paire dont une seule moitié (_bbox ou _crop) est présente
+reste en attente. Aucune dépendance à Streamlit.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from annotation_core import SCAN_MAX_DEPTH, image_key, split_image_name
+
+WATCH_POLL_SECONDS = 5
+# Relevé périodique: un fichier modifié depuis moins longtemps est peut-être en cours d'écriture
+WATCH_SETTLE_SECONDS = 2
+
+# Constantes de <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+def _folder_depth(folder):
+    return 0 if folder == "" else folder.count("/") + 1
+
+def _child_folder(folder, name):
+    return name if folder == "" else f"{folder}/{name}"
+
+class _Inotify:
+    """Accès minimal à inotify via la libc (ctypes)"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or libc_name is None:
+            raise OSError("inotify indisponible sur cette plateforme")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {path}")
+        return wd
+
+    def read_events(self, timeout):
+        """Événements (wd, mask, name) disponibles dans `timeout` secondes"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class DirectoryWatcher:
+    """
+    Suit les changements d'un dossier racine par rapport au catalogue `base`
+    added: clés des paires complètes absentes du catalogue
+    removed: clés du catalogue dont une moitié (ou les deux) a disparu
+    halves: clés dont une seule moitié est présente (paire en cours de dépôt)
+    Seules les paires touchées depuis le catalogue sont gardées en mémoire.
+    """
+
+    def __init__(self, catalogue, max_depth=SCAN_MAX_DEPTH, poll_seconds=WATCH_POLL_SECONDS):
+        self.root = catalogue.root
+        self.max_depth = max_depth
+        self.poll_seconds = poll_seconds
+        self.base = catalogue
+        self.mode = None
+        self.added = set()
+        self.removed = set()
+        self.halves = set()
+        self._touched = {}
+        # Dossiers à relire: fichiers encore en cours d'écriture lors du dernier passage
+        self._unsettled = set()
+        self._watch_folder = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # mtime des dossiers lors de la construction du catalogue: seuls ceux
+        # qui ont changé depuis sont relus au démarrage
+        if catalogue.fingerprint is not None:
+            self._folder_mtimes = dict(catalogue.fingerprint)
+        else:
+            self._folder_mtimes = {"": None}
+            for folder in catalogue.folders():
+                self._folder_mtimes[folder] = self._stat_mtime(folder)
+
+    def _path(self, folder):
+        return os.path.join(self.root, folder)
+
+    def _stat_mtime(self, folder):
+        try:
+            return os.stat(self._path(folder)).st_mtime_ns
+        except OSError:
+            return None
+
+    # ----- état des paires -----
+
+    def _entry(self, folder, base_name):
+        key = (folder, base_name)
+        entry = self._touched.get(key)
+        if entry is None:
+            position = self.base.position(image_key(folder, base_name))
+            if position is None:
+                entry = {"bbox": None, "crop": None}
+            else:
+                record = self.base[position]
+                entry = {"bbox": record.bbox_file, "crop": record.crop_file}
+            self._touched[key] = entry
+        return entry
+
+    def _update(self, folder, base_name):
+        key = (folder, base_name)
+        entry = self._touched[key]
+        present = (entry["bbox"] is not None) + (entry["crop"] is not None)
+        in_base = self.base.position(image_key(folder, base_name)) is not None
+
+        for target, member in ((self.added, present == 2 and not in_base),
+                               (self.removed, present < 2 and in_base),
+                               (self.halves, present == 1)):
+            if member:
+                target.add(key)
+            else:
+                target.discard(key)
+        if (present == 2 and in_base) or (present == 0 and not in_base):
+            # Rien ne distingue plus la paire du catalogue
+            del self._touched[key]
+
+    def file_added(self, folder, file_name):
+        parsed = split_image_name(file_name)
+        if folder == "" or parsed is None or parsed[1] is None:
+            return
+        base_name, kind = parsed
+        with self._lock:
+            self._entry(folder, base_name)[kind] = file_name
+            self._update(folder, base_name)
+
+    def file_removed(self, folder, file_name):
+        parsed = split_image_name(file_name)
+        if folder == "" or parsed is None or parsed[1] is None:
+            return
+        base_name, kind = parsed
+        with self._lock:
+            entry = self._entry(folder, base_name)
+            if entry[kind] == file_name:
+                entry[kind] = None
+            self._update(folder, base_name)
+
+    def _known_files(self, folder):
+        """Fichiers du dossier tels que connus (catalogue + changements suivis)"""
+        files = set()
+        for record in self.base.folder_pairs(folder):
+            if (folder, record.base_name) not in self._touched:
+                files.update((record.bbox_file, record.crop_file))
+        for (touched_folder, _), entry in self._touched.items():
+            if touched_folder == folder:
+                files.update(f for f in entry.values() if f is not None)
+        return files
+
+    def sync_folder(self, folder):
+        """
+        Relit un dossier et rapproche son contenu de l'état suivi
+        Retourne False si des fichiers trop récents ont été laissés de côté.
+        """
+        current = set()
+        subdirs = []
+        settled = True
+        limit = time.time() - WATCH_SETTLE_SECONDS
+        try:
+            with os.scandir(self._path(folder)) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    else:
+                        parsed = split_image_name(entry.name)
+                        if parsed is not None and parsed[1] is not None:
+                            current.add(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            # Dossier supprimé: ses paires (et celles de ses sous-dossiers) disparaissent
+            with self._lock:
+                for other in [f for f in self._folder_mtimes if f == folder or f.startswith(f"{folder}/")]:
+                    for file_name in self._known_files(other):
+                        self.file_removed(other, file_name)
+                    if other:
+                        del self._folder_mtimes[other]
+            return True
+
+        with self._lock:
+            known = self._known_files(folder) if folder else set()
+            for file_name in known - current:
+                self.file_removed(folder, file_name)
+            for file_name in current - known:
+                try:
+                    if os.stat(os.path.join(self._path(folder), file_name)).st_mtime > limit:
+                        settled = False
+                        continue
+                except FileNotFoundError:
+                    continue
+                self.file_added(folder, file_name)
+
+        if _folder_depth(folder) < self.max_depth:
+            for name in subdirs:
+                child = _child_folder(folder, name)
+                if child not in self._folder_mtimes:
+                    self._new_folder(child)
+        return settled
+
+    def _new_folder(self, folder):
+        """Dossier apparu pendant la surveillance"""
+        with self._lock:
+            self._folder_mtimes[folder] = None
+        if self._watch_folder is not None:
+            self._watch_folder(folder)
+
+    def poll_once(self):
+        """Relit les dossiers dont le mtime a changé (mode relevé, resynchronisation)"""
+        for folder in list(self._folder_mtimes):
+            mtime_ns = self._stat_mtime(folder)
+            if mtime_ns is not None and mtime_ns == self._folder_mtimes.get(folder):
+                continue
+            if self.sync_folder(folder):
+                self._unsettled.discard(folder)
+                if folder in self._folder_mtimes:
+                    self._folder_mtimes[folder] = mtime_ns
+            else:
+                self._unsettled.add(folder)
+
+    def _resync_unsettled(self):
+        for folder in list(self._unsettled):
+            if self.sync_folder(folder):
+                self._unsettled.discard(folder)
+
+    # ----- catalogue -----
+
+    def status(self, catalogue):
+        """(ajoutées, supprimées, incomplètes) par rapport à `catalogue`, ou None si ce n'est pas la référence"""
+        with self._lock:
+            if catalogue is not self.base:
+                return None
+            return len(self.added), len(self.removed), len(self.halves)
+
+    def rebase(self, catalogue):
+        """Prend `catalogue` comme nouvelle référence (les paires incomplètes restent suivies)"""
+        with self._lock:
+            self.base = catalogue
+            self.added.clear()
+            self.removed.clear()
+            self.halves.clear()
+            for folder, base_name in list(self._touched):
+                self._update(folder, base_name)
+
+    def apply(self):
+        """Catalogue de référence mis à jour des changements suivis (sans rescan), qui devient la référence"""
+        with self._lock:
+            if not self.added and not self.removed:
+                return self.base
+            added = [
+                (folder, base_name, self._touched[(folder, base_name)]["bbox"],
+                 self._touched[(folder, base_name)]["crop"])
+                for folder, base_name in sorted(self.added)
+            ]
+            removed = {image_key(folder, base_name) for folder, base_name in self.removed}
+            self.rebase(self.base.updated(added, removed))
+            return self.base
+
+    # ----- thread de surveillance -----
+
+    def start(self):
+        """Démarre la surveillance (inotify si possible, sinon relevé périodique)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            try:
+                inotify = _Inotify()
+            except OSError:
+                inotify = None
+            self.mode = "inotify" if inotify is not None else "relevé"
+            self._thread = threading.Thread(target=self._run, args=(inotify,), name="watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Arrête la surveillance et attend la fin du thread (descripteur inotify fermé)"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self, inotify):
+        if inotify is None:
+            self._run_polling()
+            return
+        try:
+            self._run_inotify(inotify)
+        except OSError:
+            # Limite de surveillances atteinte, dossier sur un montage non supporté...
+            self.mode = "relevé"
+            self._run_polling()
+        finally:
+            inotify.close()
+
+    def _run_polling(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except OSError:
+                pass
+            self._stop.wait(self.poll_seconds)
+
+    def _run_inotify(self, inotify):
+        folders = {}
+
+        def watch(folder):
+            folders[inotify.add_watch(self._path(folder))] = folder
+
+        for folder in list(self._folder_mtimes):
+            try:
+                watch(folder)
+            except FileNotFoundError:
+                continue
+        self._watch_folder = watch
+        # Changements survenus avant la pose des surveillances
+        self.poll_once()
+
+        while not self._stop.is_set():
+            self._resync_unsettled()
+            for wd, mask, name in inotify.read_events(timeout=1.0):
+                if mask & IN_Q_OVERFLOW:
+                    # Événements perdus: resynchronisation complète par mtime
+                    for folder in self._folder_mtimes:
+                        self._folder_mtimes[folder] = None
+                    self.poll_once()
+                    continue
+                folder = folders.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del folders[wd]
+                    continue
+                if mask & IN_ISDIR:
+                    child = _child_folder(folder, name)
+                    if mask & (IN_CREATE | IN_MOVED_TO) and _folder_depth(folder) < self.max_depth:
+                        if child not in self._folder_mtimes:
+                            self._new_folder(child)
+                        # Des fichiers ont pu y être écrits avant la surveillance
+                        if not self.sync_folder(child):
+                            self._unsettled.add(child)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM) and child in self._folder_mtimes:
+                        self.sync_folder(child)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.file_added(folder, name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.file_removed(folder, name)
+
+class WatcherRegistry:
+    """
+    Surveillances partagées entre sessions, une par dossier racine
+    Une session suit un seul dossier à la fois: quand elle en change ou
+    s'en détache, la surveillance qu'elle quitte est arrêtée si aucune autre
+    session ne l'utilise.
+    """
+
+    def __init__(self, factory=DirectoryWatcher):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._watchers = {}
+        self._root_of = {}
+
+    def __len__(self):
+        return len(self._watchers)
+
+    def _detach(self, session):
+        """Retire la session; retourne la surveillance devenue inutilisée (ou None)"""
+        root = self._root_of.pop(session, None)
+        if root is None or root in self._root_of.values():
+            return None
+        return self._watchers.pop(root, None)
+
+    def acquire(self, session, catalogue):
+        """Surveillance du dossier du catalogue pour `session` (démarrée au premier appel)"""
+        unused = None
+        with self._lock:
+            if self._root_of.get(session) != catalogue.root:
+                unused = self._detach(session)
+                self._root_of[session] = catalogue.root
+            watcher = self._watchers.get(catalogue.root)
+            if watcher is None:
+                watcher = self._watchers[catalogue.root] = self._factory(catalogue)
+                watcher.start()
+        # Attente du thread hors du verrou: les autres sessions ne sont pas bloquées
+        if unused is not None:
+            unused.stop()
+        return watcher
+
+    def release(self, session):
+        """La session ne surveille plus de dossier"""
+        with self._lock:
+            unused = self._detach(session)
+        if unused is not None:
+            unused.stop()
+
+    def close(self):
+        """Arrête toutes les surveillances"""
+        with self._lock:
+            watchers = list(self._watchers.values())
+            self._watchers.clear()
+            self._root_of.clear()
+        for watcher in watchers:
+            watcher.stop()